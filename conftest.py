@@ -0,0 +1,11 @@
+import pytest
+from django.test.utils import override_settings
+
+from yatube.test_runner import TEST_SETTINGS
+
+
+@pytest.fixture(autouse=True, scope='session')
+def test_settings():
+    """Те же тестовые настройки, что у manage.py test."""
+    with override_settings(**TEST_SETTINGS):
+        yield
@@ -1,9 +1,71 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db.models import Max
+from django.utils.functional import cached_property
 
 from .models import Comment, Follow, Group, Post
 
 
-class PostAdmin(admin.ModelAdmin):
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор админки без точного COUNT(*) по большим таблицам.
+
+    Без фильтров число строк оценивается по MAX(pk) (один шаг по
+    индексу), с фильтрами считается не дальше ADMIN_COUNT_LIMIT.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            return queryset.aggregate(last=Max('pk'))['last'] or 0
+        return queryset.order_by()[:settings.ADMIN_COUNT_LIMIT].count()
+
+
+class InputFilter(admin.SimpleListFilter):
+    """Фильтр-поле ввода вместо списка всех значений в сайдбаре."""
+
+    template = 'admin/input_filter.html'
+    lookup = None
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.lookup: self.value()})
+        return queryset
+
+    def choices(self, changelist):
+        yield {
+            'query_parts': [
+                (key, value) for key, value in changelist.params.items()
+                if key not in (self.parameter_name, 'p')
+            ],
+        }
+
+
+class FollowerFilter(InputFilter):
+    title = 'подписчику'
+    parameter_name = 'user'
+    lookup = 'user__username'
+
+
+class FollowingFilter(InputFilter):
+    title = 'автору'
+    parameter_name = 'author'
+    lookup = 'author__username'
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class PostAdmin(LargeTableAdmin):
     list_display = (
         'pk',
         'text',
@@ -12,6 +74,8 @@ class PostAdmin(admin.ModelAdmin):
         'group',
     )
     list_editable = ('group',)
+    list_select_related = ('author', 'group')
+    autocomplete_fields = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
@@ -28,9 +92,11 @@ class CommentAdmin(admin.ModelAdmin):
     list_display = ("text",)
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(LargeTableAdmin):
     list_display = ('user', 'author', 'id')
-    list_filter = ('user', 'author')
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+    list_filter = (FollowerFilter, FollowingFilter)
     search_fields = ('user__username', 'author__username')
 
 
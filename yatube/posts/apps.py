@@ -3,3 +3,13 @@ from django.apps import AppConfig
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        from django.conf import settings
+        from PIL import Image
+
+        from . import signals  # noqa: F401
+
+        # Pillow сам отказывается открывать картинки вдвое больше лимита,
+        # в том числе в фоновых задачах и в миниатюрах sorl.
+        Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
@@ -0,0 +1,180 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import prefetch_related_objects
+from django.http import Http404
+from django.utils import timezone
+
+from . import search, shards
+from .cache import bump_posts_generations
+from .models import (ArchivedComment, ArchivedPost, Comment, ImageVariant,
+                     Post, TimelineEntry)
+
+ARCHIVE_MODELS = (ArchivedPost, ArchivedComment)
+# Поля, которые переезжают в архив как есть.
+POST_FIELDS = (
+    'id', 'text', 'pub_date', 'author_id', 'group_id', 'image',
+    'image_width', 'image_height', 'image_size', 'image_format',
+    'image_placeholder', 'comments_count',
+)
+COMMENT_FIELDS = ('post_id', 'author_id', 'text', 'created')
+# Строки горячих таблиц, которые уходят вместе с постом, по порядку
+# удаления: сначала зависимые, потом сами посты.
+HOT_ROWS = (
+    (Comment, 'post_id'),
+    (ImageVariant, 'post_id'),
+    (TimelineEntry, 'post_id'),
+    (Post, 'id'),
+)
+
+
+def archive_database():
+    return settings.POST_ARCHIVE_DATABASE
+
+
+def hot_databases():
+    """Базы, где лежат горячие посты: шарды или default."""
+    return settings.POST_SHARDS or (DEFAULT_DB_ALIAS,)
+
+
+def archive_cutoff(days=None):
+    if days is None:
+        days = settings.POST_ARCHIVE_AFTER_DAYS
+    return timezone.now() - timedelta(days=days)
+
+
+def _copy(model, row, fields):
+    values = {field: getattr(row, field) for field in fields}
+    if 'image' in values:
+        # FieldFile, отданный другой модели, перепривязался бы к ней.
+        values['image'] = values['image'].name
+    return model(**values)
+
+
+def _delete_rows(using, tables, pks):
+    # Пост не удалён, а переехал: сигналы удаления (счётчики автора,
+    # ссылки на файлы) срабатывать не должны, поэтому запрос прямой.
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connections[using].cursor() as cursor:
+        for table, column in tables:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE {column} IN ({placeholders})',
+                pks,
+            )
+
+
+def archive_batch(using, cutoff, batch_size=None):
+    """Переносит в архив до batch_size самых старых постов базы using,
+    опубликованных раньше cutoff, с их комментариями.
+
+    Копия в архиве фиксируется раньше удаления: при сбое пост остаётся
+    в обеих базах, и повторный запуск перезапишет его архивную копию.
+    Возвращает (постов, комментариев).
+    """
+    if batch_size is None:
+        batch_size = settings.POST_ARCHIVE_BATCH_SIZE
+    archive = archive_database()
+    with transaction.atomic(using=using):
+        with transaction.atomic(using=archive):
+            posts = list(
+                Post.objects.using(using).filter(pub_date__lt=cutoff)
+                .order_by('pub_date', 'pk')[:batch_size]
+            )
+            if not posts:
+                return 0, 0
+            pks = [post.pk for post in posts]
+            comments = list(
+                Comment.objects.using(using).filter(post_id__in=pks)
+            )
+            _delete_rows(archive, (
+                (ArchivedComment._meta.db_table, 'post_id'),
+                (ArchivedPost._meta.db_table, 'id'),
+            ), pks)
+            ArchivedPost.objects.using(archive).bulk_create(
+                _copy(ArchivedPost, post, POST_FIELDS) for post in posts
+            )
+            ArchivedComment.objects.using(archive).bulk_create(
+                (_copy(ArchivedComment, comment, COMMENT_FIELDS)
+                 for comment in comments),
+                batch_size=batch_size,
+            )
+        _delete_rows(using, (
+            (model._meta.db_table, column) for model, column in HOT_ROWS
+        ), pks)
+        # Поиск работает по горячим постам.
+        for pk in pks:
+            search.unindex_post(pk)
+        transaction.on_commit(
+            lambda: bump_posts_generations(posts), using=using
+        )
+    return len(posts), len(comments)
+
+
+def archive_posts(using, cutoff, batch_size=None):
+    """archive_batch, пока в базе есть посты старше cutoff. Каждая
+    пачка — своя короткая транзакция, чтобы не держать запись."""
+    posts = comments = 0
+    while True:
+        moved_posts, moved_comments = archive_batch(
+            using, cutoff, batch_size
+        )
+        if not moved_posts:
+            return posts, comments
+        posts += moved_posts
+        comments += moved_comments
+
+
+def delete_user_rows(user_id):
+    """Каскад удаления пользователя в отдельном архиве: каскад default
+    туда не доходит. Архив в default удаляется обычным каскадом."""
+    if not shards.is_detached(archive_database()):
+        return
+    ArchivedComment.objects.filter(author_id=user_id).delete()
+    ArchivedPost.objects.filter(author_id=user_id).delete()
+
+
+def detach_group(group_id):
+    """SET_NULL для архивных постов удаляемой группы."""
+    if shards.is_detached(archive_database()):
+        ArchivedPost.objects.filter(group_id=group_id).update(group=None)
+
+
+def get_post_or_archived_404(post_id, *related):
+    """Горячий пост, а если его уже перенесли — архивный."""
+    try:
+        return shards.get_post_or_404(post_id, *related)
+    except Http404:
+        post = ArchivedPost.objects.filter(pk=post_id).first()
+        if post is None:
+            raise
+    prefetch_related_objects([post], *related)
+    return post
+
+
+def with_archive(posts, author):
+    """Посты автора вместе с архивными, если они есть.
+
+    Архив старше любого горячего поста, но страницы всё равно
+    собираются слиянием по (pub_date, pk), как лента со всех шардов.
+    """
+    archived = ArchivedPost.objects.filter(author=author)
+    if not archived.exists():
+        return posts
+    return shards.ShardedQuery(
+        lambda queryset: queryset,
+        sources=(posts, shards.with_related(archived, 'group')),
+    )
+
+
+class ArchiveRouter:
+    """Архивные таблицы живут в POST_ARCHIVE_DATABASE, и читаются они
+    тоже оттуда: на репликах и шардах архива нет."""
+
+    def _db_for(self, model, **hints):
+        if model in ARCHIVE_MODELS:
+            return archive_database()
+        return None
+
+    db_for_read = _db_for
+    db_for_write = _db_for
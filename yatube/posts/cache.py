@@ -0,0 +1,92 @@
+import time
+from hashlib import md5
+
+from django.core.cache import cache
+
+GENERATION_PREFIX = 'generation'
+ARTICLE_PREFIX = 'article'
+
+
+def generation_key(scope, pk=None):
+    if pk is None:
+        return f'{GENERATION_PREFIX}:{scope}'
+    return f'{GENERATION_PREFIX}:{scope}:{pk}'
+
+
+def _initial_generation():
+    # Миллисекунды вместо единицы: если ключ вытеснят из кэша,
+    # новое поколение не совпадёт ни с одним из старых.
+    return int(time.time() * 1000)
+
+
+def get_generation(*scopes):
+    """Возвращает строку поколений для ключа фрагментного кэша.
+
+    Каждый scope — ('index',), ('group', pk) или ('author', pk).
+    Все поколения читаются одним get_many.
+    """
+    keys = [generation_key(*scope) for scope in scopes]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, _initial_generation(), None)
+            generations[key] = cache.get(key)
+    return '-'.join(str(generations[key]) for key in keys)
+
+
+def bump_generation(scope, pk=None):
+    """Делает устаревшими все фрагменты, построенные на этом scope."""
+    key = generation_key(scope, pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_generation(), None)
+
+
+def bump_post_generations(author_id, *group_ids):
+    bump_generation('index')
+    bump_generation('author', author_id)
+    for group_id in set(group_ids):
+        if group_id is not None:
+            bump_generation('group', group_id)
+
+
+def bump_posts_generations(posts):
+    """bump_post_generations для пачки постов: каждый автор и группа
+    сбрасываются один раз."""
+    bump_generation('index')
+    for author_id in {post.author_id for post in posts}:
+        bump_generation('author', author_id)
+    for group_id in {post.group_id for post in posts} - {None}:
+        bump_generation('group', group_id)
+
+
+def post_version(post):
+    """Отпечаток всего, что попадает в карточку поста."""
+    group = post.group
+    state = (
+        post.text,
+        post.pub_date.isoformat(),
+        str(post.image),
+        post.image_ready,
+        post.image_placeholder,
+        post.comments_count,
+        post.author.username,
+        post.author.get_full_name(),
+        group and (group.slug, group.title),
+    )
+    return md5(repr(state).encode()).hexdigest()
+
+
+def article_key(post, variant):
+    return f'{ARTICLE_PREFIX}:{variant}:{post.pk}:{post_version(post)}'
+
+
+def forget_articles(posts):
+    """Удаляет закэшированные карточки постов во всех вариантах."""
+    cache.delete_many([
+        article_key(post, f'{check_author}{check_group}')
+        for post in posts
+        for check_author in (0, 1)
+        for check_group in (0, 1)
+    ])
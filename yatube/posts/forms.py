@@ -1,9 +1,37 @@
-from django.forms import ModelForm
+from django.forms import ModelForm, ValidationError
 
+from .images import image_limits_error
 from .models import Comment, Post
+from .uploads import get_finished_upload, open_upload
 
 
 class PostForm(ModelForm):
+    """Картинка приходит либо файлом в самой форме, либо токеном
+    загрузки кусками (``upload_token``) — тогда форма берёт уже
+    проверенный файл с диска."""
+
+    def __init__(self, *args, upload_token=None, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_token = upload_token
+        self.user = user
+        self.upload = None
+
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if self.upload_token:
+            self.upload = get_finished_upload(self.upload_token, self.user)
+            if self.upload is None:
+                raise ValidationError('Загрузка картинки не найдена '
+                                      'или ещё не завершена.')
+            image = open_upload(self.upload)
+        elif not hasattr(image, 'image'):
+            # Картинку не меняли: у поста осталась прежняя.
+            return image
+        error = image_limits_error(image)
+        if error:
+            raise ValidationError(error)
+        return image
+
     class Meta:
         model = Post
         fields = ("text", "group", "image")
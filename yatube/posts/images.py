@@ -0,0 +1,242 @@
+import os
+import re
+from base64 import b64encode
+from hashlib import md5
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageFilter, ImageOps, features
+
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'progressive': True, 'optimize': True}),
+}
+VARIANTS_DIR = 'variants'
+POSTS_DIR = 'posts'
+SHARDED_RE = re.compile(r'^[a-z]+/[0-9a-f]{2}/[0-9a-f]{2}/')
+HEX_RE = re.compile(r'^[0-9a-f]{4,}$')
+
+IMAGE_METADATA_FIELDS = (
+    'image_width', 'image_height', 'image_size', 'image_format'
+)
+
+
+def shard_path(directory, name, key=None):
+    """directory/ab/cd/name: два уровня по 256 подкаталогов, чтобы
+    в одном каталоге не копились сотни тысяч файлов.
+
+    Шард берётся из начала ключа (по умолчанию — имени без
+    расширения), если это hex-хэш, иначе из md5 ключа — так старые
+    имена вроде photo.jpg тоже раскладываются.
+    """
+    name = os.path.basename(name)
+    if key is None:
+        key = os.path.splitext(name)[0]
+    key = key.lower()
+    digest = key if HEX_RE.match(key) else md5(key.encode()).hexdigest()
+    return f'{directory}/{digest[:2]}/{digest[2:4]}/{name}'
+
+
+def header_limits_error(image_format, width, height):
+    """Нарушенный лимит по данным заголовка или None."""
+    if image_format not in settings.IMAGE_ALLOWED_FORMATS:
+        return f'Формат {image_format or "файла"} не поддерживается.'
+    if max(width, height) > settings.IMAGE_MAX_SIDE:
+        return (f'Сторона картинки больше '
+                f'{settings.IMAGE_MAX_SIDE} пикселей.')
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        return (f'В картинке больше '
+                f'{settings.IMAGE_MAX_PIXELS // 10 ** 6} млн пикселей.')
+    return None
+
+
+def image_limits_error(file):
+    """Проверяет загрузку по лимитам IMAGE_* до декодирования пикселей:
+    Pillow читает заголовок, кадры анимации считаются без распаковки.
+    Возвращает текст ошибки или None."""
+    if file.size > settings.IMAGE_MAX_BYTES:
+        return (f'Файл больше '
+                f'{settings.IMAGE_MAX_BYTES // 2 ** 20} МБ.')
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            error = header_limits_error(image.format, *image.size)
+            frames = getattr(image, 'n_frames', 1)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        error, frames = 'Файл не похож на картинку.', 1
+    file.seek(0)
+    if error is None and frames > settings.IMAGE_MAX_FRAMES:
+        error = f'В анимации больше {settings.IMAGE_MAX_FRAMES} кадров.'
+    return error
+
+
+def downscale_image(file, max_side):
+    """Уменьшает картинку до max_side по большей стороне.
+
+    Возвращает (байты, ширина, высота) или None, если уменьшать
+    не нужно. Анимации не трогаются: пересохранение потеряло бы кадры.
+    """
+    file.seek(0)
+    with Image.open(file) as image:
+        if (max(image.size) <= max_side
+                or getattr(image, 'n_frames', 1) > 1):
+            return None
+        image_format = image.format
+        # Для JPEG декодер сразу уменьшает картинку в 2-8 раз.
+        image.draft(image.mode, (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image_format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        buffer = BytesIO()
+        image.save(buffer, image_format, quality=90)
+    return buffer.getvalue(), image.width, image.height
+
+
+def read_image_metadata(file):
+    """Размеры, формат и вес картинки. Pillow читает только заголовок,
+    пиксели не декодируются."""
+    file.seek(0)
+    with Image.open(file) as image:
+        width, height = image.size
+        image_format = image.format or ''
+    file.seek(0)
+    return {
+        'image_width': width,
+        'image_height': height,
+        'image_size': file.size,
+        'image_format': image_format,
+    }
+
+
+def image_metadata_values(metadata=None):
+    """Значения полей IMAGE_METADATA_FIELDS; без metadata — пустые."""
+    values = {}
+    for field in IMAGE_METADATA_FIELDS:
+        value = metadata[field] if metadata else None
+        if field == 'image_format' and value is None:
+            value = ''
+        values[field] = value
+    return values
+
+
+def set_image_metadata(post, metadata=None):
+    for field, value in image_metadata_values(metadata).items():
+        setattr(post, field, value)
+
+
+def variant_formats():
+    return [
+        name for name in VARIANT_FORMATS
+        if name != 'webp' or features.check('webp')
+    ]
+
+
+def build_variants(file):
+    """Кадрирует картинку под пропорции ленты и кодирует её во всех
+    ширинах POST_IMAGE_VARIANT_WIDTHS и форматах VARIANT_FORMATS.
+
+    Возвращает список (ширина, высота, формат, байты). Ширины больше
+    исходной пропускаются, самая узкая остаётся всегда.
+    """
+    ratio_width, ratio_height = settings.POST_IMAGE_VARIANT_RATIO
+    widths = sorted(settings.POST_IMAGE_VARIANT_WIDTHS)
+    file.seek(0)
+    with Image.open(file) as image:
+        # Для JPEG декодер сразу уменьшает картинку в 2-8 раз.
+        image.draft('RGB', (widths[-1], widths[-1]))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        source_width = image.width
+        variants = []
+        for width in widths:
+            if width > source_width and width != widths[0]:
+                break
+            height = round(width * ratio_height / ratio_width)
+            resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+            for name in variant_formats():
+                pil_format, options = VARIANT_FORMATS[name]
+                buffer = BytesIO()
+                resized.save(buffer, pil_format, **options)
+                variants.append((width, height, name, buffer.getvalue()))
+    return variants
+
+
+def build_placeholder(file):
+    """Крошечная размытая копия картинки в пропорциях ленты как
+    data URI: её рисуют вместо картинки, пока та не загрузилась."""
+    ratio_width, ratio_height = settings.POST_IMAGE_VARIANT_RATIO
+    width = settings.POST_IMAGE_PLACEHOLDER_WIDTH
+    height = max(1, round(width * ratio_height / ratio_width))
+    file.seek(0)
+    with Image.open(file) as image:
+        image.draft('RGB', (width, width))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        image = image.filter(ImageFilter.GaussianBlur(1))
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=40)
+    file.seek(0)
+    data = b64encode(buffer.getvalue()).decode()
+    return f'data:image/jpeg;base64,{data}'
+
+
+def variant_name(image_name, width, format_name):
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    extension = 'jpg' if format_name == 'jpeg' else format_name
+    return shard_path(
+        VARIANTS_DIR, f'{stem}-{width}.{extension}', key=stem
+    )
+
+
+def write_variants(image_name, variants):
+    """Пишет результат build_variants в хранилище.
+
+    Возвращает список (ширина, высота, формат, имя файла). Строки
+    ImageVariant не трогает, поэтому годится и для процессов пула.
+    """
+    stored = []
+    for width, height, format_name, content in variants:
+        name = variant_name(image_name, width, format_name)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        name = default_storage.save(name, ContentFile(content))
+        stored.append((width, height, format_name, name))
+    return stored
+
+
+def store_variants(image_name, file):
+    return write_variants(image_name, build_variants(file))
+
+
+def replace_variants(variants_by_post, using=None):
+    """Заменяет строки ImageVariant постов результатами store_variants.
+    Файлы старых вариантов, которые не переписаны заново, удаляются."""
+    from .models import ImageVariant
+
+    fresh = {
+        name
+        for variants in variants_by_post.values()
+        for _, _, _, name in variants
+    }
+    variants = ImageVariant.objects.using(using)
+    old = variants.filter(post_id__in=variants_by_post)
+    stale = set(old.values_list('file', flat=True)) - fresh
+    # Посты с одинаковой картинкой делят и файлы её вариантов.
+    stale -= set(
+        variants.filter(file__in=stale)
+        .exclude(post_id__in=variants_by_post)
+        .values_list('file', flat=True)
+    )
+    for name in stale:
+        default_storage.delete(name)
+    old.delete()
+    return variants.bulk_create(
+        ImageVariant(
+            post_id=pk, width=width, height=height,
+            format=format_name, file=name,
+        )
+        for pk, variants in variants_by_post.items()
+        for width, height, format_name, name in variants
+    )
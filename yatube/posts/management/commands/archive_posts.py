@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.archive import archive_cutoff, archive_posts, hot_databases
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит посты старше --days дней вместе с комментариями '
+        'из горячих таблиц (или шардов) в архив POST_ARCHIVE_DATABASE '
+        'пачками по --batch-size. Страница поста и профиль автора '
+        'продолжают их показывать.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=float, default=settings.POST_ARCHIVE_AFTER_DAYS,
+            help='Возраст поста, после которого он уходит в архив.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=settings.POST_ARCHIVE_BATCH_SIZE,
+        )
+
+    def handle(self, *args, days, batch_size, **options):
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть больше нуля')
+        cutoff = archive_cutoff(days)
+        total = 0
+        started = time.monotonic()
+        for using in hot_databases():
+            posts, comments = archive_posts(using, cutoff, batch_size)
+            total += posts
+            self.stdout.write(
+                f'{using}: постов {posts}, комментариев {comments}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'В архив перенесено постов: {total} за '
+            f'{time.monotonic() - started:.1f} с'
+        ))
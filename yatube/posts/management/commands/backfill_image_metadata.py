@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from posts.images import IMAGE_METADATA_FIELDS, read_image_metadata
+from posts.images import set_image_metadata
+from posts.models import Post
+from posts.shards import post_databases
+
+
+class Command(BaseCommand):
+    help = 'Заполняет размеры, вес и формат картинок старых постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, batch_size=500, **options):
+        filled = broken = 0
+        for using in post_databases():
+            queryset = Post.objects.using(using).exclude(image='').filter(
+                image_width__isnull=True
+            ).only('pk', 'image', *IMAGE_METADATA_FIELDS).order_by('pk')
+            last_pk = 0
+            while True:
+                batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                updated = []
+                for post in batch:
+                    try:
+                        with post.image.open('rb'):
+                            metadata = read_image_metadata(post.image)
+                    except (OSError, ValueError):
+                        broken += 1
+                        continue
+                    set_image_metadata(post, metadata)
+                    updated.append(post)
+                Post.objects.using(using).bulk_update(
+                    updated, IMAGE_METADATA_FIELDS
+                )
+                filled += len(updated)
+                self.stdout.write(
+                    f'Заполнено: {filled}, не прочитано: {broken}'
+                )
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово. Заполнено: {filled}, не прочитано: {broken}'
+        ))
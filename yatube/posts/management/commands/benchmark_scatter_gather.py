@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import Post
+from posts.shards import enabled, merge_sorted, scatter
+
+
+class Command(BaseCommand):
+    help = (
+        'Меряет сборку первой страницы главной со всех шардов: '
+        'опрос шардов по очереди и параллельно, SHARD_WORKERS потоков.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, repeat, **options):
+        if not enabled():
+            raise CommandError('POST_SHARDS пуст: шардирование выключено')
+        per_page = settings.PAGE_COUNT
+        counts = scatter(lambda using: Post.objects.using(using).count())
+        self.stdout.write('Постов по шардам: ' + ', '.join(
+            f'{shard}={count}'
+            for shard, count in zip(settings.POST_SHARDS, counts)
+        ))
+
+        def fetch(using):
+            return list(
+                Post.objects.using(using).order_by('-pub_date', '-pk')
+                [:per_page]
+            )
+
+        for label, workers in (('по очереди', 0),
+                               ('параллельно', settings.SHARD_WORKERS)):
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                merge_sorted(
+                    scatter(fetch, workers),
+                    lambda post: (post.pub_date, post.pk), per_page,
+                )
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            self.stdout.write(
+                f'{label}: p50 {timings[len(timings) // 2] * 1000:.1f} мс, '
+                f'p95 {timings[int(len(timings) * 0.95)] * 1000:.1f} мс'
+            )
@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.sqlite import LOCKED_ERRORS, apply_pragmas, run_serialized
+
+SCHEMA = (
+    'CREATE TABLE post (id INTEGER PRIMARY KEY, author INTEGER, '
+    'text TEXT, pub_date REAL)',
+    'CREATE INDEX post_author_idx ON post (author, pub_date)',
+    'CREATE TABLE stats (author INTEGER PRIMARY KEY, posts INTEGER)',
+)
+MODES = ('default', 'production')
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает конкурентную запись в SQLite с настройками '
+        'по умолчанию и с профилем SQLITE_PRAGMAS и общим замком '
+        'записи. Работает на временных файлах, рабочую БД не трогает.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=2)
+        parser.add_argument(
+            '--writes', type=int, default=200,
+            help='Записей на один поток-писатель.',
+        )
+        parser.add_argument(
+            '--timeout', type=float, default=5.0,
+            help='Сколько sqlite3 ждёт блокировку, секунд.',
+        )
+        parser.add_argument('--mode', choices=MODES, action='append')
+
+    def handle(self, *args, writers, readers, writes, timeout,
+               mode=None, **options):
+        results = {}
+        for name in mode or MODES:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.sqlite3')
+                results[name] = self.run(
+                    name, path, writers, readers, writes, timeout
+                )
+            self.report(name, results[name])
+        if len(results) == len(MODES):
+            default, production = (results[name] for name in MODES)
+            speedup = production['writes_per_second'] / max(
+                default['writes_per_second'], 1e-9
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'Ускорение записи: x{speedup:.1f}'
+            ))
+
+    def connect(self, mode, path, timeout):
+        connection = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None,
+            check_same_thread=False,
+        )
+        if mode == 'production':
+            apply_pragmas(connection)
+        return connection
+
+    def write(self, connection, author):
+        connection.execute('BEGIN')
+        try:
+            connection.execute(
+                'INSERT INTO post (author, text, pub_date) VALUES (?, ?, ?)',
+                (author, 'x' * 200, time.time()),
+            )
+            connection.execute(
+                'INSERT INTO stats (author, posts) VALUES (?, 1) '
+                'ON CONFLICT (author) DO UPDATE SET posts = posts + 1',
+                (author,),
+            )
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def writer(self, mode, path, timeout, author, writes):
+        connection = self.connect(mode, path, timeout)
+        for _ in range(writes):
+            try:
+                if mode == 'production':
+                    run_serialized(lambda: self.write(connection, author))
+                else:
+                    self.write(connection, author)
+            except LOCKED_ERRORS:
+                self.write_errors.append(author)
+        connection.close()
+
+    def reader(self, mode, path, timeout):
+        connection = self.connect(mode, path, timeout)
+        while not self.done.is_set():
+            started = time.perf_counter()
+            try:
+                connection.execute(
+                    'SELECT * FROM post ORDER BY pub_date DESC LIMIT 10'
+                ).fetchall()
+            except LOCKED_ERRORS:
+                self.read_errors.append(None)
+            self.latencies.append(time.perf_counter() - started)
+        connection.close()
+
+    def run(self, mode, path, writers, readers, writes, timeout):
+        setup = self.connect(mode, path, timeout)
+        for statement in SCHEMA:
+            setup.execute(statement)
+        setup.close()
+        self.write_errors, self.read_errors, self.latencies = [], [], []
+        self.done = threading.Event()
+        writer_threads = [
+            threading.Thread(
+                target=self.writer,
+                args=(mode, path, timeout, author, writes),
+            )
+            for author in range(writers)
+        ]
+        reader_threads = [
+            threading.Thread(target=self.reader, args=(mode, path, timeout))
+            for _ in range(readers)
+        ]
+        started = time.perf_counter()
+        for thread in writer_threads + reader_threads:
+            thread.start()
+        for thread in writer_threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        self.done.set()
+        for thread in reader_threads:
+            thread.join()
+        latencies = sorted(self.latencies)
+        committed = writers * writes - len(self.write_errors)
+        return {
+            'committed': committed,
+            'errors': len(self.write_errors) + len(self.read_errors),
+            'elapsed': elapsed,
+            'writes_per_second': committed / elapsed,
+            'reads': len(latencies),
+            'read_p95': (
+                latencies[int(len(latencies) * 0.95)] if latencies else 0
+            ),
+        }
+
+    def report(self, mode, result):
+        self.stdout.write(
+            f'{mode}: записей {result["committed"]} за '
+            f'{result["elapsed"]:.2f} с '
+            f'({result["writes_per_second"]:.0f}/с), '
+            f'ошибок блокировки {result["errors"]}, чтений '
+            f'{result["reads"]}, p95 чтения '
+            f'{result["read_p95"] * 1000:.1f} мс'
+        )
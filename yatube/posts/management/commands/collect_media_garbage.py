@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from posts.images import VARIANTS_DIR
+from posts.models import ArchivedPost, ImageVariant, Post, StoredFile
+from posts.shards import post_databases
+
+CHUNK_SIZE = 2000
+
+
+def digest(value):
+    """8 байт вместо строки: на сотни тысяч путей набор остаётся
+    компактным, а коллизии при таком размере практически исключены."""
+    return blake2b(value.encode(), digest_size=8).digest()
+
+
+def stream(queryset):
+    return queryset.iterator(chunk_size=CHUNK_SIZE)
+
+
+def kv_values(identity):
+    prefix = add_prefix('', identity)
+    rows = KVStoreModel.objects.filter(key__startswith=prefix)
+    for key, value in stream(rows.values_list('key', 'value')):
+        yield key[len(prefix):], json.loads(value)
+
+
+def referenced_files():
+    """Набор дайджестов всех путей, на которые что-то ссылается:
+    картинки постов (со всех шардов) и архива, варианты, счётчики
+    ссылок и миниатюры sorl этих картинок из KV-хранилища."""
+    referenced = set()
+    source_keys = set()
+    post_managers = [
+        Post.objects.using(using) for using in post_databases()
+    ]
+    for manager in (*post_managers, ArchivedPost.objects):
+        images = manager.exclude(image='').values_list('image', flat=True)
+        for name in stream(images):
+            referenced.add(digest(name))
+            source_keys.add(digest(ImageFile(name, default.storage).key))
+    for using in post_databases():
+        variants = ImageVariant.objects.using(using).values_list(
+            'file', flat=True
+        )
+        referenced.update(digest(name) for name in stream(variants))
+    stored = StoredFile.objects.filter(references__gt=0)
+    referenced.update(
+        digest(name) for name in stream(stored.values_list('name', flat=True))
+    )
+    thumbnail_keys = set()
+    for key, thumbnails in kv_values('thumbnails'):
+        if digest(key) in source_keys:
+            thumbnail_keys.update(digest(name) for name in thumbnails)
+    for key, image in kv_values('image'):
+        if digest(key) in thumbnail_keys:
+            referenced.add(digest(image['name']))
+    return referenced
+
+
+def scan(directory, recursive, referenced, min_mtime):
+    """Файлы каталога, на которые никто не ссылается: [(имя, байты)].
+
+    Свежие файлы пропускаются: пост с только что загруженной картинкой
+    может быть ещё не закоммичен.
+    """
+    orphans = []
+    pending = [directory]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        pending.append(entry.path)
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime > min_mtime:
+                    continue
+                name = os.path.relpath(entry.path, settings.MEDIA_ROOT)
+                name = name.replace(os.sep, '/')
+                if digest(name) not in referenced:
+                    orphans.append((name, stat.st_size))
+    return orphans
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из MEDIA_ROOT картинки, варианты и миниатюры, на которые '
+        'не ссылается ни один пост. С --dry-run файлы не удаляются, '
+        'а переносятся в карантин.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Перенести файлы в MEDIA_QUARANTINE_ROOT вместо удаления.',
+        )
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument(
+            '--min-age', type=float, default=24,
+            help='Не трогать файлы моложе стольких часов.',
+        )
+
+    def handle(self, *args, dry_run=False, workers=8, min_age=24,
+               **options):
+        self.verbosity = options.get('verbosity', 1)
+        referenced = referenced_files()
+        self.stdout.write(f'Путей со ссылками: {len(referenced)}')
+        orphans = self.find_orphans(
+            referenced, workers, time.time() - min_age * 3600
+        )
+        reclaimed = sum(size for _, size in orphans)
+        for name, _ in orphans:
+            if dry_run:
+                self.quarantine(name)
+            else:
+                self.delete(name)
+        action = 'В карантине' if dry_run else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} файлов: {len(orphans)}, '
+            f'освобождено: {reclaimed / 2 ** 20:.1f} МБ ({reclaimed} байт)'
+        ))
+
+    def managed_dirs(self):
+        return [
+            *settings.SHARDED_UPLOAD_DIRS,
+            VARIANTS_DIR,
+            sorl_settings.THUMBNAIL_PREFIX.strip('/'),
+        ]
+
+    def find_orphans(self, referenced, workers, min_mtime):
+        """Обходит управляемые каталоги параллельно: по задаче на
+        каждый подкаталог-шард и одну на файлы самого каталога."""
+        tasks = []
+        for directory in self.managed_dirs():
+            path = os.path.join(settings.MEDIA_ROOT, directory)
+            if not os.path.isdir(path):
+                continue
+            tasks.append((path, False))
+            with os.scandir(path) as entries:
+                tasks.extend(
+                    (entry.path, True) for entry in entries
+                    if entry.is_dir(follow_symlinks=False)
+                )
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                lambda task: scan(*task, referenced, min_mtime), tasks
+            )
+            return [orphan for orphans in results for orphan in orphans]
+
+    def quarantine(self, name):
+        target = os.path.join(settings.MEDIA_QUARANTINE_ROOT, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(os.path.join(settings.MEDIA_ROOT, name), target)
+        if self.verbosity > 1:
+            self.stdout.write(f'В карантин: {name}')
+
+    def delete(self, name):
+        default.storage.delete(name)
+        # Ссылки sorl на удалённый файл: и как на миниатюру, и как
+        # на исходник со списком его миниатюр.
+        default.kvstore.delete(ImageFile(name, default.storage))
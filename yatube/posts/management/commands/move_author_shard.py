@@ -0,0 +1,72 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from posts.shards import (ShardError, enabled, move_author_rows, placement,
+                          reserve_post_ids, shard_for_author)
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит авторов между шардами вместе с постами, комментариями '
+        'к ним, вариантами картинок, записями лент и подписками. Без --to '
+        'автор уходит в базу по placement: так после смены '
+        'POST_SHARD_COUNT шарды перебалансируются, а с --from default '
+        'в шарды переезжают посты, созданные до шардирования.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*')
+        parser.add_argument(
+            '--all', dest='all_authors', action='store_true',
+            help='Все авторы.',
+        )
+        parser.add_argument('--to', help='База, куда переносить.')
+        parser.add_argument(
+            '--from', dest='source',
+            help='Где сейчас лежат строки, если не там, куда указывает '
+                 'карта шардов.',
+        )
+
+    def handle(self, *args, usernames, all_authors=False, to=None,
+               source=None, **options):
+        if not enabled():
+            raise CommandError('POST_SHARDS пуст: шардирование выключено')
+        databases = settings.POST_SHARDS + (DEFAULT_DB_ALIAS,)
+        for alias in (to, source):
+            if alias is not None and alias not in databases:
+                raise CommandError(f'Неизвестная база {alias}')
+        if all_authors:
+            authors = User.objects.order_by('pk')
+        elif usernames:
+            authors = User.objects.filter(username__in=usernames)
+        else:
+            raise CommandError('Укажите авторов или --all')
+        # Посты из default с id, которые каталог уже выдал бы шардам,
+        # не переедут: счётчик сдвигается до переноса.
+        reserve_post_ids(force=True)
+        moved_authors = 0
+        started = time.monotonic()
+        for author in authors.iterator():
+            target = to or placement(author.pk)
+            origin = source or shard_for_author(author.pk)
+            if origin == target:
+                continue
+            try:
+                moved = move_author_rows(author.pk, origin, target)
+            except ShardError as error:
+                raise CommandError(f'{author.username}: {error}')
+            moved_authors += 1
+            rows = ', '.join(f'{name}: {count}' for name, count
+                             in moved.items())
+            self.stdout.write(f'{author.username}: {origin} → {target} '
+                              f'({rows})')
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено авторов: {moved_authors} за '
+            f'{time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts.models import AuthorStats
+from posts.stats import COUNTERS, collect_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов и подписок авторов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить счётчики, ничего не меняя.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, check=False, batch_size=1000, **options):
+        expected = collect_stats()
+        stored = {
+            stats.pk: stats
+            for stats in AuthorStats.objects.filter(pk__in=expected)
+        }
+        missing, wrong = [], []
+        for pk, counters in expected.items():
+            stats = stored.get(pk)
+            if stats is None:
+                missing.append(AuthorStats(author_id=pk, **counters))
+            elif any(getattr(stats, name) != value
+                     for name, value in counters.items()):
+                for name, value in counters.items():
+                    setattr(stats, name, value)
+                wrong.append(stats)
+
+        self.stdout.write(
+            f'Авторов: {len(expected)}, без счётчиков: {len(missing)}, '
+            f'с ошибкой: {len(wrong)}'
+        )
+        if check:
+            if wrong:
+                raise CommandError('Счётчики расходятся с данными.')
+            return
+        with transaction.atomic():
+            AuthorStats.objects.bulk_create(missing, batch_size=batch_size)
+            AuthorStats.objects.bulk_update(
+                wrong, COUNTERS, batch_size=batch_size
+            )
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны.'))
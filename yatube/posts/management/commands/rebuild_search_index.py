@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.search import fts_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Заново строит полнотекстовый индекс постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, batch_size=1000, **options):
+        if not fts_available():
+            raise CommandError('Полнотекстовый индекс есть только в SQLite.')
+        indexed = rebuild_index(batch_size=batch_size)
+        self.stdout.write(
+            self.style.SUCCESS(f'Проиндексировано постов: {indexed}')
+        )
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts.models import Comment, Post
+from posts.shards import post_databases
+
+
+class Command(BaseCommand):
+    help = 'Сверяет и пересчитывает Post.comments_count.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить счётчики, ничего не меняя.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, check=False, batch_size=1000, **options):
+        actual = Coalesce(
+            Subquery(
+                Comment.objects.filter(post=OuterRef('pk'))
+                .order_by().values('post')
+                .annotate(total=Count('pk')).values('total'),
+                output_field=IntegerField(),
+            ),
+            0,
+        )
+        fixed = 0
+        for using in post_databases():
+            fixed += self.reconcile(Post.objects.using(using), actual,
+                                    check, batch_size)
+        if check and fixed:
+            raise CommandError(f'Разошлись счётчики у {fixed} постов.')
+        self.stdout.write(
+            self.style.SUCCESS(f'Исправлено постов: {0 if check else fixed}')
+        )
+
+    def reconcile(self, posts, actual, check, batch_size):
+        """Сверяет посты одной базы пачками по pk; возвращает число
+        постов с неверным счётчиком."""
+        fixed = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                posts.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not batch:
+                return fixed
+            last_pk = batch[-1]
+            wrong = posts.filter(
+                pk__in=batch
+            ).annotate(actual=actual).exclude(
+                comments_count=F('actual')
+            ).values_list('pk', 'actual')
+            for pk, value in wrong:
+                fixed += 1
+                if not check:
+                    posts.filter(pk=pk).update(comments_count=value)
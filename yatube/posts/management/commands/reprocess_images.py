@@ -0,0 +1,200 @@
+import os
+import time
+from multiprocessing import Pool
+from operator import itemgetter
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from posts.cache import bump_posts_generations, forget_articles
+from posts.images import image_metadata_values, replace_variants
+from posts.models import Post
+from posts.shards import merge_sorted, post_databases, with_related
+from posts.sqlite import retry_locked
+from posts.thumbnails import (pop_recorded_thumbnails, record_thumbnails,
+                              render_post_image, use_recording_kvstore)
+
+
+def reprocess(name):
+    """Работа одного процесса пула: только декодирование и запись
+    файлов. Миниатюры sorl запоминает в памяти (use_recording_kvstore),
+    а строки в БД, и их тоже, пишет родительский процесс."""
+    try:
+        metadata, variants = render_post_image(name)
+    except Exception as error:
+        pop_recorded_thumbnails()
+        return name, None, None, (), f'{type(error).__name__}: {error}'
+    return name, metadata, variants, pop_recorded_thumbnails(), None
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересоздаёт миниатюры, варианты и метаданные картинок постов '
+        'в пуле процессов. Прерванный запуск продолжается с места '
+        'остановки через --state-file или --start-after.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Число процессов; 1 — без пула, в текущем процессе.',
+        )
+        parser.add_argument('--chunk-size', type=int, default=100)
+        parser.add_argument(
+            '--start-after', type=int, default=0,
+            help='Пропустить посты с pk не больше этого.',
+        )
+        parser.add_argument(
+            '--state-file',
+            help='Файл, где хранится pk последней записанной пачки.',
+        )
+        parser.add_argument(
+            '--pending',
+            action='store_true',
+            help='Только картинки, которые ещё не обработаны.',
+        )
+
+    def handle(self, *args, workers, chunk_size, start_after,
+               state_file=None, pending=False, **options):
+        last_pk = max(start_after, self.read_state(state_file))
+        querysets = {}
+        for using in post_databases():
+            queryset = Post.objects.using(using).exclude(image='')
+            if pending:
+                queryset = queryset.filter(image_ready=False)
+            querysets[using] = queryset.order_by('pk')
+        total = sum(
+            queryset.filter(pk__gt=last_pk).count()
+            for queryset in querysets.values()
+        )
+        self.stdout.write(f'Картинок к обработке: {total}, начиная '
+                          f'после pk={last_pk}')
+        # Процессы пула наследуют память родителя: открытые соединения
+        # с БД нельзя делить между процессами.
+        connections.close_all()
+        pool = None
+        if workers > 1:
+            # Процессы пула не пишут в базу: несколько писателей SQLite
+            # из разных процессов только ждали бы блокировку.
+            pool = Pool(workers, initializer=use_recording_kvstore)
+        started = time.monotonic()
+        done = failed = 0
+        try:
+            while True:
+                chunk = self.next_chunk(querysets, last_pk, chunk_size)
+                if not chunk:
+                    break
+                # Одинаковые загрузки хранятся одним файлом: каждый
+                # файл пачки обрабатывается один раз.
+                pks_by_name = {}
+                for pk, name, using in chunk:
+                    pks_by_name.setdefault(name, []).append((using, pk))
+                if pool is None:
+                    results = map(reprocess, pks_by_name)
+                else:
+                    results = pool.imap_unordered(reprocess, pks_by_name)
+                failed += self.save_chunk(results, pks_by_name)
+                done += len(chunk)
+                last_pk = chunk[-1][0]
+                self.write_state(state_file, last_pk)
+                self.report(done, total, failed, started)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово. Обработано: {done - failed}, с ошибкой: {failed}'
+        ))
+
+    def next_chunk(self, querysets, last_pk, chunk_size):
+        """Следующие chunk_size постов после last_pk по всем базам:
+        [(pk, картинка, база)]. id постов на шардах не пересекаются,
+        поэтому одного last_pk хватает, чтобы продолжить с места."""
+        return merge_sorted(
+            [
+                [(pk, name, using) for pk, name in queryset.filter(
+                    pk__gt=last_pk
+                ).values_list('pk', 'image')[:chunk_size]]
+                for using, queryset in querysets.items()
+            ],
+            itemgetter(0), chunk_size, reverse=False,
+        )
+
+    def save_chunk(self, results, pks_by_name):
+        """Пишет результаты пачки, по транзакции на базу; возвращает
+        число постов, картинки которых не удалось обработать."""
+        rendered, thumbnails, failed = [], [], 0
+        # Рендер идёт, пока читаются результаты пула, — до транзакций.
+        for name, image_metadata, image_variants, recorded, error in results:
+            if error:
+                pks = [pk for _, pk in pks_by_name[name]]
+                failed += len(pks)
+                self.stderr.write(f'{name} (pk={pks}): {error}')
+                continue
+            rendered.append((name, image_metadata, image_variants))
+            thumbnails.extend(recorded)
+        # Миниатюры процессов пула записываются здесь, одним писателем.
+        retry_locked(lambda: record_thumbnails(thumbnails))
+        databases = {
+            using for rows in pks_by_name.values() for using, _ in rows
+        }
+        posts = []
+        for using in databases:
+            posts.extend(self.save_database(using, rendered, pks_by_name))
+        # Имена файлов могли не поменяться, а геометрия миниатюр — да:
+        # карточки и страницы с этими постами строятся заново.
+        forget_articles(posts)
+        bump_posts_generations(posts)
+        return failed
+
+    def save_database(self, using, rendered, pks_by_name):
+        """Записывает результаты в одну базу и возвращает её посты.
+
+        Пока картинка рендерилась, пост могли отредактировать: каждая
+        запись фильтруется по (pk, image=name), и посты с новой
+        картинкой пропускаются — их обработает задача новой загрузки.
+        """
+        variants = {}
+        posts = Post.objects.using(using)
+        with transaction.atomic(using=using):
+            for name, image_metadata, image_variants in rendered:
+                current = posts.filter(image=name, pk__in=[
+                    pk for db, pk in pks_by_name[name] if db == using
+                ])
+                pks = list(
+                    current.select_for_update().values_list('pk', flat=True)
+                )
+                current.filter(pk__in=pks).update(
+                    image_ready=True,
+                    image_placeholder=image_metadata['image_placeholder'],
+                    **image_metadata_values(image_metadata),
+                )
+                variants.update(dict.fromkeys(pks, image_variants))
+            replace_variants(variants, using=using)
+        return list(
+            with_related(posts.filter(pk__in=variants), 'author', 'group')
+        )
+
+    def report(self, done, total, failed, started):
+        elapsed = time.monotonic() - started
+        rate = done / elapsed if elapsed else 0
+        left = (total - done) / rate if rate else 0
+        self.stdout.write(
+            f'{done}/{total}, ошибок: {failed}, '
+            f'{rate:.1f} картинок/с, осталось ~{left / 60:.0f} мин'
+        )
+
+    def read_state(self, state_file):
+        if not state_file or not os.path.exists(state_file):
+            return 0
+        with open(state_file) as file:
+            return int(file.read().strip() or 0)
+
+    def write_state(self, state_file, last_pk):
+        if not state_file:
+            return
+        # Запись через временный файл: обрыв не оставит пустой файл.
+        temporary = f'{state_file}.tmp'
+        with open(temporary, 'w') as file:
+            file.write(str(last_pk))
+        os.replace(temporary, state_file)
@@ -0,0 +1,102 @@
+import os
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.cache import bump_posts_generations
+from posts.images import POSTS_DIR, SHARDED_RE
+from posts.models import Post
+from posts.shards import post_databases
+from posts.storage import acquire_file
+
+
+class Command(BaseCommand):
+    help = (
+        'Раскладывает картинки постов из плоского каталога posts/ '
+        'по подкаталогам posts/ab/cd/ с именами по содержимому '
+        'и переписывает Post.image.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только посчитать картинки, которые нужно перенести.',
+        )
+
+    def handle(self, *args, batch_size=500, dry_run=False, **options):
+        querysets = [
+            Post.objects.using(using).exclude(image='').filter(
+                image__startswith=f'{POSTS_DIR}/'
+            ).exclude(
+                image__regex=SHARDED_RE.pattern
+            ).only('pk', 'image', 'author_id', 'group_id').order_by('pk')
+            for using in post_databases()
+        ]
+        total = sum(queryset.count() for queryset in querysets)
+        self.stdout.write(f'Картинок к переносу: {total}')
+        if dry_run:
+            return
+        self.moved = self.missing = 0
+        for queryset in querysets:
+            self.move_images(queryset, batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово. Перенесено: {self.moved}, без файла: {self.missing}'
+        ))
+
+    def move_images(self, queryset, batch_size):
+        """Переносит картинки постов одной базы пачками по pk."""
+        last_pk = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            updated, sources = [], []
+            for post in batch:
+                source = post.image.name
+                if not default_storage.exists(source):
+                    self.missing += 1
+                    self.stderr.write(f'pk={post.pk}: нет файла {source}')
+                    continue
+                post.image.name = self.copy(source)
+                updated.append(post)
+                sources.append(source)
+            # Старые файлы удаляются только после коммита: если запись
+            # в БД упадёт, посты продолжат указывать на целые файлы.
+            with transaction.atomic(using=queryset.db):
+                Post.objects.using(queryset.db).bulk_update(
+                    updated, ['image']
+                )
+                # Одинаковые картинки пачки — один файл: счётчик
+                # меняется один раз на имя, а не на каждый пост.
+                names = Counter(post.image.name for post in updated)
+                for name, count in names.items():
+                    acquire_file(name, count)
+            for source in sources:
+                default_storage.delete(source)
+            bump_posts_generations(updated)
+            self.moved += len(updated)
+            self.stdout.write(
+                f'Перенесено: {self.moved}, без файла: {self.missing}'
+            )
+
+    def copy(self, source):
+        """Копия файла под именем по содержимому; если такой файл уже
+        есть, копия не нужна. На локальном диске это жёсткая ссылка."""
+        with default_storage.open(source, 'rb') as file:
+            target = default_storage.content_name(source, file)
+            if default_storage.exists(target):
+                return target
+            try:
+                source_path = default_storage.path(source)
+                target_path = default_storage.path(target)
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                os.link(source_path, target_path)
+                return target
+            except (NotImplementedError, OSError):
+                # Хранилище без локальных путей или ФС без жёстких ссылок.
+                return default_storage.save(target, file)
@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from posts.replicas import copy_database
+
+SQLITE_ENGINE = 'django.db.backends.sqlite3'
+
+
+class Command(BaseCommand):
+    help = (
+        'Заменяет репликацию при локальной проверке: копирует SQLite-базу '
+        'default во все DATABASE_REPLICAS. С --interval копирует по кругу, '
+        'и реплики отстают от primary на этот интервал.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Повторять копирование каждые N секунд.',
+        )
+
+    def handle(self, *args, interval=0, **options):
+        aliases = (DEFAULT_DB_ALIAS,) + tuple(settings.DATABASE_REPLICAS)
+        for alias in aliases:
+            if connections[alias].settings_dict['ENGINE'] != SQLITE_ENGINE:
+                raise CommandError(f'{alias}: поддерживается только SQLite')
+        if len(aliases) == 1:
+            raise CommandError('DATABASE_REPLICAS пуст: копировать некуда')
+        source = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+        while True:
+            for alias in settings.DATABASE_REPLICAS:
+                pages = copy_database(
+                    source, connections[alias].settings_dict['NAME']
+                )
+                self.stdout.write(f'{alias}: скопировано страниц {pages}')
+            if not interval:
+                break
+            time.sleep(interval)
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.shards import post_databases
+from posts.timeline import trim_timelines
+
+
+class Command(BaseCommand):
+    help = (
+        'Обрезает ленты подписок до FEED_TIMELINE_SIZE свежих записей. '
+        'Fan-out нового поста хвосты не трогает, поэтому команду нужно '
+        'запускать периодически, например из cron.'
+    )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        deleted = sum(trim_timelines(using=using)
+                      for using in post_databases())
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено записей: {deleted} за '
+            f'{time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_fts USING fts5('
+        "text, tokenize='unicode61 remove_diacritics 2')"
+    )
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS posts_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_post_comments_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
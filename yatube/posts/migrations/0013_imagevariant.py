@@ -0,0 +1,34 @@
+# Generated by Django 2.2.16 on 2026-10-17 04:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_post_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_ready',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Миниатюры готовы'),
+        ),
+        migrations.CreateModel(
+            name='ImageVariant',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('width', models.PositiveIntegerField(verbose_name='Ширина')),
+                ('height', models.PositiveIntegerField(verbose_name='Высота')),
+                ('format', models.CharField(max_length=10, verbose_name='Формат')),
+                ('file', models.ImageField(upload_to='variants/', verbose_name='Файл')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_variants', to='posts.Post', verbose_name='Пост')),
+            ],
+            options={
+                'verbose_name_plural': 'Варианты картинок',
+                'ordering': ('format', 'width'),
+            },
+        ),
+    ]
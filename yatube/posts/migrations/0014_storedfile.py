@@ -0,0 +1,37 @@
+# Generated by Django 2.2.16 on 2026-10-17 04:32
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_references(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    StoredFile = apps.get_model('posts', 'StoredFile')
+    StoredFile.objects.bulk_create(
+        StoredFile(name=image, references=references)
+        for image, references in Post.objects.filter(
+            image__regex=r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/'
+        ).values_list('image').annotate(references=Count('pk'))
+        .order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_imagevariant'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False, verbose_name='Имя файла')),
+                ('references', models.PositiveIntegerField(default=0, verbose_name='Ссылок')),
+            ],
+            options={
+                'verbose_name_plural': 'Файлы картинок',
+            },
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
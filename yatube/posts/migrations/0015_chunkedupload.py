@@ -0,0 +1,32 @@
+# Generated by Django 2.2.16 on 2026-10-17 04:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0014_storedfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('token', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False, verbose_name='Токен')),
+                ('filename', models.CharField(max_length=255, verbose_name='Имя файла')),
+                ('size', models.PositiveIntegerField(verbose_name='Размер')),
+                ('offset', models.PositiveIntegerField(default=0, verbose_name='Получено байт')),
+                ('image_format', models.CharField(blank=True, max_length=10, verbose_name='Формат')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Начало загрузки')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+            options={
+                'verbose_name_plural': 'Загрузки картинок',
+            },
+        ),
+    ]
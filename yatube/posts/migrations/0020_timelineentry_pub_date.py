@@ -0,0 +1,41 @@
+# Generated by Django 2.2.16 on 2026-10-17 06:10
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_pub_dates(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+    db_alias = schema_editor.connection.alias
+    TimelineEntry.objects.using(db_alias).update(pub_date=Subquery(
+        Post.objects.filter(pk=OuterRef('post')).values('pub_date')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timelineentry',
+            name='pub_date',
+            field=models.DateTimeField(null=True, verbose_name='Дата публикации'),
+        ),
+        migrations.RunPython(
+            copy_pub_dates, migrations.RunPython.noop,
+            hints={'model_name': 'timelineentry'},
+        ),
+        migrations.AlterField(
+            model_name='timelineentry',
+            name='pub_date',
+            field=models.DateTimeField(verbose_name='Дата публикации'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-post'], name='timeline_user_date_idx'),
+        ),
+    ]
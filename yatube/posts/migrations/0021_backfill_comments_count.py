@@ -0,0 +1,33 @@
+# Generated by Django 2.2.16 on 2026-10-17 06:40
+
+from django.db import migrations
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_comments(apps, schema_editor):
+    Comment = apps.get_model('posts', 'Comment')
+    Post = apps.get_model('posts', 'Post')
+    db_alias = schema_editor.connection.alias
+    Post.objects.using(db_alias).update(comments_count=Coalesce(
+        Subquery(
+            Comment.objects.filter(post=OuterRef('pk')).order_by()
+            .values('post').annotate(total=Count('pk')).values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_timelineentry_pub_date'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            count_comments, migrations.RunPython.noop,
+            hints={'model_name': 'post'},
+        ),
+    ]
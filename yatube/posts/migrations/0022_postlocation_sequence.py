@@ -0,0 +1,44 @@
+# Generated by Django 2.2.16 on 2026-10-17 12:10
+
+from django.db import DEFAULT_DB_ALIAS, connections, migrations
+from django.db.models import Max
+
+
+def reserve_post_ids(apps, schema_editor):
+    # Каталог живёт в default, а посты, созданные до шардирования, и
+    # архивные уже заняли свои id: новые посты на шардах получат id
+    # больше самого большого из них во всех базах.
+    if schema_editor.connection.alias != DEFAULT_DB_ALIAS:
+        return
+    PostLocation = apps.get_model('posts', 'PostLocation')
+    top = 0
+    for model_name in ('Post', 'ArchivedPost'):
+        model = apps.get_model('posts', model_name)
+        for alias in connections:
+            tables = connections[alias].introspection.table_names()
+            if model._meta.db_table not in tables:
+                continue
+            found = model.objects.using(alias).aggregate(top=Max('pk'))
+            top = max(top, found['top'] or 0)
+    with schema_editor.connection.cursor() as cursor:
+        table = PostLocation._meta.db_table
+        cursor.execute(
+            'UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s',
+            [top, table],
+        )
+        if not cursor.rowcount:
+            cursor.execute(
+                'INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)',
+                [table, top],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0021_backfill_comments_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(reserve_post_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.16 on 2026-10-17 05:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_pull_authors(apps, schema_editor):
+    # До флага режим определялся одним порогом: авторы над ним уже
+    # читаются напрямую, и записей в лентах у них нет.
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    db_alias = schema_editor.connection.alias
+    AuthorStats.objects.using(db_alias).filter(
+        followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS,
+    ).update(feed_pull=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0022_postlocation_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorstats',
+            name='feed_pull',
+            field=models.BooleanField(default=False, verbose_name='Лента читает посты напрямую'),
+        ),
+        migrations.RunPython(
+            mark_pull_authors, migrations.RunPython.noop,
+            hints={'model_name': 'authorstats'},
+        ),
+    ]
@@ -1,3 +1,5 @@
+from uuid import uuid4
+
 from django.contrib.auth import get_user_model
 from django.db import models
 
@@ -25,6 +27,15 @@ class Group(models.Model):
         return self.title
 
 
+# Поля поста, которые пишут только атомарные UPDATE: счётчик
+# комментариев и состояние картинки, которое ведёт её обработка.
+DERIVED_FIELDS = ('comments_count',)
+IMAGE_STATE_FIELDS = (
+    'image', 'image_width', 'image_height', 'image_size', 'image_format',
+    'image_ready', 'image_placeholder',
+)
+
+
 class Post(models.Model):
     text = models.TextField('Текст')
     pub_date = models.DateTimeField(
@@ -32,11 +43,14 @@ class Post(models.Model):
         auto_now_add=True,
         db_index=True
     )
+    # Пользователи и группы живут в default, а посты могут лежать
+    # в шарде: ссылку на другую базу СУБД не проверит.
     author = models.ForeignKey(
         User,
         verbose_name='Автор',
         on_delete=models.CASCADE,
-        related_name='posts'
+        related_name='posts',
+        db_constraint=False,
     )
     group = models.ForeignKey(
         Group,
@@ -44,21 +58,98 @@ class Post(models.Model):
         blank=True,
         null=True,
         on_delete=models.SET_NULL,
-        related_name='posts'
+        related_name='posts',
+        db_constraint=False,
     )
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
         blank=True
     )
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки',
+        null=True,
+        editable=False,
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота картинки',
+        null=True,
+        editable=False,
+    )
+    image_size = models.PositiveIntegerField(
+        'Размер картинки, байт',
+        null=True,
+        editable=False,
+    )
+    image_format = models.CharField(
+        'Формат картинки',
+        max_length=10,
+        blank=True,
+        editable=False,
+    )
+    image_ready = models.BooleanField(
+        'Миниатюры готовы',
+        default=False,
+        editable=False,
+    )
+    image_placeholder = models.TextField(
+        'Заглушка картинки',
+        blank=True,
+        editable=False,
+    )
+    comments_count = models.PositiveIntegerField(
+        'Комментариев',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name_plural = 'Посты'
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_date_idx',
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_date_idx',
+            ),
+        ]
 
     def __str__(self) -> str:
         return self.text[:15]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # По имени картинки при чтении save() понимает, меняли ли её.
+        instance._loaded_image = dict(zip(field_names, values)).get('image')
+        return instance
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        """Сохранение уже записанного поста не трогает столбцы, которые
+        ведут атомарные UPDATE сигналов и фоновых задач: экземпляр,
+        прочитанный до них, вернул бы туда устаревшие значения."""
+        if (update_fields is None and not force_insert
+                and not self._state.adding
+                and using in (None, self._state.db)):
+            update_fields = self._saved_fields()
+        super().save(force_insert, force_update, using, update_fields)
+        self._loaded_image = self.image.name
+
+    def _saved_fields(self):
+        skipped = {*DERIVED_FIELDS, *self.get_deferred_fields()}
+        if ('image' in skipped
+                or self.image.name == getattr(self, '_loaded_image', None)):
+            # Картинку не меняли: её файл и состояние ведёт обработка.
+            skipped.update(IMAGE_STATE_FIELDS)
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname not in skipped
+        ]
+
 
 class Comment(models.Model):
     post = models.ForeignKey(
@@ -72,6 +163,7 @@ class Comment(models.Model):
         verbose_name="Автор",
         related_name="comments",
         on_delete=models.CASCADE,
+        db_constraint=False,
     )
     text = models.TextField(
         verbose_name="Текст",
@@ -85,6 +177,12 @@ class Comment(models.Model):
     class Meta:
         ordering = ["-created"]
         verbose_name_plural = 'Комментарии'
+        indexes = [
+            models.Index(
+                fields=['post', '-created', '-id'],
+                name='comment_post_created_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.text[:30]
@@ -97,6 +195,7 @@ class Follow(models.Model):
         related_name='follower',
         help_text='Пользователь, который подписывается',
         verbose_name='Подписчик',
+        db_constraint=False,
     )
 
     author = models.ForeignKey(
@@ -105,6 +204,7 @@ class Follow(models.Model):
         related_name='following',
         help_text='На кого подписываются',
         verbose_name='Автор',
+        db_constraint=False,
     )
 
     class Meta:
@@ -112,6 +212,256 @@ class Follow(models.Model):
             models.UniqueConstraint(
                 fields=['user', 'author'], name='unique_follow')
         ]
+        indexes = [
+            models.Index(
+                fields=['author', 'user'], name='follow_author_user_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'Пользователь {self.user} подписался на {self.author}'
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик',
+        db_constraint=False,
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост',
+    )
+    # Копия даты поста: лента листается по индексу записей без
+    # сортировки постов.
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'], name='unique_timeline_entry')
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_date_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'Пост {self.post_id} в ленте {self.user_id}'
+
+
+class AuthorStats(models.Model):
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Автор',
+    )
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+    # Режим ленты с гистерезисом: по одному числу подписчиков его
+    # не восстановить.
+    feed_pull = models.BooleanField(
+        'Лента читает посты напрямую', default=False
+    )
+
+    class Meta:
+        verbose_name_plural = 'Статистика авторов'
+
+    def __str__(self):
+        return f'Статистика {self.author_id}'
+
+
+class ImageVariant(models.Model):
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='image_variants',
+        verbose_name='Пост',
+    )
+    width = models.PositiveIntegerField('Ширина')
+    height = models.PositiveIntegerField('Высота')
+    format = models.CharField('Формат', max_length=10)
+    file = models.ImageField('Файл', upload_to='variants/')
+
+    class Meta:
+        ordering = ('format', 'width')
+        verbose_name_plural = 'Варианты картинок'
+
+    def __str__(self):
+        return f'{self.file.name} ({self.width}w)'
+
+
+class StoredFile(models.Model):
+    """Счётчик ссылок на файл картинки: одинаковые загрузки хранятся
+    одним файлом, и он удаляется, когда на него не ссылается ни один
+    пост."""
+    name = models.CharField('Имя файла', max_length=255, primary_key=True)
+    references = models.PositiveIntegerField('Ссылок', default=0)
+
+    class Meta:
+        verbose_name_plural = 'Файлы картинок'
+
+    def __str__(self):
+        return f'{self.name} ({self.references})'
+
+
+class ChunkedUpload(models.Model):
+    """Картинка, которая загружается кусками до отправки формы поста.
+    Файл копится во временном каталоге, пока offset не дойдёт до size."""
+    token = models.UUIDField('Токен', primary_key=True, default=uuid4)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='uploads',
+        verbose_name='Автор',
+    )
+    filename = models.CharField('Имя файла', max_length=255)
+    size = models.PositiveIntegerField('Размер')
+    offset = models.PositiveIntegerField('Получено байт', default=0)
+    image_format = models.CharField('Формат', max_length=10, blank=True)
+    created = models.DateTimeField('Начало загрузки', auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = 'Загрузки картинок'
+
+    def __str__(self):
+        return f'{self.filename} ({self.offset}/{self.size})'
+
+    @property
+    def complete(self):
+        return self.offset == self.size
+
+
+class AuthorShard(models.Model):
+    """Карта шардов: в какой базе POST_SHARDS лежат посты автора,
+    комментарии к ним, подписки на него и его записи в лентах."""
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='shard',
+        verbose_name='Автор',
+    )
+    shard = models.CharField('База', max_length=50)
+
+    class Meta:
+        verbose_name_plural = 'Карта шардов'
+
+    def __str__(self):
+        return f'{self.author_id} → {self.shard}'
+
+
+class PostLocation(models.Model):
+    """Выдаёт постам на шардах сквозные id и помнит автора поста:
+    по нему и карте шардов находится база поста."""
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='post_locations',
+        verbose_name='Автор',
+    )
+
+    class Meta:
+        verbose_name_plural = 'Адреса постов'
+
+    def __str__(self):
+        return f'Пост {self.pk} автора {self.author_id}'
+
+
+class ArchivedPost(models.Model):
+    """Пост старше POST_ARCHIVE_AFTER_DAYS, перенесённый командой
+    archive_posts из горячей таблицы. id остаётся прежним, так что
+    ссылки на пост продолжают работать."""
+    text = models.TextField('Текст')
+    pub_date = models.DateTimeField('Дата публикации')
+    archived = models.DateTimeField('Перенесён в архив', auto_now_add=True)
+    # Архив может лежать в отдельной базе, без пользователей и групп.
+    author = models.ForeignKey(
+        User,
+        verbose_name='Автор',
+        on_delete=models.CASCADE,
+        related_name='archived_posts',
+        db_constraint=False,
+    )
+    group = models.ForeignKey(
+        Group,
+        verbose_name='Группа',
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+        related_name='archived_posts',
+        db_constraint=False,
+    )
+    image = models.ImageField(
+        'Картинка',
+        upload_to='posts/',
+        blank=True
+    )
+    image_width = models.PositiveIntegerField('Ширина картинки', null=True)
+    image_height = models.PositiveIntegerField('Высота картинки', null=True)
+    image_size = models.PositiveIntegerField(
+        'Размер картинки, байт', null=True
+    )
+    image_format = models.CharField(
+        'Формат картинки', max_length=10, blank=True
+    )
+    image_placeholder = models.TextField('Заглушка картинки', blank=True)
+    comments_count = models.PositiveIntegerField('Комментариев', default=0)
+
+    # Варианты картинки в архив не переезжают: карточка показывает
+    # миниатюру sorl.
+    image_ready = False
+
+    class Meta:
+        ordering = ('-pub_date',)
+        verbose_name_plural = 'Архив постов'
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='archived_author_date_idx',
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return self.text[:15]
+
+
+class ArchivedComment(models.Model):
+    post = models.ForeignKey(
+        ArchivedPost,
+        verbose_name='Пост',
+        related_name='comments',
+        on_delete=models.CASCADE,
+    )
+    author = models.ForeignKey(
+        User,
+        verbose_name='Автор',
+        related_name='archived_comments',
+        on_delete=models.CASCADE,
+        db_constraint=False,
+    )
+    text = models.TextField('Текст')
+    created = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        ordering = ['-created']
+        verbose_name_plural = 'Архив комментариев'
+        indexes = [
+            models.Index(
+                fields=['post', '-created', '-id'],
+                name='archived_comment_created_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return self.text[:30]
@@ -0,0 +1,100 @@
+import random
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_state = threading.local()
+
+
+def read_from_replica(view):
+    """Разрешает GET-запросам view читать с реплики.
+
+    Остальные view, админка и фоновые задачи всегда читают с primary.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        previous = getattr(_state, 'replica', False)
+        _state.replica = True
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _state.replica = previous
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    """Чтение из view с read_from_replica уходит на случайную реплику
+    DATABASE_REPLICAS, всё остальное — на default.
+
+    После записи чтения прилипают к primary: до конца запроса
+    и ещё REPLICA_STICKY_SECONDS по cookie, чтобы пользователь видел
+    свои изменения, пока реплика догоняет.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if (not replicas or not getattr(_state, 'replica', False)
+                or getattr(_state, 'pinned', False)
+                or getattr(_state, 'wrote', False)):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # На репликах те же данные, что и на primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема приезжает на реплики вместе с данными.
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaMiddleware:
+    """Прилипание к primary после записи: ставит cookie со временем,
+    до которого запросы пользователя читают с primary."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        cookie = settings.REPLICA_STICKY_COOKIE
+        try:
+            pinned_until = float(request.COOKIES.get(cookie, 0))
+        except ValueError:
+            pinned_until = 0
+        _state.pinned = pinned_until > time.time()
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = _state.wrote
+            _state.pinned = _state.wrote = False
+        if wrote and settings.DATABASE_REPLICAS:
+            window = settings.REPLICA_STICKY_SECONDS
+            response.set_cookie(
+                cookie, str(time.time() + window), max_age=window,
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+
+def copy_database(source, target):
+    """Копирует SQLite-базу целиком через backup API: подменяет
+    репликацию при локальной проверке. Возвращает число страниц."""
+    source_connection = sqlite3.connect(source)
+    target_connection = sqlite3.connect(target)
+    try:
+        source_connection.backup(target_connection)
+        return target_connection.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        target_connection.close()
+        source_connection.close()
@@ -0,0 +1,148 @@
+import re
+
+from django.db import connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Post
+from .shards import post_databases, scatter, with_related
+
+FTS_TABLE = 'posts_post_fts'
+# Служебные символы вместо тегов: текст поста экранируется целиком,
+# и только потом маркеры превращаются в <mark>.
+MARK_OPEN, MARK_CLOSE = '\x02', '\x03'
+SNIPPET_TOKENS = 32
+WORD_RE = re.compile(r'\w+')
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def index_post(pk, text):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+            [pk, text],
+        )
+
+
+def unindex_post(pk):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
+
+
+def rebuild_index(batch_size=1000):
+    """Заново наполняет индекс всеми постами, пачками по pk. Индекс
+    один на все шарды: id постов в них не пересекаются."""
+    indexed = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        for using in post_databases():
+            posts = Post.objects.using(using).order_by('pk')
+            last_pk = 0
+            while True:
+                batch = list(
+                    posts.filter(pk__gt=last_pk)
+                    .values_list('pk', 'text')[:batch_size]
+                )
+                if not batch:
+                    break
+                cursor.executemany(
+                    f'INSERT INTO {FTS_TABLE} (rowid, text) '
+                    'VALUES (%s, %s)',
+                    batch,
+                )
+                indexed += len(batch)
+                last_pk = batch[-1][0]
+    return indexed
+
+
+def build_match(query):
+    """Запрос пользователя -> выражение MATCH: все слова обязательны,
+    последнее ищется по префиксу. Операторы FTS5 из ввода не проходят."""
+    words = WORD_RE.findall(query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def highlight(snippet):
+    return mark_safe(
+        escape(snippet)
+        .replace(MARK_OPEN, '<mark>')
+        .replace(MARK_CLOSE, '</mark>')
+    )
+
+
+class SearchResults:
+    """Результаты поиска по FTS5 в порядке релевантности.
+
+    Поддерживает count() и срезы, поэтому отдаётся в Paginator
+    как обычный QuerySet; посты страницы догружаются одним запросом.
+    """
+
+    def __init__(self, match):
+        self.match = match
+
+    def count(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s',
+                [self.match],
+            )
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start = item.start or 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, snippet({FTS_TABLE}, 0, %s, %s, %s, %s) '
+                f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                'ORDER BY rank LIMIT %s OFFSET %s',
+                [MARK_OPEN, MARK_CLOSE, '…', SNIPPET_TOKENS, self.match,
+                 item.stop - start, start],
+            )
+            rows = cursor.fetchall()
+        pks = [pk for pk, _ in rows]
+        posts = {}
+        # Индекс один, а посты лежат в базах авторов.
+        for found in scatter(
+            lambda using: with_related(
+                Post.objects.using(using), 'author', 'group'
+            ).in_bulk(pks),
+            sources=post_databases(),
+        ):
+            posts.update(found)
+        results = []
+        for pk, snippet in rows:
+            post = posts.get(pk)
+            if post is not None:
+                post.highlight = highlight(snippet)
+                results.append(post)
+        return results
+
+
+def search_posts(query):
+    """Посты по запросу: FTS5 на SQLite, иначе LIKE по тексту."""
+    if fts_available():
+        match = build_match(query)
+        if match is None:
+            return Post.objects.none()
+        return SearchResults(match)
+    return Post.objects.select_related('author', 'group').filter(
+        text__icontains=query
+    )
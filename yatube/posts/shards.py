@@ -0,0 +1,356 @@
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max, prefetch_related_objects
+from django.http import Http404
+
+from . import sqlite
+from .models import (ArchivedPost, AuthorShard, Comment, Follow,
+                     ImageVariant, Post, PostLocation, TimelineEntry)
+
+SHARD_CACHE_PREFIX = 'shard'
+# Строки, которые живут в базе автора поста.
+SHARDED_MODELS = (Post, Comment, Follow, TimelineEntry, ImageVariant)
+# Что переезжает вместе с автором: модель и как она на него ссылается.
+AUTHOR_ROWS = (
+    (Post, 'author_id'),
+    (Comment, 'post__author_id'),
+    (ImageVariant, 'post__author_id'),
+    (TimelineEntry, 'post__author_id'),
+    (Follow, 'author_id'),
+)
+# Строки, которые ссылаются на пользователя без ограничения FK:
+# каскад удаления в default до шардов не доходит.
+USER_ROWS = (
+    (Post, 'author_id'),
+    (Comment, 'author_id'),
+    (Follow, 'user_id'),
+    (Follow, 'author_id'),
+    (TimelineEntry, 'user_id'),
+)
+BATCH_SIZE = 500
+
+_executors = {}
+_executors_lock = threading.Lock()
+_post_ids_reserved = False
+
+
+class ShardError(Exception):
+    """Строку нельзя разместить по шардам: база не определена или
+    id поста уже занят другим автором."""
+
+
+def enabled():
+    return bool(settings.POST_SHARDS)
+
+
+def post_databases():
+    """Базы с постами: шарды, а без них — None, то есть выбор за
+    роутерами (чтение может уйти на реплику)."""
+    return settings.POST_SHARDS or (None,)
+
+
+def placement(author_id):
+    """База нового автора: авторы раскладываются по шардам по кругу."""
+    shards = settings.POST_SHARDS
+    return shards[author_id % len(shards)]
+
+
+def top_post_id():
+    """Самый большой id поста во всех базах, включая архив: посты,
+    созданные до шардирования, и архивные сохраняют свои id."""
+    databases = {DEFAULT_DB_ALIAS, *settings.POST_SHARDS}
+    ids = [
+        Post.objects.using(using).aggregate(top=Max('pk'))['top']
+        for using in databases
+    ]
+    ids.append(
+        ArchivedPost.objects.using(settings.POST_ARCHIVE_DATABASE)
+        .aggregate(top=Max('pk'))['top']
+    )
+    return max(filter(None, ids), default=0)
+
+
+def reserve_post_ids(force=False):
+    """Сдвигает счётчик каталога PostLocation за top_post_id, чтобы
+    новый пост на шарде не получил id поста из default или архива.
+
+    Достаточно одного раза на процесс: после включения шардов новые
+    посты в default не пишутся.
+    """
+    global _post_ids_reserved
+    if _post_ids_reserved and not force:
+        return
+    sqlite.advance_sequence(
+        connections[DEFAULT_DB_ALIAS], PostLocation._meta.db_table,
+        top_post_id(),
+    )
+    _post_ids_reserved = True
+
+
+def shard_for_author(author_id, assign=False):
+    """База, где лежат посты автора. Без шардов — None: using(None)
+    оставляет выбор роутерам, и чтение может уйти на реплику.
+
+    Автор без записи в карте читается из базы по placement; при
+    assign=True (первая запись автора) место закрепляется в карте.
+    """
+    if not enabled():
+        return None
+    key = f'{SHARD_CACHE_PREFIX}:{author_id}'
+    shard = cache.get(key)
+    if shard is None:
+        shard = AuthorShard.objects.filter(author_id=author_id).values_list(
+            'shard', flat=True
+        ).first()
+        if shard is None:
+            shard = placement(author_id)
+            if not assign:
+                return shard
+            shard = AuthorShard.objects.get_or_create(
+                author_id=author_id, defaults={'shard': shard}
+            )[0].shard
+        cache.set(key, shard, None)
+    return shard
+
+
+def move_author(author_id, shard):
+    AuthorShard.objects.update_or_create(
+        author_id=author_id, defaults={'shard': shard}
+    )
+    cache.delete(f'{SHARD_CACHE_PREFIX}:{author_id}')
+
+
+def move_author_rows(author_id, source, target):
+    """Переносит строки автора из source в target и переключает карту.
+
+    Посты сохраняют id, остальные строки получают новые. source всё
+    время переноса заблокирована на запись, и удаляются из неё только
+    скопированные строки. Сначала фиксируется копия, потом удаление:
+    при сбое строки остаются в обеих базах, а карта указывает на
+    старую. Возвращает {модель: строк}.
+    """
+    moved = {}
+    copied = {}
+    with sqlite.write_transaction(source):
+        with transaction.atomic(using=target):
+            for model, lookup in AUTHOR_ROWS:
+                rows = list(
+                    model.objects.using(source).filter(**{lookup: author_id})
+                )
+                copied[model] = [row.pk for row in rows]
+                if model is Post:
+                    # До копирования: чужой id не должен попасть в target.
+                    locate_posts(author_id, copied[Post])
+                else:
+                    for row in rows:
+                        row.pk = None
+                model.objects.using(target).bulk_create(
+                    rows, batch_size=BATCH_SIZE
+                )
+                moved[model._meta.model_name] = len(rows)
+        move_author(author_id, target)
+        _delete_rows(source, copied)
+    return moved
+
+
+def locate_posts(author_id, post_ids):
+    """Записывает в каталог адреса постов автора. Посты, созданные ещё
+    без шардов, получают адрес впервые; id, который каталог уже отдал
+    другому автору, — ShardError, а не молча потерянный пост."""
+    known = dict(
+        PostLocation.objects.filter(pk__in=post_ids)
+        .values_list('pk', 'author_id')
+    )
+    taken = sorted(pk for pk, owner in known.items() if owner != author_id)
+    if taken:
+        raise ShardError(
+            f'id постов {taken} в каталоге принадлежат другим авторам'
+        )
+    PostLocation.objects.bulk_create(
+        (PostLocation(pk=pk, author_id=author_id)
+         for pk in post_ids if pk not in known),
+        batch_size=BATCH_SIZE,
+    )
+
+
+def _delete_rows(using, copied):
+    # Строки не удалены, а переехали: сигналы удаления (счётчики,
+    # файлы, ленты) срабатывать не должны, поэтому запрос прямой.
+    with connections[using].cursor() as cursor:
+        for model, _ in reversed(AUTHOR_ROWS):
+            pks = copied[model]
+            for start in range(0, len(pks), BATCH_SIZE):
+                batch = pks[start:start + BATCH_SIZE]
+                placeholders = ', '.join(['%s'] * len(batch))
+                cursor.execute(
+                    f'DELETE FROM {model._meta.db_table} '
+                    f'WHERE id IN ({placeholders})',
+                    batch,
+                )
+
+
+def delete_user_rows(user_id):
+    """Каскад удаления пользователя на шардах. Удаление идёт через ORM,
+    чтобы сработали сигналы: счётчики, ссылки на файлы, ленты."""
+    for shard in settings.POST_SHARDS:
+        for model, lookup in USER_ROWS:
+            model.objects.using(shard).filter(**{lookup: user_id}).delete()
+
+
+def detach_group(group_id):
+    """SET_NULL для постов удаляемой группы на шардах."""
+    for shard in settings.POST_SHARDS:
+        Post.objects.using(shard).filter(group_id=group_id).update(
+            group=None
+        )
+
+
+def shard_for_post(post_id):
+    author_id = PostLocation.objects.filter(pk=post_id).values_list(
+        'author_id', flat=True
+    ).first()
+    if author_id is None:
+        return None
+    return shard_for_author(author_id)
+
+
+def get_post_or_404(post_id, *related):
+    """Пост из базы его автора; related подтягиваются из default."""
+    if not enabled():
+        queryset = Post.objects.all()
+        if related:
+            queryset = queryset.select_related(*related)
+        try:
+            return queryset.get(pk=post_id)
+        except Post.DoesNotExist:
+            raise Http404('Пост не найден')
+    shard = shard_for_post(post_id)
+    post = shard and Post.objects.using(shard).filter(pk=post_id).first()
+    if not post:
+        raise Http404('Пост не найден')
+    prefetch_related_objects([post], *related)
+    return post
+
+
+def is_detached(using):
+    """База без пользователей и групп: шард или отдельный архив."""
+    return using in settings.POST_SHARDS or (
+        using != DEFAULT_DB_ALIAS
+        and using == settings.POST_ARCHIVE_DATABASE
+    )
+
+
+def with_related(queryset, *related):
+    """select_related, а для шарда и отдельного архива —
+    prefetch_related: авторов и групп в их базах нет, JOIN с ними
+    ничего не найдёт."""
+    if is_detached(queryset.db):
+        return queryset.prefetch_related(*related)
+    return queryset.select_related(*related)
+
+
+def get_executor(workers):
+    """Пул для опроса шардов. Потоки живут всё время процесса
+    и держат свои соединения с шардами открытыми."""
+    with _executors_lock:
+        if workers not in _executors:
+            _executors[workers] = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix='shards',
+            )
+        return _executors[workers]
+
+
+def scatter(func, workers=None, sources=None):
+    """Вызывает func(shard) на всех шардах (или на каждом из sources)
+    и возвращает результаты в том же порядке. При SHARD_WORKERS > 0
+    они опрашиваются параллельно, каждый в своём потоке со своим
+    соединением."""
+    shards = settings.POST_SHARDS if sources is None else sources
+    if workers is None:
+        workers = settings.SHARD_WORKERS
+    if not workers or len(shards) < 2:
+        return [func(shard) for shard in shards]
+    return list(get_executor(workers).map(func, shards))
+
+
+def merge_sorted(results, key, limit, reverse=True):
+    """k-way merge уже отсортированных списков с шардов через heapq:
+    возвращает первые limit элементов общего порядка."""
+    return list(islice(heapq.merge(*results, key=key, reverse=reverse), limit))
+
+
+class ShardedQuery:
+    """Лента, которая собирается со всех шардов.
+
+    factory(shard) строит queryset ленты для одной базы; related
+    подтягиваются из default одним prefetch на всю страницу. sources
+    заменяют список шардов, если лента собирается из других частей.
+    """
+
+    def __init__(self, factory, related=(), sources=None):
+        self.factory = factory
+        self.related = related
+        self.sources = sources
+
+
+def scatter_posts(factory, *related):
+    """queryset ленты для default или ShardedQuery, если шарды
+    включены."""
+    if not enabled():
+        return factory(None).select_related(*related)
+    return ShardedQuery(factory, related)
+
+
+class ShardRouter:
+    """Пишет и читает строки SHARDED_MODELS в базе их автора.
+
+    Чтение без подсказки instance уходит в default, а запись без неё
+    — ShardError: objects.create() или update() без using() молча
+    записали бы строку в default, где её никто не найдёт. Подсказка
+    с пользователем или группой (Post(author=user), user.posts)
+    базу не выбирает и не запрещает.
+    """
+
+    def _db_for(self, model, instance=None, **hints):
+        if not enabled() or model not in SHARDED_MODELS:
+            return None
+        if not isinstance(instance, SHARDED_MODELS):
+            return None
+        # Новой строке база достаётся от присвоенного автора: её
+        # выбирает не он, а шард.
+        if instance._state.db and not instance._state.adding:
+            return instance._state.db
+        if isinstance(instance, (Post, Follow)):
+            return shard_for_author(instance.author_id, assign=True)
+        post_field = instance._meta.get_field('post')
+        if post_field.is_cached(instance):
+            return post_field.get_cached_value(instance)._state.db
+        return shard_for_post(instance.post_id)
+
+    db_for_read = _db_for
+
+    def db_for_write(self, model, **hints):
+        using = self._db_for(model, **hints)
+        if (using is None and not hints and enabled()
+                and model in SHARDED_MODELS):
+            raise ShardError(
+                f'Не выбрана база для записи {model._meta.object_name}: '
+                f'укажите using() или сохраняйте через save()'
+            )
+        return using
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Миграции данных без подсказки model_name пишут без using(),
+        # то есть в default: на других базах они бы задвоили строки.
+        # Шард создаётся пустым, и переносить на нём нечего — ему
+        # достаётся только схема.
+        if (model_name is None and db != DEFAULT_DB_ALIAS
+                and db not in settings.DATABASE_REPLICAS):
+            return False
+        return None
@@ -0,0 +1,179 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import archive, search, shards, sqlite, stats, storage, timeline
+from .images import (build_placeholder, read_image_metadata,
+                     set_image_metadata)
+from .cache import bump_generation, bump_post_generations
+from .models import (ArchivedPost, Comment, Follow, Group, Post, PostLocation,
+                     User)
+
+
+@receiver(connection_created)
+def sqlite_connection_created(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        sqlite.apply_pragmas(connection.connection)
+
+
+@receiver(pre_save, sender=Post)
+def post_remember_previous(sender, instance, raw=False, using=None,
+                           **kwargs):
+    instance._previous_group_id = None
+    instance._previous_image = ''
+    if instance.pk and not raw:
+        instance._previous_group_id, instance._previous_image = (
+            Post.objects.using(using).filter(pk=instance.pk)
+            .values_list('group_id', 'image').first() or (None, '')
+        )
+
+
+@receiver(pre_save, sender=Post)
+def post_shard_id(sender, instance, raw=False, using=None, **kwargs):
+    # Автоинкремент у каждого шарда свой: id постам выдаёт default.
+    if (instance.pk is None and not raw
+            and using in settings.POST_SHARDS):
+        shards.reserve_post_ids()
+        instance.pk = PostLocation.objects.create(
+            author_id=instance.author_id
+        ).pk
+
+
+@receiver(pre_save, sender=Post)
+def post_image_metadata(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if not instance.image:
+        set_image_metadata(instance)
+    elif not instance.image._committed:
+        # Заглушка считается при загрузке: крошечная копия декодируется
+        # быстро, и первая же лента рисует её вместо картинки.
+        try:
+            metadata = read_image_metadata(instance.image)
+            placeholder = build_placeholder(instance.image)
+        except (OSError, ValueError):
+            # Битый файл не мешает сохранению; backfill отчитается о нём.
+            metadata, placeholder = None, ''
+        set_image_metadata(instance, metadata)
+        instance.image_ready = False
+        instance.image_placeholder = placeholder
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    bump_post_generations(
+        instance.author_id,
+        instance.group_id,
+        getattr(instance, '_previous_group_id', None),
+    )
+    search.index_post(instance.pk, instance.text)
+    previous_image = getattr(instance, '_previous_image', '')
+    if instance.image.name != previous_image:
+        if instance.image:
+            storage.acquire_file(instance.image.name)
+        if previous_image:
+            storage.release_file(previous_image)
+    if created:
+        stats.change_counter(instance.author_id, 'posts_count', 1)
+        timeline.fan_out_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, using=None, **kwargs):
+    bump_post_generations(instance.author_id, instance.group_id)
+    search.unindex_post(instance.pk)
+    stats.change_counter(instance.author_id, 'posts_count', -1)
+    if instance.image:
+        storage.release_file(instance.image.name)
+    if using in settings.POST_SHARDS:
+        PostLocation.objects.filter(pk=instance.pk).delete()
+
+
+@receiver(post_delete, sender=ArchivedPost)
+def archived_post_deleted(sender, instance, **kwargs):
+    # Перенос в архив счётчики и ссылки на файлы не трогал: архивный
+    # пост остаётся постом автора, пока его не удалят.
+    bump_post_generations(instance.author_id, instance.group_id)
+    stats.change_counter(instance.author_id, 'posts_count', -1)
+    if instance.image:
+        storage.release_file(instance.image.name)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, using=None,
+                   **kwargs):
+    if created and not raw:
+        stats.change_counter(instance.author_id, 'followers_count', 1)
+        stats.change_counter(instance.user_id, 'following_count', 1)
+        # Режим — до backfill: ставшему популярным автору записи
+        # в ленте уже не нужны.
+        timeline.update_author_mode(instance.author_id, using=using)
+        timeline.backfill(instance.user_id, instance.author_id, using=using)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, using=None, **kwargs):
+    stats.change_counter(instance.author_id, 'followers_count', -1)
+    stats.change_counter(instance.user_id, 'following_count', -1)
+    timeline.trim(instance.user_id, instance.author_id, using=using)
+    timeline.update_author_mode(instance.author_id, using=using)
+
+
+def _bump_comment_post(comment, using):
+    # Пост удаляется каскадом вместе с комментариями — тогда
+    # поколения уже сдвинул сигнал самого поста.
+    post = Post.objects.using(using).filter(pk=comment.post_id).values_list(
+        'author_id', 'group_id'
+    ).first()
+    if post is not None:
+        bump_post_generations(*post)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, using=None,
+                    **kwargs):
+    if raw:
+        return
+    if created:
+        Post.objects.using(using).filter(pk=instance.post_id).update(
+            comments_count=F('comments_count') + 1
+        )
+    _bump_comment_post(instance, using)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, using=None, **kwargs):
+    # Счётчик мог отстать от комментариев: уходить ниже нуля ему нельзя.
+    Post.objects.using(using).filter(
+        pk=instance.post_id, comments_count__gt=0
+    ).update(comments_count=F('comments_count') - 1)
+    _bump_comment_post(instance, using)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    # Посты, комментарии и подписки на шардах и в отдельном архиве
+    # ссылаются на пользователя без FK, и каскад default их не видит.
+    shards.delete_user_rows(instance.pk)
+    archive.delete_user_rows(instance.pk)
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    shards.detach_group(instance.pk)
+    archive.detach_group(instance.pk)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_generation('index')
+    bump_generation('groups')
+    bump_generation('group', instance.pk)
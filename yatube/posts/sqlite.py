@@ -0,0 +1,143 @@
+import random
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.db import transaction
+
+LOCKED_ERRORS = (OperationalError, sqlite3.OperationalError)
+
+_write_lock = threading.RLock()
+# Запросы, с которых SQLite берёт блокировку записи.
+WRITE_RE = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+
+def apply_pragmas(connection, pragmas=None):
+    """Выставляет соединению SQLite настройки из SQLITE_PRAGMAS.
+
+    Принимает и сырое соединение sqlite3, и курсор: нужен только execute.
+    """
+    if pragmas is None:
+        pragmas = settings.SQLITE_PRAGMAS
+    for name, value in pragmas:
+        connection.execute(f'PRAGMA {name} = {value}')
+
+
+def is_locked(error):
+    message = str(error)
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def retry_locked(func, retries=None, backoff=None):
+    """Выполняет func и повторяет её, пока база заблокирована другим
+    процессом: до ``retries`` раз с экспоненциальной паузой и случайным
+    разбросом."""
+    if retries is None:
+        retries = settings.SQLITE_WRITE_RETRIES
+    if backoff is None:
+        backoff = settings.SQLITE_WRITE_BACKOFF
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except LOCKED_ERRORS as error:
+            if attempt == retries or not is_locked(error):
+                raise
+        time.sleep(backoff * 2 ** attempt * (1 + random.random()))
+
+
+def run_serialized(func, retries=None, backoff=None):
+    """Выполняет запись под общим для процесса замком; заблокированная
+    другим процессом запись повторяется, как в retry_locked."""
+    def locked():
+        with _write_lock:
+            return func()
+
+    return retry_locked(locked, retries, backoff)
+
+
+@contextmanager
+def lock_on_first_write(connection):
+    """Берёт общий замок на первом пишущем запросе соединения и держит
+    его до выхода из блока — то есть, если блок оборачивает транзакцию,
+    до её коммита или отката. Чтение до первой записи замок не ждёт."""
+    held = []
+
+    def execute(execute, sql, params, many, context):
+        if not held and WRITE_RE.match(sql):
+            _write_lock.acquire()
+            held.append(True)
+        return execute(sql, params, many, context)
+
+    try:
+        with connection.execute_wrapper(execute):
+            yield
+    finally:
+        if held:
+            _write_lock.release()
+
+
+def serialized_write(view):
+    """transaction.atomic, который на SQLite пропускает записи по одной
+    и повторяет view при блокировке базы.
+
+    Замок берётся на первом пишущем запросе, а не на входе во view:
+    проверка формы, чтение загрузки и хэширование файла идут
+    параллельно с чужими записями. Внутри уже открытой транзакции
+    повторять нечего: откатится вся внешняя транзакция, так что view
+    выполняется один раз.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        connection = connections[DEFAULT_DB_ALIAS]
+
+        def write():
+            with transaction.atomic():
+                return view(*args, **kwargs)
+
+        def locked_write():
+            with lock_on_first_write(connection):
+                return write()
+
+        if connection.vendor != 'sqlite':
+            return write()
+        retries = 0 if connection.in_atomic_block else None
+        return retry_locked(locked_write, retries=retries)
+    return wrapper
+
+
+@contextmanager
+def write_transaction(using):
+    """transaction.atomic на базе using, который на SQLite сразу берёт
+    блокировку записи базы и общий замок процесса и держит их до
+    коммита: никто не допишет строк между чтением и записью блока."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        with transaction.atomic(using=using):
+            yield
+        return
+    with _write_lock, transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            # BEGIN у atomic отложенный: блокировку записи SQLite берёт
+            # первый пишущий запрос, даже если он ничего не меняет.
+            cursor.execute('DELETE FROM django_migrations WHERE 0')
+        yield
+
+
+def advance_sequence(connection, table, value):
+    """Поднимает счётчик AUTOINCREMENT таблицы до value: следующая
+    строка получит id больше. Уже бо́льший счётчик не трогается."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s',
+            [value, table],
+        )
+        if not cursor.rowcount:
+            cursor.execute(
+                'INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)',
+                [table, value],
+            )
@@ -0,0 +1,89 @@
+from django.db.models import Count, F
+
+from .models import ArchivedPost, AuthorStats, Follow, Post, User
+from .shards import post_databases, scatter, shard_for_author
+
+COUNTERS = ('posts_count', 'followers_count', 'following_count')
+
+
+def compute_stats(author_id):
+    """Честный пересчёт счётчиков автора по исходным таблицам.
+
+    Посты автора и подписки на него лежат в его базе, а подписки
+    самого автора — в базах тех, на кого он подписан.
+    """
+    using = shard_for_author(author_id)
+    return {
+        'posts_count': (
+            Post.objects.using(using).filter(author_id=author_id).count()
+            + ArchivedPost.objects.filter(author_id=author_id).count()
+        ),
+        'followers_count': Follow.objects.using(using).filter(
+            author_id=author_id
+        ).count(),
+        'following_count': sum(scatter(
+            lambda shard: Follow.objects.using(shard).filter(
+                user_id=author_id
+            ).count(),
+            sources=post_databases(),
+        )),
+    }
+
+
+def get_author_stats(author):
+    """Счётчики автора одной строкой; строка создаётся при первом чтении."""
+    try:
+        return AuthorStats.objects.get(pk=author.pk)
+    except AuthorStats.DoesNotExist:
+        stats, _ = AuthorStats.objects.get_or_create(
+            author_id=author.pk, defaults=compute_stats(author.pk)
+        )
+        return stats
+
+
+def change_counter(author_id, counter, delta):
+    """Атомарно сдвигает счётчик.
+
+    Если строки ещё нет, при росте счётчика она считается целиком
+    (запись уже в базе, так что учтена), а при удалении остаётся
+    на ленивый пересчёт в get_author_stats.
+    """
+    updated = AuthorStats.objects.filter(pk=author_id).update(
+        **{counter: F(counter) + delta}
+    )
+    if not updated and delta > 0:
+        AuthorStats.objects.get_or_create(
+            author_id=author_id, defaults=compute_stats(author_id)
+        )
+
+
+def _aggregates(using):
+    return [
+        (counter, list(queryset.annotate(value=Count('pk')).order_by()))
+        for counter, queryset in (
+            ('posts_count', Post.objects.using(using).values_list('author')),
+            ('followers_count',
+             Follow.objects.using(using).values_list('author')),
+            ('following_count',
+             Follow.objects.using(using).values_list('user')),
+        )
+    ]
+
+
+def collect_stats():
+    """Счётчики всех пользователей агрегирующим запросом на таблицу
+    каждой базы с постами."""
+    stats = {
+        pk: dict.fromkeys(COUNTERS, 0)
+        for pk in User.objects.values_list('pk', flat=True)
+    }
+    archived = ArchivedPost.objects.values_list('author').annotate(
+        value=Count('pk')
+    ).order_by()
+    aggregates = scatter(_aggregates, sources=post_databases())
+    aggregates.append([('posts_count', archived)])
+    for counters in aggregates:
+        for counter, rows in counters:
+            for pk, value in rows:
+                stats[pk][counter] += value
+    return stats
@@ -0,0 +1,119 @@
+import os
+import posixpath
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+from .images import SHARDED_RE, shard_path
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, которое называет загрузки в каталоги из
+    SHARDED_UPLOAD_DIRS по содержимому: posts/ab/cd/<sha256>.<ext>.
+
+    Повторная загрузка того же файла не пишет копию, а возвращает имя
+    уже сохранённого — у него же готовы и миниатюры. Файлы, сохранённые
+    вне этих каталогов (миниатюры sorl, варианты), хранятся как есть.
+    """
+
+    def content_name(self, name, content):
+        """Имя файла по содержимому или None, если каталог не из
+        SHARDED_UPLOAD_DIRS."""
+        directory, basename = posixpath.split(name)
+        if directory not in settings.SHARDED_UPLOAD_DIRS:
+            return None
+        digest = sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        extension = os.path.splitext(basename)[1].lower()
+        return shard_path(directory, f'{digest.hexdigest()}{extension}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        hashed = self.content_name(name, content)
+        if hashed is None:
+            return super().save(name, content, max_length)
+        if self.exists(hashed):
+            return hashed
+        return super().save(hashed, content, max_length)
+
+
+def is_shared(name):
+    """Файл из SHARDED_UPLOAD_DIRS с именем по содержимому: на него
+    могут ссылаться несколько постов. Остальные имена уникальны для
+    каждой загрузки, и счётчик ссылок им не нужен."""
+    return (
+        bool(SHARDED_RE.match(name))
+        and name.split('/', 1)[0] in settings.SHARDED_UPLOAD_DIRS
+    )
+
+
+def _post_managers():
+    """Посты всех баз и архив: картинка может быть у любого из них."""
+    from .models import ArchivedPost, Post
+    from .shards import post_databases
+
+    return [
+        *(Post.objects.using(using) for using in post_databases()),
+        ArchivedPost.objects,
+    ]
+
+
+def acquire_file(name, count=1):
+    """Ещё count ссылок на файл картинки.
+
+    Если счётчика нет, он считается по постам целиком: посты со ссылкой
+    уже сохранены, так что учтены.
+    """
+    from .models import StoredFile
+
+    if not is_shared(name):
+        return
+    updated = StoredFile.objects.filter(name=name).update(
+        references=F('references') + count
+    )
+    if not updated:
+        StoredFile.objects.get_or_create(name=name, defaults={
+            'references': sum(
+                posts.filter(image=name).count() for posts in _post_managers()
+            ),
+        })
+
+
+def release_file(name):
+    """Снимает ссылку; последняя уносит файл и его миниатюры sorl
+    после коммита. Файлы вариантов подбирает сборщик мусора."""
+    from .models import StoredFile
+
+    if not is_shared(name):
+        return
+    StoredFile.objects.filter(name=name, references__gt=0).update(
+        references=F('references') - 1
+    )
+    deleted, _ = StoredFile.objects.filter(
+        name=name, references=0
+    ).delete()
+    if deleted:
+        transaction.on_commit(lambda: _delete_unreferenced(name))
+
+
+def _delete_unreferenced(name):
+    # sorl сам берёт это хранилище по умолчанию: импорт на уровне
+    # модуля был бы циклическим.
+    from sorl.thumbnail import delete as delete_with_thumbnails
+
+    from .models import StoredFile
+
+    # Между коммитом и удалением файл мог загрузить кто-то ещё.
+    if (StoredFile.objects.filter(name=name).exists()
+            or any(posts.filter(image=name).exists()
+                   for posts in _post_managers())):
+        return
+    delete_with_thumbnails(name, delete_file=True)
@@ -0,0 +1,77 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from ..cache import article_key
+from ..models import Post
+from ..thumbnails import (backend, prefetch_thumbnails,
+                          schedule_post_image)
+
+register = template.Library()
+
+ARTICLE_TEMPLATE = 'posts/includes/article.html'
+
+
+@register.simple_tag
+def post_articles(posts, check_author=False, check_group=False):
+    """HTML карточек постов страницы: все готовые фрагменты берутся
+    из кэша одним get_many, рендерятся и пишутся одним set_many
+    только промахи."""
+    variant = f'{int(check_author)}{int(check_group)}'
+    keys = {article_key(post, variant): post for post in posts}
+    fragments = cache.get_many(keys)
+    missing = {}
+    if len(fragments) < len(keys):
+        with_images = [
+            post for key, post in keys.items()
+            if key not in fragments and post.image
+        ]
+        prefetch_thumbnails(post.image for post in with_images)
+        ready = [post for post in with_images if post.image_ready]
+        # prefetch идёт в базу первого поста: посты с разных шардов
+        # подтягиваются отдельно.
+        for using in {post._state.db for post in ready}:
+            prefetch_related_objects(
+                [post for post in ready if post._state.db == using],
+                'image_variants',
+            )
+        article = get_template(ARTICLE_TEMPLATE)
+        for key, post in keys.items():
+            if key not in fragments:
+                missing[key] = article.render({
+                    'post': post,
+                    'check_author': check_author,
+                    'check_group': check_group,
+                    'image_sizes': settings.POST_IMAGE_SIZES,
+                })
+        cache.set_many(missing, settings.ARTICLE_CACHE_TIMEOUT)
+        fragments.update(missing)
+    return [mark_safe(fragments[key]) for key in keys]
+
+
+@register.simple_tag
+def ready_thumbnail(image, geometry, **options):
+    """Готовая миниатюра или None; недостающая для горячего поста
+    ставится в очередь, а шаблон пока показывает оригинал."""
+    if not image:
+        return None
+    thumbnail = backend.get_ready_thumbnail(image, geometry, **options)
+    # Архивные посты картинки не обрабатывают: задача для них пустая.
+    if thumbnail is None and isinstance(image.instance, Post):
+        schedule_post_image(image.instance)
+    return thumbnail
+
+
+@register.simple_tag
+def image_srcset(post, format_name):
+    """srcset из готовых вариантов картинки без обращения к хранилищу."""
+    if not post.image_ready:
+        return ''
+    return ', '.join(
+        f'{variant.file.url} {variant.width}w'
+        for variant in post.image_variants.all()
+        if variant.format == format_name
+    )
@@ -0,0 +1,46 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from ..admin import EstimatedCountPaginator
+from ..models import Follow, Post, User
+
+
+class LargeTableAdminTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="pass"
+        )
+        cls.author = User.objects.create_user(username="author")
+        cls.user = User.objects.create_user(username="user")
+        Post.objects.create(author=cls.author, text="Тестовый пост")
+        Follow.objects.create(user=cls.user, author=cls.author)
+        Follow.objects.create(user=cls.admin, author=cls.author)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_changelists_open(self):
+        """Списки постов и подписок открываются с оценкой числа строк"""
+        for model in ("post", "follow"):
+            with self.subTest(model=model):
+                response = self.client.get(
+                    reverse(f"admin:posts_{model}_changelist")
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertIsInstance(
+                    response.context["cl"].paginator,
+                    EstimatedCountPaginator,
+                )
+
+    def test_follow_input_filter(self):
+        """Подписки фильтруются по введённому имени, без списка всех"""
+        response = self.client.get(
+            reverse("admin:posts_follow_changelist"), {"user": "user"}
+        )
+        self.assertEqual(
+            list(response.context["cl"].result_list),
+            list(Follow.objects.filter(user=self.user)),
+        )
+        self.assertContains(response, 'name="user" value="user"')
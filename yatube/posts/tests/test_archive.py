@@ -0,0 +1,119 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from ..models import ArchivedComment, ArchivedPost, Comment, Post, User
+from ..stats import collect_stats, get_author_stats
+from ..utils import CURSOR_NEXT, encode_cursor
+
+
+class ArchiveTests(TestCase):
+    databases = {"default", "archive"}
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="author")
+        self.reader = User.objects.create_user(username="reader")
+        self.client.force_login(self.reader)
+        self.old = Post.objects.create(author=self.author, text="Старый пост")
+        Comment.objects.create(
+            post=self.old, author=self.reader, text="Старый комментарий"
+        )
+        Post.objects.filter(pk=self.old.pk).update(
+            pub_date=timezone.now() - timedelta(days=400)
+        )
+        self.new = Post.objects.create(author=self.author, text="Новый пост")
+
+    def archive(self):
+        out = StringIO()
+        call_command("archive_posts", batch_size=1, stdout=out)
+        return out.getvalue()
+
+    def test_old_posts_move_to_archive(self):
+        """Старые посты уезжают в архив с комментариями, новые остаются"""
+        self.assertIn("постов 1, комментариев 1", self.archive())
+        self.assertEqual(list(Post.objects.all()), [self.new])
+        self.assertFalse(Comment.objects.exists())
+        archived = ArchivedPost.objects.get(pk=self.old.pk)
+        self.assertEqual(archived.text, "Старый пост")
+        self.assertEqual(archived.comments_count, 1)
+        self.assertEqual(archived.comments.get().author, self.reader)
+        self.assertIn("постов 0", self.archive())
+
+    def test_author_stats_are_kept(self):
+        """Архивный пост остаётся в счётчике автора до удаления"""
+        self.archive()
+        self.assertEqual(get_author_stats(self.author).posts_count, 2)
+        self.assertEqual(collect_stats()[self.author.pk]["posts_count"], 2)
+        ArchivedPost.objects.get().delete()
+        self.assertEqual(get_author_stats(self.author).posts_count, 1)
+        self.assertFalse(ArchivedComment.objects.exists())
+
+    def test_post_detail_falls_back_to_archive(self):
+        """Страница архивного поста открывается без формы комментария"""
+        self.archive()
+        response = self.client.get(
+            reverse("posts:post_detail", args=[self.old.pk])
+        )
+        self.assertContains(response, "Старый пост")
+        self.assertContains(response, "Старый комментарий")
+        self.assertTrue(response.context["archived"])
+        self.assertNotContains(
+            response, reverse("posts:add_comment", args=[self.old.pk])
+        )
+        response = self.client.post(
+            reverse("posts:add_comment", args=[self.old.pk]),
+            {"text": "Поздно"},
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_profile_continues_into_archive(self):
+        """Профиль показывает архивные посты после горячих"""
+        self.archive()
+        response = self.client.get(
+            reverse("posts:profile", args=[self.author.username])
+        )
+        self.assertEqual(
+            [post.pk for post in response.context["page_obj"]],
+            [self.new.pk, self.old.pk],
+        )
+        self.assertIsInstance(response.context["page_obj"][1], ArchivedPost)
+        # Профиль с архивом листается курсором и в режиме номеров.
+        response = self.client.get(
+            reverse("posts:profile", args=[self.author.username]),
+            {"page": 2},
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse("posts:profile", args=[self.author.username]),
+            {"cursor": encode_cursor(
+                CURSOR_NEXT, timezone.now() - timedelta(days=1000), 1
+            )},
+        )
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(POST_ARCHIVE_DATABASE="archive")
+    def test_separate_archive_database(self):
+        """Архив в отдельной базе читается так же прозрачно"""
+        self.archive()
+        self.assertTrue(
+            ArchivedPost.objects.using("archive").filter(
+                pk=self.old.pk
+            ).exists()
+        )
+        self.assertFalse(
+            ArchivedPost.objects.using("default").exists()
+        )
+        response = self.client.get(
+            reverse("posts:post_detail", args=[self.old.pk])
+        )
+        self.assertContains(response, "Старый комментарий")
+        response = self.client.get(
+            reverse("posts:profile", args=[self.author.username])
+        )
+        self.assertContains(response, "Старый пост")
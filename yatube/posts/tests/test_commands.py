@@ -0,0 +1,88 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from ..models import AuthorStats, Comment, Follow, Post, User
+from ..search import search_posts
+from ..stats import get_author_stats
+
+
+class RebuildAuthorStatsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username="author")
+        cls.user = User.objects.create_user(username="user")
+        Post.objects.create(author=cls.author, text="Тестовый пост")
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def test_check_and_rebuild(self):
+        """Команда находит разъехавшиеся счётчики и чинит их"""
+        AuthorStats.objects.update_or_create(
+            author=self.author, defaults={"posts_count": 42}
+        )
+        with self.assertRaises(CommandError):
+            call_command("rebuild_author_stats", check=True, stdout=StringIO())
+        call_command("rebuild_author_stats", stdout=StringIO())
+        stats = AuthorStats.objects.get(pk=self.author.pk)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.followers_count, 1)
+        self.assertEqual(get_author_stats(self.user).following_count, 1)
+        call_command("rebuild_author_stats", check=True, stdout=StringIO())
+
+
+class ReconcileCommentsCountTests(TestCase):
+    def test_reconcile(self):
+        """Команда возвращает счётчик комментариев к реальному числу"""
+        author = User.objects.create_user(username="author")
+        post = Post.objects.create(author=author, text="Тестовый пост")
+        Comment.objects.create(post=post, author=author, text="Комментарий")
+        Post.objects.filter(pk=post.pk).update(comments_count=7)
+        with self.assertRaises(CommandError):
+            call_command(
+                "reconcile_comments_count", check=True, stdout=StringIO()
+            )
+        call_command("reconcile_comments_count", stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+    def test_delete_with_stale_counter(self):
+        """Удаление комментария не уводит отставший счётчик ниже нуля"""
+        author = User.objects.create_user(username="author")
+        post = Post.objects.create(author=author, text="Тестовый пост")
+        comment = Comment.objects.create(
+            post=post, author=author, text="Комментарий"
+        )
+        Post.objects.filter(pk=post.pk).update(comments_count=0)
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+
+
+class RebuildSearchIndexTests(TestCase):
+    def test_rebuild_indexes_existing_posts(self):
+        """Команда индексирует посты, созданные мимо сигналов"""
+        author = User.objects.create_user(username="author")
+        Post.objects.bulk_create([
+            Post(author=author, text="Пушкин"),
+            Post(author=author, text="Лермонтов"),
+        ])
+        self.assertEqual(search_posts("Пушкин").count(), 0)
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(search_posts("Пушкин").count(), 1)
+
+
+class BenchmarkSqliteWritesTests(TestCase):
+    def test_benchmark(self):
+        """Бенчмарк сравнивает оба режима и пишет все записи"""
+        out = StringIO()
+        call_command(
+            "benchmark_sqlite_writes", writers=2, readers=1, writes=5,
+            stdout=out,
+        )
+        output = out.getvalue()
+        self.assertIn("default: записей 10", output)
+        self.assertIn("production: записей 10", output)
+        self.assertIn("Ускорение записи", output)
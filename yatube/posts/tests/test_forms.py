@@ -1,5 +1,6 @@
 import shutil
 import tempfile
+from io import BytesIO
 
 from http import HTTPStatus
 
@@ -7,6 +8,7 @@ from django.test import Client, TestCase
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
 from ..forms import CommentForm, PostForm
 from ..models import Comment, Group, Post, User
@@ -170,6 +172,30 @@ class CommentFormTests(TestCase):
         self.assertEqual(created_comment.text, text["text"])
         self.assertEqual(created_comment.author, self.user)
         self.assertEqual(Comment.objects.count(), (comment_count + 1))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, comment_count + 1)
+
+    def test_edit_keeps_concurrent_counters(self):
+        """Правка поста, прочитанного до комментария и обработки
+        картинки, не возвращает их столбцам старые значения"""
+        stale = Post.objects.get(pk=self.post.pk)
+        self.authorized_client.post(
+            reverse("posts:add_comment", args=(self.post.id,)),
+            data={"text": "Комментарий"},
+        )
+        Post.objects.filter(pk=self.post.pk).update(
+            image_ready=True, image_placeholder="data:image/jpeg;base64,"
+        )
+        form = PostForm({"text": "Исправленный текст"}, instance=stale)
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.text, "Исправленный текст")
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertTrue(self.post.image_ready)
+        self.assertEqual(
+            self.post.image_placeholder, "data:image/jpeg;base64,"
+        )
 
     def test_anon_user_cant_comments(self):
         """Проверка прав на создание комментария"""
@@ -193,3 +219,143 @@ class CommentFormTests(TestCase):
 
         self.assertRedirects(response, expected_url)
         self.assertEqual(Comment.objects.count(), (comment_count))
+
+
+SMALL_GIF = (
+    b"\x47\x49\x46\x38\x39\x61\x02\x00"
+    b"\x01\x00\x80\x00\x00\x00\x00\x00"
+    b"\xFF\xFF\xFF\x21\xF9\x04\x00\x00"
+    b"\x00\x00\x00\x2C\x00\x00\x00\x00"
+    b"\x02\x00\x01\x00\x00\x02\x02\x0C"
+    b"\x0A\x00\x3B"
+)
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    UPLOAD_TEMP_ROOT=tempfile.mkdtemp(),
+    UPLOAD_CHUNK_SIZE=16,
+    UPLOAD_HEADER_LIMIT=40,
+)
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="auth")
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def start(self, content, filename="small.gif"):
+        response = self.authorized_client.post(
+            reverse("posts:upload_start"),
+            {"filename": filename, "size": len(content)},
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        return response.json()["token"]
+
+    def put(self, token, content, start, end):
+        return self.authorized_client.put(
+            reverse("posts:upload_chunk", args=(token,)),
+            data=content[start:end],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(content)}",
+        )
+
+    def test_chunked_upload_is_used_by_post_form(self):
+        """Картинка, загруженная кусками, попадает в пост по токену"""
+        token = self.start(SMALL_GIF)
+        self.assertEqual(self.put(token, SMALL_GIF, 0, 16).status_code, 200)
+        response = self.put(token, SMALL_GIF, 0, 16)
+        self.assertEqual(response.status_code, HTTPStatus.CONFLICT)
+        self.assertEqual(response.json()["offset"], 16)
+        self.put(token, SMALL_GIF, 16, 32)
+        self.put(token, SMALL_GIF, 32, len(SMALL_GIF))
+        status = self.authorized_client.get(
+            reverse("posts:upload_chunk", args=(token,))
+        ).json()
+        self.assertTrue(status["complete"])
+        self.authorized_client.post(
+            reverse("posts:post_create"),
+            {"text": "Пост с загрузкой", "upload_token": token},
+        )
+        post = Post.objects.get(text="Пост с загрузкой")
+        with post.image.open("rb"):
+            self.assertEqual(post.image.read(), SMALL_GIF)
+        self.assertEqual(post.image_format, "GIF")
+
+    def test_not_an_image_is_rejected_early(self):
+        """Файл без заголовка картинки отклоняется по первым кускам"""
+        content = b"not an image" * 10
+        token = self.start(content, "notes.txt")
+        self.assertEqual(self.put(token, content, 0, 16).status_code, 200)
+        self.assertEqual(self.put(token, content, 16, 32).status_code, 200)
+        response = self.put(token, content, 32, 48)
+        self.assertEqual(
+            response.status_code, HTTPStatus.UNSUPPORTED_MEDIA_TYPE
+        )
+
+    def test_unfinished_or_foreign_upload_is_invalid(self):
+        """Форма не принимает недокачанную или чужую загрузку"""
+        token = self.start(SMALL_GIF)
+        self.put(token, SMALL_GIF, 0, 16)
+        form = PostForm({"text": "Текст"}, upload_token=token, user=self.user)
+        self.assertIn("image", form.errors)
+        stranger = User.objects.create_user(username="stranger")
+        form = PostForm({"text": "Текст"}, upload_token=token, user=stranger)
+        self.assertIn("image", form.errors)
+
+
+def image_file(name, image_format, size=(20, 20), frames=1):
+    buffer = BytesIO()
+    images = [Image.new("RGB", size, (shade, 0, 0)) for shade in range(frames)]
+    images[0].save(
+        buffer, image_format, save_all=frames > 1, append_images=images[1:]
+    )
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    UPLOAD_TEMP_ROOT=tempfile.mkdtemp(),
+    IMAGE_MAX_PIXELS=1000,
+    IMAGE_MAX_FRAMES=2,
+)
+class ImageLimitsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="auth")
+
+    def form(self, image):
+        return PostForm({"text": "Текст"}, files={"image": image})
+
+    def test_image_within_limits_is_valid(self):
+        """Картинка в пределах лимитов проходит проверку"""
+        self.assertTrue(self.form(image_file("ok.png", "PNG")).is_valid())
+
+    def test_limits_are_checked(self):
+        """Формат, число пикселей и кадров проверяются по заголовку"""
+        cases = {
+            "формат": image_file("image.bmp", "BMP"),
+            "пиксели": image_file("big.png", "PNG", size=(40, 40)),
+            "кадры": image_file("anim.gif", "GIF", frames=3),
+        }
+        for case, image in cases.items():
+            with self.subTest(case=case):
+                self.assertIn("image", self.form(image).errors)
+
+    def test_chunked_upload_rejected_by_header(self):
+        """Загрузка кусками прерывается, как только заголовок нарушил
+        лимит"""
+        client = Client()
+        client.force_login(self.user)
+        content = image_file("big.png", "PNG", size=(40, 40)).read()
+        token = client.post(
+            reverse("posts:upload_start"),
+            {"filename": "big.png", "size": len(content)},
+        ).json()["token"]
+        response = client.put(
+            reverse("posts:upload_chunk", args=(token,)),
+            data=content,
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes 0-{len(content) - 1}/{len(content)}",
+        )
+        self.assertEqual(
+            response.status_code, HTTPStatus.UNSUPPORTED_MEDIA_TYPE
+        )
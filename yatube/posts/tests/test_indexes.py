@@ -0,0 +1,110 @@
+import re
+from unittest import skipUnless
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post, User
+from posts.utils import CURSOR_NEXT, encode_cursor
+
+# Полный просмотр — SCAN таблицы без индекса или по покрывающему
+# индексу (так SQLite считает COUNT(*) всей таблицы). Проход по
+# обычному индексу в его порядке останавливается на LIMIT, а SCAN
+# подзапроса читает уже отобранные по индексу строки.
+FULL_SCAN_RE = re.compile(
+    r"\bSCAN (TABLE )?(?!subquery\b)\w+(?!.* USING INDEX )"
+)
+TEMP_BTREE = "USE TEMP B-TREE"
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN SQLite")
+class QueryPlanTests(TestCase):
+    """Основные запросы лент идут по индексам: без полного просмотра
+    таблиц и без сортировки во временном B-дереве."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author")
+        cls.reader = User.objects.create_user(username="reader")
+        cls.group = Group.objects.create(
+            title="Тестовая группа",
+            slug="test-slug",
+            description="Тестовое описание",
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text="Тестовый пост"
+        )
+        cls.comment = Comment.objects.create(
+            post=cls.post, author=cls.reader, text="Комментарий"
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def query_plans(self, url):
+        """Планы всех SELECT, которые выполнил view: [(sql, [строки])]."""
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                if not query["sql"].startswith("SELECT"):
+                    continue
+                cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                plans.append(
+                    (query["sql"], [row[-1] for row in cursor.fetchall()])
+                )
+        return plans
+
+    def assert_plans(self, url):
+        for sql, plan in self.query_plans(url):
+            for line in plan:
+                self.assertIsNone(
+                    FULL_SCAN_RE.search(line), f"{url}: {line}\n{sql}"
+                )
+                self.assertNotIn(TEMP_BTREE, line, f"{url}: {sql}")
+
+    def listing_urls(self):
+        cursor = encode_cursor(
+            CURSOR_NEXT, self.post.pub_date, self.post.pk + 1
+        )
+        comments_cursor = encode_cursor(
+            CURSOR_NEXT, self.comment.created, self.comment.pk + 1
+        )
+        return [
+            reverse("posts:group_list", args=[self.group.slug]),
+            reverse("posts:group_list", args=[self.group.slug])
+            + f"?cursor={cursor}",
+            reverse("posts:profile", args=[self.author.username]),
+            reverse("posts:profile", args=[self.author.username])
+            + f"?cursor={cursor}",
+            reverse("posts:post_detail", args=[self.post.pk]),
+            reverse("posts:post_comments", args=[self.post.pk])
+            + f"?cursor={comments_cursor}",
+        ]
+
+    def test_listing_queries_use_indexes(self):
+        """Группа, профиль и комментарии читаются по составным индексам"""
+        for cursor_mode in (False, True):
+            with self.settings(PAGE_CURSOR_MODE=cursor_mode):
+                for url in self.listing_urls():
+                    with self.subTest(url=url, cursor_mode=cursor_mode):
+                        self.assert_plans(url)
+
+    def test_index_page_is_read_in_date_order(self):
+        """Главная идёт по индексу даты без отдельной сортировки.
+
+        Проверяется курсорный режим: номерная пагинация считает
+        COUNT(*) по всей таблице постов.
+        """
+        with self.settings(PAGE_CURSOR_MODE=True):
+            self.assert_plans(reverse("posts:index"))
+
+    def test_follow_index_does_not_scan_posts(self):
+        """Лента подписок не просматривает таблицы целиком"""
+        self.assert_plans(reverse("posts:follow_index"))
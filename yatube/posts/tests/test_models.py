@@ -1,6 +1,7 @@
 from django.test import TestCase
 
-from ..models import Comment, Group, Post, User
+from ..models import Comment, Follow, Group, Post, User
+from ..stats import get_author_stats
 
 
 class PostModelTest(TestCase):
@@ -35,3 +36,22 @@ class PostModelTest(TestCase):
         self.assertEqual(expected, Post.__str__(post))
         self.assertEqual(expected_group, Group.__str__(group))
         self.assertEqual(expected_comment, Comment.__str__(comment))
+
+
+class AuthorStatsTest(TestCase):
+    def test_counters_follow_writes(self):
+        """Счётчики автора меняются вместе с постами и подписками"""
+        author = User.objects.create_user(username='author')
+        user = User.objects.create_user(username='user')
+        self.assertEqual(get_author_stats(author).posts_count, 0)
+        post = Post.objects.create(author=author, text='Тестовый пост')
+        follow = Follow.objects.create(user=user, author=author)
+        stats = get_author_stats(author)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.followers_count, 1)
+        self.assertEqual(get_author_stats(user).following_count, 1)
+        post.delete()
+        follow.delete()
+        stats.refresh_from_db()
+        self.assertEqual(stats.posts_count, 0)
+        self.assertEqual(stats.followers_count, 0)
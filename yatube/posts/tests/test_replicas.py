@@ -0,0 +1,133 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Follow, Post, User
+from ..replicas import (PrimaryReplicaRouter, ReplicaMiddleware,
+                        copy_database, read_from_replica)
+
+router = PrimaryReplicaRouter()
+
+
+@read_from_replica
+def routed_view(request):
+    """Отвечает базой, которую роутер выбрал бы для чтения."""
+    return HttpResponse(router.db_for_read(Post))
+
+
+def write_view(request):
+    router.db_for_write(Post)
+    return HttpResponse(router.db_for_read(Post))
+
+
+@override_settings(DATABASE_REPLICAS=("replica",))
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def call(self, view, method="get", cookies=None):
+        request = getattr(self.factory, method)("/")
+        request.COOKIES.update(cookies or {})
+        return ReplicaMiddleware(view)(request)
+
+    def test_read_only_view_reads_replica(self):
+        """GET-запрос в view для чтения идёт на реплику"""
+        self.assertEqual(self.call(routed_view).content, b"replica")
+        self.assertEqual(router.db_for_read(Post), "default")
+
+    def test_other_requests_read_primary(self):
+        """POST и view без декоратора читают с primary"""
+        self.assertEqual(
+            self.call(routed_view, method="post").content, b"default"
+        )
+        self.assertEqual(self.call(write_view).content, b"default")
+
+    def test_write_pins_reads_to_primary(self):
+        """После записи чтения прилипают к primary по cookie"""
+        response = self.call(write_view)
+        cookies = {"primary_until": response.cookies["primary_until"].value}
+        self.assertEqual(
+            self.call(routed_view, cookies=cookies).content, b"default"
+        )
+        expired = {"primary_until": "0"}
+        self.assertEqual(
+            self.call(routed_view, cookies=expired).content, b"replica"
+        )
+
+    def test_comment_sets_sticky_cookie(self):
+        """Комментарий ставит cookie прилипания к primary"""
+        author = User.objects.create_user(username="author")
+        post = Post.objects.create(author=author, text="Тестовый пост")
+        self.client.force_login(author)
+        response = self.client.post(
+            reverse("posts:add_comment", args=[post.pk]), {"text": "Текст"}
+        )
+        self.assertIn("primary_until", response.cookies)
+
+    def test_replicas_are_not_migrated(self):
+        """migrate не трогает реплики: схема приезжает с копией"""
+        self.assertTrue(router.allow_migrate("default", "posts"))
+        self.assertFalse(router.allow_migrate("replica", "posts"))
+
+
+def replica_for(*models):
+    """db_for_read, который отправляет models на «реплику» — тестовую
+    базу archive со схемой, но без строк."""
+    def db_for_read(router, model, **hints):
+        return "archive" if model in models else "default"
+    return db_for_read
+
+
+class ReplicaViewTests(TestCase):
+    databases = {"default", "archive"}
+
+    def test_profile_reads_are_routed(self):
+        """Без шардов профиль не прибивает чтение постов и подписки
+        к primary: базу выбирает роутер реплик"""
+        cache.clear()
+        author = User.objects.create_user(username="author")
+        Post.objects.create(author=author, text="Тестовый пост")
+        self.client.force_login(User.objects.create_user(username="reader"))
+        with mock.patch.object(
+            PrimaryReplicaRouter, "db_for_read", replica_for(Post, Follow)
+        ), CaptureQueriesContext(connections["archive"]) as replica:
+            response = self.client.get(
+                reverse("posts:profile", args=[author.username])
+            )
+        self.assertNotContains(response, "Тестовый пост")
+        tables = " ".join(query["sql"] for query in replica.captured_queries)
+        self.assertIn('"posts_post"', tables)
+        self.assertIn('"posts_follow"', tables)
+
+
+class CopyDatabaseTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_replica_catches_up_after_copy(self):
+        """Реплика видит запись primary только после копирования"""
+        primary = os.path.join(self.directory, "primary.sqlite3")
+        replica = os.path.join(self.directory, "replica.sqlite3")
+        connection = sqlite3.connect(primary)
+        connection.execute("CREATE TABLE post (text TEXT)")
+        connection.commit()
+        copy_database(primary, replica)
+        connection.execute("INSERT INTO post VALUES ('новый пост')")
+        connection.commit()
+        connection.close()
+        query = "SELECT count(*) FROM post"
+        with sqlite3.connect(replica) as lagging:
+            self.assertEqual(lagging.execute(query).fetchone()[0], 0)
+        copy_database(primary, replica)
+        with sqlite3.connect(replica) as synced:
+            self.assertEqual(synced.execute(query).fetchone()[0], 1)
@@ -0,0 +1,314 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from ..management.commands.collect_media_garbage import (digest,
+                                                         referenced_files)
+from .. import shards
+from ..models import (Comment, Follow, Group, ImageVariant, Post,
+                      PostLocation, StoredFile, TimelineEntry, User)
+from ..shards import ShardError, ShardRouter, shard_for_author
+from ..stats import collect_stats, compute_stats
+from ..utils import CURSOR_NEXT, encode_cursor
+from .test_thumbnails import MEDIA_ROOT, SMALL_GIF
+
+SHARDS = ("shard_1", "shard_2")
+
+
+@override_settings(POST_SHARDS=SHARDS)
+class ShardingTests(TestCase):
+    databases = {"default", *SHARDS}
+
+    def setUp(self):
+        cache.clear()
+        self.first = User.objects.create_user(username="first")
+        self.second = User.objects.create_user(username="second")
+        self.reader = User.objects.create_user(username="reader")
+        self.client.force_login(self.reader)
+
+    def create_posts(self, count):
+        # Шард выбирается по подсказке instance, как в form.save():
+        # objects.create() без using() роутер отклоняет.
+        posts = []
+        for number in range(count):
+            post = Post(
+                author=(self.first, self.second)[number % 2],
+                text=f"Пост {number}",
+            )
+            post.save()
+            posts.append(post)
+        return posts
+
+    def other_shard(self, shard):
+        return SHARDS[1 - SHARDS.index(shard)]
+
+    def test_posts_are_written_to_author_shard(self):
+        """Посты автора пишутся в его шард с id из каталога"""
+        first_post, second_post = self.create_posts(2)
+        first_shard = shard_for_author(self.first.pk)
+        self.assertNotEqual(first_shard, shard_for_author(self.second.pk))
+        self.assertEqual(first_post._state.db, first_shard)
+        self.assertTrue(
+            Post.objects.using(first_shard).filter(pk=first_post.pk).exists()
+        )
+        self.assertFalse(Post.objects.filter(pk=first_post.pk).exists())
+        self.assertNotEqual(first_post.pk, second_post.pk)
+
+    def test_index_merges_shards_by_date(self):
+        """Главная собирается со всех шардов в порядке даты"""
+        posts = self.create_posts(12)
+        expected = [post.pk for post in reversed(posts)]
+        response = self.client.get(reverse("posts:index"))
+        page = response.context["page_obj"]
+        self.assertEqual([post.pk for post in page], expected[:10])
+        response = self.client.get(
+            reverse("posts:index"), {"cursor": page.next_cursor()}
+        )
+        self.assertEqual(
+            [post.pk for post in response.context["page_obj"]], expected[10:]
+        )
+        last = response.context["page_obj"][-1]
+        url = reverse("posts:index")
+        self.assertEqual(self.client.get(url, {"page": 3}).status_code, 404)
+        response = self.client.get(url, {"cursor": encode_cursor(
+            CURSOR_NEXT, last.pub_date, last.pk
+        )})
+        self.assertEqual(response.status_code, 404)
+
+    def test_comment_is_stored_next_to_post(self):
+        """Комментарий ложится в шард поста, а страница поста его видит"""
+        post = self.create_posts(1)[0]
+        self.client.post(
+            reverse("posts:add_comment", args=[post.pk]), {"text": "Привет"}
+        )
+        self.assertTrue(
+            Comment.objects.using(post._state.db).filter(post=post).exists()
+        )
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        response = self.client.get(
+            reverse("posts:post_detail", args=[post.pk])
+        )
+        self.assertContains(response, "Привет")
+
+    def test_follow_index_merges_followed_authors(self):
+        """Лента подписок собирает посты авторов с разных шардов"""
+        for author in (self.first, self.second):
+            self.client.get(
+                reverse("posts:profile_follow", args=[author.username])
+            )
+            self.assertTrue(
+                Follow.objects.using(shard_for_author(author.pk))
+                .filter(user=self.reader, author=author).exists()
+            )
+        posts = self.create_posts(4)
+        response = self.client.get(reverse("posts:follow_index"))
+        self.assertEqual(
+            [post.pk for post in response.context["page_obj"]],
+            [post.pk for post in reversed(posts)],
+        )
+
+    def test_move_author_shard(self):
+        """Автор переезжает в другой шард вместе с постами"""
+        post = self.create_posts(1)[0]
+        Comment(post=post, author=self.reader, text="Текст").save()
+        source = post._state.db
+        target = self.other_shard(source)
+        call_command(
+            "move_author_shard", self.first.username, to=target,
+            stdout=StringIO(),
+        )
+        self.assertEqual(shard_for_author(self.first.pk), target)
+        self.assertFalse(Post.objects.using(source).exists())
+        self.assertFalse(Comment.objects.using(source).exists())
+        moved = Post.objects.using(target).get(pk=post.pk)
+        self.assertEqual(moved.comments.count(), 1)
+        response = self.client.get(
+            reverse("posts:post_detail", args=[post.pk])
+        )
+        self.assertContains(response, "Текст")
+
+    def test_unrouted_write_is_rejected(self):
+        """Запись без подсказки instance не уходит молча в default"""
+        with self.assertRaises(ShardError):
+            Post.objects.create(author=self.first, text="Без шарда")
+        with self.assertRaises(ShardError):
+            Post.objects.filter(author=self.first).update(text="Текст")
+        self.assertFalse(Post.objects.using("default").exists())
+
+    @mock.patch.object(shards, "_post_ids_reserved", False)
+    def test_shard_post_ids_skip_default_posts(self):
+        """Посты на шардах не занимают id постов, созданных до
+        шардирования, и те переезжают из default без потерь"""
+        legacy = Post.objects.using("default").create(
+            author=self.first, text="Пост до шардов"
+        )
+        post = Post(author=self.second, text="Пост на шарде")
+        post.save()
+        self.assertGreater(post.pk, legacy.pk)
+        call_command(
+            "move_author_shard", self.first.username, source="default",
+            stdout=StringIO(),
+        )
+        self.assertFalse(Post.objects.using("default").exists())
+        for pk, text in ((legacy.pk, "Пост до шардов"),
+                         (post.pk, "Пост на шарде")):
+            response = self.client.get(
+                reverse("posts:post_detail", args=[pk])
+            )
+            self.assertContains(response, text)
+
+    def test_move_fails_on_taken_post_id(self):
+        """Id, который каталог уже отдал другому автору, останавливает
+        перенос, а не теряет пост"""
+        legacy = Post.objects.using("default").create(
+            author=self.first, text="Пост до шардов"
+        )
+        PostLocation.objects.create(pk=legacy.pk, author=self.second)
+        with self.assertRaises(CommandError):
+            call_command(
+                "move_author_shard", self.first.username, source="default",
+                stdout=StringIO(),
+            )
+        self.assertTrue(
+            Post.objects.using("default").filter(pk=legacy.pk).exists()
+        )
+        for shard in SHARDS:
+            self.assertFalse(Post.objects.using(shard).exists())
+
+    def test_move_keeps_rows_it_did_not_copy(self):
+        """Из исходной базы удаляются только скопированные строки"""
+        post = self.create_posts(1)[0]
+        source = post._state.db
+        move_author = shards.move_author
+
+        def post_during_move(author_id, shard):
+            Post.objects.using(source).create(
+                author=self.first, text="Поздний"
+            )
+            move_author(author_id, shard)
+
+        with mock.patch.object(shards, "move_author", post_during_move):
+            shards.move_author_rows(
+                self.first.pk, source, self.other_shard(source)
+            )
+        self.assertEqual(
+            list(Post.objects.using(source).values_list("text", flat=True)),
+            ["Поздний"],
+        )
+
+    def test_data_migrations_skip_shards(self):
+        """Шарду достаётся схема, а миграции данных без model_name
+        выполняются только в default"""
+        router = ShardRouter()
+        self.assertFalse(router.allow_migrate("shard_1", "posts"))
+        self.assertIsNone(router.allow_migrate("default", "posts"))
+        self.assertIsNone(
+            router.allow_migrate("shard_1", "posts", model_name="post")
+        )
+
+    def test_search_reads_posts_from_shards(self):
+        """Поиск находит посты всех шардов, и число результатов
+        совпадает со страницей"""
+        self.create_posts(2)
+        response = self.client.get(reverse("posts:search"), {"q": "Пост"})
+        page = response.context["page_obj"]
+        self.assertEqual(page.paginator.count, 2)
+        self.assertEqual(len(page), 2)
+
+    def test_stats_are_collected_from_shards(self):
+        """Пересчёт счётчиков видит посты и подписки на шардах"""
+        self.create_posts(3)
+        Follow(user=self.reader, author=self.first).save()
+        stats = collect_stats()
+        self.assertEqual(stats[self.first.pk]["posts_count"], 2)
+        self.assertEqual(stats[self.second.pk]["posts_count"], 1)
+        self.assertEqual(stats[self.first.pk]["followers_count"], 1)
+        self.assertEqual(stats[self.reader.pk]["following_count"], 1)
+        self.assertEqual(compute_stats(self.reader.pk)["following_count"], 1)
+        call_command("rebuild_author_stats", check=True, stdout=StringIO())
+
+    def test_media_garbage_keeps_shard_files(self):
+        """Сборщик мусора не считает мусором картинки и варианты
+        постов на шардах"""
+        post = self.create_posts(1)[0]
+        Post.objects.using(post._state.db).filter(pk=post.pk).update(
+            image="posts/aa/bb/shard.gif"
+        )
+        ImageVariant(
+            post=post, width=320, height=142, format="jpeg",
+            file="variants/aa/bb/shard-320.jpg",
+        ).save()
+        referenced = referenced_files()
+        self.assertIn(digest("posts/aa/bb/shard.gif"), referenced)
+        self.assertIn(digest("variants/aa/bb/shard-320.jpg"), referenced)
+
+    @override_settings(MEDIA_ROOT=MEDIA_ROOT)
+    def test_reprocess_images_on_shards(self):
+        """reprocess_images обрабатывает картинки постов всех шардов,
+        а общий файл считается по всем шардам"""
+        posts = []
+        for author in (self.first, self.second):
+            post = Post(
+                author=author, text="Пост с картинкой",
+                image=SimpleUploadedFile(
+                    "small.gif", SMALL_GIF, content_type="image/gif"
+                ),
+            )
+            post.save()
+            posts.append(post)
+        self.assertEqual(
+            StoredFile.objects.get(name=posts[0].image.name).references, 2
+        )
+        call_command("reprocess_images", workers=1, stdout=StringIO())
+        for post in posts:
+            post.refresh_from_db()
+            self.assertTrue(post.image_ready)
+            self.assertEqual(post.image_variants.count(), 2)
+
+    def test_deleting_user_cleans_shards(self):
+        """Удаление пользователя удаляет его строки на всех шардах"""
+        first_post, second_post = self.create_posts(2)
+        Comment(post=second_post, author=self.first, text="Текст").save()
+        Follow(user=self.first, author=self.second).save()
+        Follow(user=self.reader, author=self.first).save()
+        user_id = self.first.pk
+        self.first.delete()
+        for shard in SHARDS:
+            self.assertFalse(
+                Post.objects.using(shard).filter(author_id=user_id).exists()
+            )
+            self.assertFalse(
+                Comment.objects.using(shard).filter(author_id=user_id)
+                .exists()
+            )
+            self.assertFalse(
+                Follow.objects.using(shard).filter(user_id=user_id).exists()
+            )
+            self.assertFalse(
+                Follow.objects.using(shard).filter(author_id=user_id)
+                .exists()
+            )
+            self.assertFalse(
+                TimelineEntry.objects.using(shard).filter(user_id=user_id)
+                .exists()
+            )
+        second_post.refresh_from_db()
+        self.assertEqual(second_post.comments_count, 0)
+
+    def test_deleting_group_detaches_shard_posts(self):
+        """Посты удалённой группы на шардах остаются без группы"""
+        group = Group.objects.create(
+            title="Тестовая группа", slug="test-slug",
+            description="Тестовое описание",
+        )
+        post = Post(author=self.first, group=group, text="Пост в группе")
+        post.save()
+        group.delete()
+        post.refresh_from_db()
+        self.assertIsNone(post.group_id)
@@ -0,0 +1,83 @@
+import threading
+from unittest import mock, skipUnless
+
+from django.db import OperationalError, connection
+from django.test import TestCase, override_settings
+
+from ..models import User
+from ..sqlite import _write_lock, run_serialized, serialized_write
+
+
+def write_lock_is_free():
+    """Свободен ли замок записи для другого потока."""
+    result = []
+
+    def try_acquire():
+        acquired = _write_lock.acquire(blocking=False)
+        if acquired:
+            _write_lock.release()
+        result.append(acquired)
+
+    thread = threading.Thread(target=try_acquire)
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+@skipUnless(connection.vendor == "sqlite", "Профиль только для SQLite")
+class SqliteProfileTests(TestCase):
+    def test_pragmas_are_applied(self):
+        """Новое соединение получает настройки SQLITE_PRAGMAS"""
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+
+@override_settings(SQLITE_WRITE_RETRIES=2, SQLITE_WRITE_BACKOFF=0)
+class SerializedWriteTests(TestCase):
+    def test_locked_write_is_retried(self):
+        """Заблокированная запись повторяется, пока не пройдёт"""
+        write = mock.Mock(side_effect=[
+            OperationalError("database is locked"), "готово"
+        ])
+        self.assertEqual(run_serialized(write), "готово")
+        self.assertEqual(write.call_count, 2)
+
+    def test_retries_are_limited(self):
+        """После SQLITE_WRITE_RETRIES повторов ошибка уходит наверх"""
+        write = mock.Mock(side_effect=OperationalError("database is locked"))
+        with self.assertRaises(OperationalError):
+            run_serialized(write)
+        self.assertEqual(write.call_count, 3)
+
+    def test_other_errors_are_not_retried(self):
+        """Ошибки, не связанные с блокировкой, не повторяются"""
+        write = mock.Mock(side_effect=OperationalError("no such table"))
+        with self.assertRaises(OperationalError):
+            run_serialized(write)
+        self.assertEqual(write.call_count, 1)
+
+    def test_nested_write_runs_once(self):
+        """Внутри открытой транзакции запись не повторяется"""
+        view = mock.Mock(side_effect=OperationalError("database is locked"))
+        with self.assertRaises(OperationalError):
+            serialized_write(view)()
+        self.assertEqual(view.call_count, 1)
+
+    @skipUnless(connection.vendor == "sqlite", "Замок только для SQLite")
+    def test_lock_is_held_only_for_writes(self):
+        """Замок берётся на первой записи и отпускается после view"""
+        states = []
+
+        def view():
+            states.append(write_lock_is_free())
+            User.objects.filter(username="writer").exists()
+            states.append(write_lock_is_free())
+            User.objects.create_user(username="writer")
+            states.append(write_lock_is_free())
+
+        serialized_write(view)()
+        states.append(write_lock_is_free())
+        self.assertEqual(states, [True, True, False, True])
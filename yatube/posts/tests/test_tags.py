@@ -0,0 +1,42 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from ..models import Group, Post, User
+from ..templatetags.post_tags import post_articles
+
+
+class RenderPostsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="author")
+        cls.group = Group.objects.create(
+            title="Тестовая группа",
+            slug="test-slug",
+            description="Тестовое описание",
+        )
+        for num in range(3):
+            Post.objects.create(
+                author=cls.user, group=cls.group, text=f"Пост {num}"
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def get_posts(self):
+        return list(Post.objects.select_related("author", "group"))
+
+    def test_fragments_are_reused(self):
+        """Повторная отрисовка берёт карточки из кэша одним запросом"""
+        html = post_articles(self.get_posts())
+        self.assertEqual(len(html), 3)
+        with self.assertTemplateNotUsed("posts/includes/article.html"):
+            self.assertEqual(post_articles(self.get_posts()), html)
+
+    def test_changed_post_is_rendered_again(self):
+        """Изменённый пост получает новую версию ключа"""
+        post_articles(self.get_posts())
+        Post.objects.filter(text="Пост 1").update(text="Исправленный пост")
+        html = "".join(post_articles(self.get_posts()))
+        self.assertIn("Исправленный пост", html)
+        self.assertIn("Пост 0", html)
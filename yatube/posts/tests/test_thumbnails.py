@@ -0,0 +1,548 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from ..models import ArchivedPost, Post, StoredFile, User
+from ..templatetags.post_tags import post_articles, ready_thumbnail
+from ..thumbnails import (generate_thumbnails, process_post_image,
+                          schedule_post_image)
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+SMALL_GIF = (
+    b"\x47\x49\x46\x38\x39\x61\x02\x00"
+    b"\x01\x00\x80\x00\x00\x00\x00\x00"
+    b"\xFF\xFF\xFF\x21\xF9\x04\x00\x00"
+    b"\x00\x00\x00\x2C\x00\x00\x00\x00"
+    b"\x02\x00\x01\x00\x00\x02\x02\x0C"
+    b"\x0A\x00\x3B"
+)
+
+
+def small_png(shade):
+    """Картинка с уникальным содержимым: одинаковые файлы хранилище
+    сохраняет один раз."""
+    buffer = BytesIO()
+    Image.new("RGB", (2, 1), (shade, shade, shade)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class PregeneratedThumbnailTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="author")
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text="Тестовый пост",
+            image=SimpleUploadedFile(
+                name="small.gif", content=SMALL_GIF, content_type="image/gif"
+            ),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_original_is_shown_until_thumbnail_is_ready(self):
+        """Пока миниатюры нет, лента показывает оригинал, не создавая её"""
+        self.assertIsNone(
+            ready_thumbnail(self.post.image, "900x400", crop="center")
+        )
+        response = self.client.get(reverse("posts:index"))
+        self.assertContains(response, self.post.image.url)
+        self.assertIsNone(
+            ready_thumbnail(self.post.image, "900x400", crop="center")
+        )
+
+    def test_generated_thumbnail_is_used(self):
+        """После фоновой генерации лента берёт готовую миниатюру"""
+        generate_thumbnails(self.post.image.name)
+        thumbnail = ready_thumbnail(
+            self.post.image, "900x400", crop="center", upscale=True
+        )
+        self.assertIsNotNone(thumbnail)
+        response = self.client.get(reverse("posts:index"))
+        self.assertContains(response, thumbnail.url)
+
+    def test_page_thumbnails_are_resolved_in_one_batch(self):
+        """Миниатюры всей страницы берутся одним запросом к KV-хранилищу"""
+        for num in range(3):
+            post = Post.objects.create(
+                author=self.user,
+                text=f"Пост {num}",
+                image=SimpleUploadedFile(
+                    name="small.png", content=small_png(num),
+                    content_type="image/png",
+                ),
+            )
+            generate_thumbnails(post.image.name)
+        cache.clear()
+        posts = list(Post.objects.select_related("author", "group"))
+        with self.assertNumQueries(1):
+            html = "".join(post_articles(posts))
+        self.assertEqual(html.count("/cache/"), 3)
+        self.assertIn(self.post.image.url, html)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageMetadataTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="author")
+        self.post = Post.objects.create(
+            author=self.user,
+            text="Тестовый пост",
+            image=SimpleUploadedFile(
+                name="small.gif", content=SMALL_GIF, content_type="image/gif"
+            ),
+        )
+
+    def test_metadata_saved_on_upload(self):
+        """Размеры, вес и формат сохраняются при загрузке"""
+        self.post.refresh_from_db()
+        self.assertEqual(
+            (self.post.image_width, self.post.image_height,
+             self.post.image_size, self.post.image_format),
+            (2, 1, len(SMALL_GIF), "GIF"),
+        )
+
+    def test_backfill_command(self):
+        """Команда заполняет метаданные старых постов"""
+        Post.objects.update(image_width=None, image_height=None,
+                            image_size=None, image_format="")
+        call_command("backfill_image_metadata", stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.image_width, 2)
+        self.assertEqual(self.post.image_format, "GIF")
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="author")
+        self.post = Post.objects.create(
+            author=self.user,
+            text="Тестовый пост",
+            image=SimpleUploadedFile(
+                name="small.gif", content=SMALL_GIF, content_type="image/gif"
+            ),
+        )
+
+    def test_variants_are_tracked_and_rendered(self):
+        """Варианты картинки сохраняются в таблицу и попадают в srcset"""
+        response = self.client.get(reverse("posts:index"))
+        self.assertNotContains(response, "srcset")
+        process_post_image(self.post.pk)
+        self.post.refresh_from_db()
+        self.assertTrue(self.post.image_ready)
+        variants = list(self.post.image_variants.all())
+        self.assertEqual(
+            {(variant.width, variant.format) for variant in variants},
+            {(320, "webp"), (320, "jpeg")},
+        )
+        response = self.client.get(reverse("posts:index"))
+        for variant in variants:
+            self.assertContains(response, f"{variant.file.url} 320w")
+        self.assertContains(response, 'type="image/webp"')
+
+    def test_new_upload_resets_ready_flag(self):
+        """Новая картинка снова ждёт обработки"""
+        process_post_image(self.post.pk)
+        self.post.image = SimpleUploadedFile(
+            name="other.gif", content=SMALL_GIF, content_type="image/gif"
+        )
+        self.post.save()
+        self.post.refresh_from_db()
+        self.assertFalse(self.post.image_ready)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ReprocessImagesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="author")
+        self.posts = [
+            Post.objects.create(
+                author=self.user,
+                text=f"Тестовый пост {number}",
+                image=SimpleUploadedFile(
+                    name="small.gif", content=SMALL_GIF,
+                    content_type="image/gif",
+                ),
+            )
+            for number in range(3)
+        ]
+        self.state_file = tempfile.mktemp(dir=MEDIA_ROOT)
+
+    def reprocess(self, workers=1, **options):
+        out = StringIO()
+        call_command(
+            "reprocess_images", workers=workers, chunk_size=2,
+            state_file=self.state_file, stdout=out, **options
+        )
+        return out.getvalue()
+
+    def test_reprocess_and_resume(self):
+        """Команда обрабатывает картинки пачками и продолжает с места
+        остановки"""
+        output = self.reprocess()
+        self.assertIn("3/3", output)
+        for post in self.posts:
+            post.refresh_from_db()
+            self.assertTrue(post.image_ready)
+            self.assertEqual(post.image_variants.count(), 2)
+        with open(self.state_file) as file:
+            self.assertEqual(file.read(), str(self.posts[-1].pk))
+        output = self.reprocess()
+        self.assertIn("Картинок к обработке: 0", output)
+
+    def test_pool_workers_do_not_write_database(self):
+        """Процессы пула пишут только файлы, а миниатюры в KV-хранилище
+        записывает родительский процесс"""
+        # Тестовая база в памяти процессам пула не видна: запись в неё
+        # из пула закончилась бы ошибкой.
+        output = self.reprocess(workers=2)
+        self.assertIn("с ошибкой: 0", output)
+        for post in self.posts:
+            post.refresh_from_db()
+            self.assertTrue(post.image_ready)
+            self.assertIsNotNone(ready_thumbnail(
+                post.image, "900x400", crop="center", upscale=True
+            ))
+
+    def test_reprocess_replaces_variants(self):
+        """Повторная обработка не плодит строки и файлы вариантов"""
+        self.reprocess()
+        first = list(self.posts[0].image_variants.values_list("file"))
+        os.remove(self.state_file)
+        self.reprocess()
+        self.assertEqual(
+            list(self.posts[0].image_variants.values_list("file")), first
+        )
+
+    def test_reprocess_skips_changed_image(self):
+        """Пост, картинку которого заменили во время обработки, не
+        получает результаты старой картинки"""
+        from ..management.commands import reprocess_images
+
+        changed = self.posts[0]
+        render = reprocess_images.render_post_image
+
+        def render_and_edit(name):
+            Post.objects.filter(pk=changed.pk).update(
+                image="posts/other.gif", image_ready=False
+            )
+            return render(name)
+
+        with mock.patch.object(
+            reprocess_images, "render_post_image", render_and_edit
+        ):
+            self.reprocess()
+        changed.refresh_from_db()
+        self.assertFalse(changed.image_ready)
+        self.assertFalse(changed.image_variants.exists())
+        for post in self.posts[1:]:
+            post.refresh_from_db()
+            self.assertTrue(post.image_ready)
+            self.assertEqual(post.image_variants.count(), 2)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ContentAddressedStorageTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="author")
+        self.post = self.create_post()
+
+    def create_post(self):
+        return Post.objects.create(
+            author=self.user,
+            text="Тестовый пост",
+            image=SimpleUploadedFile(
+                name="Small.GIF", content=SMALL_GIF, content_type="image/gif"
+            ),
+        )
+
+    def test_upload_is_named_by_content(self):
+        """Новая картинка ложится в posts/ab/cd/<sha256>.<ext>"""
+        self.assertRegex(
+            self.post.image.name,
+            r"^posts/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.gif$",
+        )
+
+    def test_duplicates_share_one_file(self):
+        """Одинаковые загрузки ссылаются на один файл, и он удаляется
+        вместе с последней ссылкой"""
+        name = self.post.image.name
+        duplicate = self.create_post()
+        self.assertEqual(duplicate.image.name, name)
+        self.assertEqual(StoredFile.objects.get(name=name).references, 2)
+        duplicate.delete()
+        self.assertEqual(StoredFile.objects.get(name=name).references, 1)
+        self.assertTrue(default_storage.exists(name))
+        self.post.delete()
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_duplicate_reuses_processed_variants(self):
+        """Дубликат получает варианты уже обработанной картинки"""
+        process_post_image(self.post.pk)
+        duplicate = self.create_post()
+        process_post_image(duplicate.pk)
+        duplicate.refresh_from_db()
+        self.assertTrue(duplicate.image_ready)
+        self.assertEqual(
+            list(duplicate.image_variants.values_list("file")),
+            list(self.post.image_variants.values_list("file")),
+        )
+
+    def test_command_moves_flat_files(self):
+        """Команда переносит старые картинки и переписывает Post.image"""
+        flat = FileSystemStorage().save("posts/old.gif", ContentFile(b"GIF"))
+        Post.objects.filter(pk=self.post.pk).update(image=flat)
+        call_command("shard_post_images", stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(
+            self.post.image.name,
+            default_storage.content_name(flat, ContentFile(b"GIF")),
+        )
+        self.assertTrue(default_storage.exists(self.post.image.name))
+        self.assertFalse(default_storage.exists(flat))
+        out = StringIO()
+        call_command("shard_post_images", dry_run=True, stdout=out)
+        self.assertIn("Картинок к переносу: 0", out.getvalue())
+
+    def test_command_counts_duplicates_in_one_batch(self):
+        """Посты пачки с одинаковой картинкой дают по одной ссылке"""
+        duplicate = self.create_post()
+        storage = FileSystemStorage()
+        for post in (self.post, duplicate):
+            flat = storage.save("posts/same.gif", ContentFile(b"SAME"))
+            Post.objects.filter(pk=post.pk).update(image=flat)
+        call_command("shard_post_images", stdout=StringIO())
+        duplicate.refresh_from_db()
+        self.assertEqual(
+            StoredFile.objects.get(name=duplicate.image.name).references, 2
+        )
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ScheduleTests(TransactionTestCase):
+    databases = {"default", "archive"}
+
+    def test_rolled_back_schedule_does_not_block_later_jobs(self):
+        """Откат транзакции не оставляет пост в работе навсегда"""
+        user = User.objects.create_user(username="author")
+        post = Post.objects.create(
+            author=user,
+            text="Тестовый пост",
+            image=SimpleUploadedFile(
+                name="small.png", content=small_png(11),
+                content_type="image/png",
+            ),
+        )
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            schedule_post_image(post)
+            raise RuntimeError
+        schedule_post_image(post)
+        post.refresh_from_db()
+        self.assertTrue(post.image_ready)
+
+    def test_job_writes_primary_for_replica_reads(self):
+        """Задача для поста, прочитанного с реплики, пишет в primary"""
+        cache.clear()
+        user = User.objects.create_user(username="author")
+        post = Post.objects.create(
+            author=user,
+            text="Тестовый пост",
+            image=SimpleUploadedFile(
+                name="small.png", content=small_png(12),
+                content_type="image/png",
+            ),
+        )
+        # Реплика — тестовая база archive с копией автора и поста.
+        User.objects.using("archive").bulk_create([user])
+        Post.objects.using("archive").bulk_create([
+            Post.objects.get(pk=post.pk)
+        ])
+        with self.settings(DATABASE_REPLICAS=("archive",)):
+            response = self.client.get(reverse("posts:index"))
+        self.assertEqual(response.status_code, 200)
+        post.refresh_from_db()
+        self.assertTrue(post.image_ready)
+        self.assertEqual(post.image_variants.count(), 2)
+        self.assertFalse(
+            Post.objects.using("archive").get(pk=post.pk).image_ready
+        )
+
+    def test_archived_post_is_not_scheduled(self):
+        """Для архивного поста миниатюра не ставится в очередь"""
+        user = User.objects.create_user(username="author")
+        archived = ArchivedPost.objects.create(
+            author=user, text="Старый пост", pub_date=timezone.now(),
+            image="posts/missing.png",
+        )
+        with mock.patch(
+            "posts.templatetags.post_tags.schedule_post_image"
+        ) as schedule:
+            self.assertIsNone(ready_thumbnail(archived.image, "900x400"))
+        schedule.assert_not_called()
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(), MEDIA_QUARANTINE_ROOT=tempfile.mkdtemp()
+)
+class CollectMediaGarbageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="author")
+        self.post = Post.objects.create(
+            author=self.user,
+            text="Тестовый пост",
+            image=SimpleUploadedFile(
+                name="small.png", content=small_png(7),
+                content_type="image/png",
+            ),
+        )
+        process_post_image(self.post.pk)
+        self.post.refresh_from_db()
+        self.thumbnail = ready_thumbnail(
+            self.post.image, "900x400", crop="center", upscale=True
+        )
+        self.files = [
+            self.post.image.name,
+            self.thumbnail.name,
+            *self.post.image_variants.values_list("file", flat=True),
+        ]
+        self.orphan = FileSystemStorage().save(
+            "posts/00/00/orphan.png", ContentFile(b"x" * 10)
+        )
+
+    def collect(self, **options):
+        out = StringIO()
+        call_command(
+            "collect_media_garbage", min_age=0, stdout=out, **options
+        )
+        return out.getvalue()
+
+    def test_dry_run_quarantines_orphans(self):
+        """В пробном режиме файлы без ссылок уходят в карантин"""
+        output = self.collect(dry_run=True)
+        self.assertIn("В карантине файлов: 1", output)
+        self.assertIn("(10 байт)", output)
+        self.assertFalse(default_storage.exists(self.orphan))
+        self.assertTrue(os.path.exists(os.path.join(
+            settings.MEDIA_QUARANTINE_ROOT, self.orphan
+        )))
+        for name in self.files:
+            self.assertTrue(default_storage.exists(name), name)
+
+    def test_deleted_post_files_are_collected(self):
+        """Картинка удалённого поста уходит вместе с вариантами
+        и миниатюрами"""
+        self.post.delete()
+        output = self.collect()
+        self.assertIn(f"Удалено файлов: {len(self.files) + 1}", output)
+        for name in self.files:
+            self.assertFalse(default_storage.exists(name), name)
+
+    def test_archived_post_image_is_kept(self):
+        """Картинка архивного поста и её миниатюра остаются, а варианты
+        уходят вместе с горячей строкой"""
+        Post.objects.filter(pk=self.post.pk).update(
+            pub_date=timezone.now() - timedelta(days=400)
+        )
+        call_command("archive_posts", stdout=StringIO())
+        kept, variants = self.files[:2], self.files[2:]
+        self.assertEqual(
+            StoredFile.objects.get(name=self.post.image.name).references, 1
+        )
+        output = self.collect()
+        self.assertIn(f"Удалено файлов: {len(variants) + 1}", output)
+        for name in kept:
+            self.assertTrue(default_storage.exists(name), name)
+        for name in variants:
+            self.assertFalse(default_storage.exists(name), name)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_STORE_MAX_SIDE=100)
+class DownscaleTests(TestCase):
+    def test_large_image_is_downscaled_in_background(self):
+        """Фоновая задача уменьшает слишком большой оригинал"""
+        buffer = BytesIO()
+        Image.new("RGB", (300, 150), (10, 20, 30)).save(buffer, "JPEG")
+        post = Post.objects.create(
+            author=User.objects.create_user(username="author"),
+            text="Тестовый пост",
+            image=SimpleUploadedFile("big.jpg", buffer.getvalue()),
+        )
+        original = post.image.name
+        process_post_image(post.pk)
+        post.refresh_from_db()
+        self.assertNotEqual(post.image.name, original)
+        self.assertEqual((post.image_width, post.image_height), (100, 50))
+        with post.image.open("rb"), Image.open(post.image) as image:
+            self.assertEqual(image.size, (100, 50))
+        self.assertTrue(post.image_ready)
+        self.assertFalse(StoredFile.objects.filter(name=original).exists())
+        self.assertEqual(
+            StoredFile.objects.get(name=post.image.name).references, 1
+        )
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class PlaceholderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_placeholder_is_inlined_into_card(self):
+        """Заглушка считается при загрузке и встраивается в карточку,
+        картинка грузится лениво"""
+        post = Post.objects.create(
+            author=User.objects.create_user(username="author"),
+            text="Тестовый пост",
+            image=SimpleUploadedFile("lqip.png", small_png(40)),
+        )
+        post.refresh_from_db()
+        self.assertFalse(post.image_ready)
+        self.assertTrue(
+            post.image_placeholder.startswith("data:image/jpeg;base64,")
+        )
+        self.assertLess(len(post.image_placeholder), 1024)
+        response = self.client.get(reverse("posts:index"))
+        self.assertContains(response, post.image_placeholder)
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_placeholder_is_built_for_old_posts(self):
+        """Фоновая обработка досчитывает заглушку старых постов"""
+        post = Post.objects.create(
+            author=User.objects.create_user(username="author"),
+            text="Тестовый пост",
+            image=SimpleUploadedFile("old.png", small_png(41)),
+        )
+        placeholder = post.image_placeholder
+        Post.objects.filter(pk=post.pk).update(image_placeholder="")
+        process_post_image(post.pk)
+        post.refresh_from_db()
+        self.assertEqual(post.image_placeholder, placeholder)
@@ -48,6 +48,8 @@ class PostUrlTests(TestCase):
             ("posts:profile", (self.user.username,),
              f"/profile/{self.user.username}/"),
             ("posts:post_detail", (self.post.id,), f"/posts/{self.post.id}/"),
+            ("posts:post_comments", (self.post.id,),
+             f"/posts/{self.post.id}/comments/"),
             ("posts:post_create", None, "/create/"),
             ("posts:post_edit", (self.post.id,),
              f"/posts/{self.post.id}/edit/"),
@@ -1,15 +1,21 @@
 import shutil
 import tempfile
+from io import StringIO
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.cache import cache
-from django.test import Client, TestCase, override_settings
+from django.core.management import call_command
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
 from django.urls import reverse
 
-from posts.models import Comment, Follow, Group, Post, User
+from posts.models import Comment, Follow, Group, Post, TimelineEntry, User
+from posts import timeline
 from posts.forms import PostForm
+from posts.utils import CURSOR_NEXT, CURSOR_PREVIOUS, encode_cursor
 
 MEDIA_ROOT = tempfile.mkdtemp()
 
@@ -164,7 +170,7 @@ class PostPagesTests(TestCase):
             reverse("posts:post_detail", args=(self.post.id,))
         )
 
-        context = response.context["comments"].first()
+        context = response.context["comments"][0]
         context_detail = {
             context.post.id: self.post.id,
             context.text: text,
@@ -180,13 +186,39 @@ class PostPagesTests(TestCase):
         post_cashe = Post.objects.create(author=self.user, text="Тест кэша")
         url = reverse("posts:index")
         response = self.authorized_client.get(url)
-        post_cashe.delete()
+        Post.objects.filter(pk=post_cashe.pk).update(text="Мимо сигналов")
         response_old = self.authorized_client.get(url)
         self.assertEqual(response.content, response_old.content)
-        cache.clear()
+        post_cashe.delete()
         response_new = self.authorized_client.get(url)
         self.assertNotEqual(response_old.content, response_new.content)
 
+    def test_cache_invalidated_by_new_content(self):
+        """Новые пост и комментарий сразу видны на закэшированных лентах"""
+        urls = (
+            reverse("posts:index"),
+            reverse("posts:group_list", args=(self.group.slug,)),
+            reverse("posts:profile", args=(self.user.username,)),
+        )
+        for url in urls:
+            self.authorized_client.get(url)
+        Post.objects.create(
+            author=self.user, group=self.group, text="Свежий пост"
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(
+                    self.authorized_client.get(url), "Свежий пост"
+                )
+        Comment.objects.create(
+            post=self.post, author=self.user_author, text="Комментарий"
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(
+                    self.authorized_client.get(url), "Комментариев: 1"
+                )
+
     def test_custom_template_error(self):
         response = self.client.get("/404/")
         self.assertEqual(response.status_code, 404)
@@ -276,6 +308,135 @@ class FollowTests(TestCase):
         response = self.authorized_client.get(reverse("posts:follow_index"))
         self.assertEqual(len(response.context["page_obj"]), 1)
 
+    def test_timeline_fan_out_and_trim(self):
+        """Новый пост раскладывается по лентам, отписка чистит ленту"""
+        Follow.objects.create(user=self.user, author=self.author)
+        new_post = Post.objects.create(text="Новый пост", author=self.author)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user, post=new_post).exists())
+        self.authorized_client.get(
+            reverse("posts:profile_unfollow", args=(self.author.username,))
+        )
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+        response = self.authorized_client.get(reverse("posts:follow_index"))
+        self.assertEqual(len(response.context["page_obj"]), 0)
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=0)
+    def test_popular_author_is_pulled_at_read(self):
+        """Посты популярного автора читаются без fan-out"""
+        Follow.objects.create(user=self.user, author=self.author)
+        Post.objects.create(text="Новый пост", author=self.author)
+        self.assertFalse(TimelineEntry.objects.exists())
+        response = self.authorized_client.get(reverse("posts:follow_index"))
+        self.assertEqual(len(response.context["page_obj"]), 2)
+
+    @override_settings(FEED_TIMELINE_SIZE=2)
+    def test_timeline_is_trimmed(self):
+        """В ленте остаются только FEED_TIMELINE_SIZE свежих записей:
+        fan-out хвосты не трогает, их обрезает trim_timelines"""
+        other = User.objects.create_user(username="other")
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=other, author=self.author)
+        posts = [
+            Post.objects.create(text=f"Пост {num}", author=self.author)
+            for num in range(3)
+        ]
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.user).count(), 4
+        )
+        call_command("trim_timelines", stdout=StringIO())
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(user=other)
+                .values_list("post", flat=True)),
+            {posts[1].pk, posts[2].pk},
+        )
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(user=self.user)
+                .values_list("post", flat=True)),
+            {posts[1].pk, posts[2].pk},
+        )
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=1)
+    def test_mode_change_is_not_rebuilt_in_request(self):
+        """Смена режима только ставит флаг, а ленты пересобирает
+        задача после коммита"""
+        other = User.objects.create_user(username="other")
+        Follow.objects.create(user=self.user, author=self.author)
+        with mock.patch("posts.timeline.schedule_job") as schedule:
+            Follow.objects.create(user=other, author=self.author)
+        schedule.assert_called_once_with(
+            timeline.drop_author_entries, self.author.pk, "default"
+        )
+        self.assertTrue(timeline.is_pull_author(self.author.pk))
+        self.assertTrue(TimelineEntry.objects.filter(user=self.user).exists())
+
+
+@override_settings(
+    FEED_FANOUT_MAX_FOLLOWERS=2, FEED_FANOUT_RESUME_FOLLOWERS=2
+)
+class FeedModeTests(TransactionTestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="author")
+        self.user = User.objects.create_user(username="user")
+        self.others = [
+            User.objects.create_user(username=f"other{num}")
+            for num in range(2)
+        ]
+        self.client.force_login(self.user)
+        self.post = Post.objects.create(
+            text="Тестовый пост", author=self.author
+        )
+        Follow.objects.create(user=self.user, author=self.author)
+
+    def follow_others(self):
+        for other in self.others:
+            Follow.objects.create(user=other, author=self.author)
+
+    def unfollow_others(self):
+        Follow.objects.filter(user__in=self.others).delete()
+
+    def test_author_crossing_threshold_rematerializes(self):
+        """Автор, ставший популярным, уходит из лент, а вернувшийся
+        к fan-out приносит посты, написанные в режиме чтения"""
+        self.assertTrue(TimelineEntry.objects.exists())
+        self.follow_others()
+        self.assertFalse(TimelineEntry.objects.exists())
+        pulled = Post.objects.create(text="Пока популярен", author=self.author)
+        response = self.client.get(reverse("posts:follow_index"))
+        self.assertEqual(len(response.context["page_obj"]), 2)
+        self.unfollow_others()
+        self.assertFalse(timeline.is_pull_author(self.author.pk))
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user, post=pulled
+        ).exists())
+        response = self.client.get(reverse("posts:follow_index"))
+        self.assertEqual(
+            [post.pk for post in response.context["page_obj"]],
+            [pulled.pk, self.post.pk],
+        )
+
+    def test_mode_does_not_flap_between_thresholds(self):
+        """Между порогами подписка и отписка режим не меняют"""
+        self.follow_others()
+        with mock.patch("posts.timeline.schedule_job") as schedule:
+            Follow.objects.filter(user=self.others[0]).delete()
+            Follow.objects.create(user=self.others[0], author=self.author)
+            Follow.objects.filter(user=self.others[0]).delete()
+        schedule.assert_not_called()
+        self.assertTrue(timeline.is_pull_author(self.author.pk))
+
+    def test_pending_entries_are_not_duplicated(self):
+        """Пока записи ушедшего в чтение автора не удалены, лента
+        показывает его посты один раз"""
+        with mock.patch("posts.timeline.schedule_job"):
+            self.follow_others()
+        self.assertTrue(TimelineEntry.objects.filter(user=self.user).exists())
+        response = self.client.get(reverse("posts:follow_index"))
+        self.assertEqual(
+            [post.pk for post in response.context["page_obj"]],
+            [self.post.pk],
+        )
+
 
 class PaginatorViewsTest(TestCase):
     @classmethod
@@ -292,13 +453,14 @@ class PaginatorViewsTest(TestCase):
         cls.folower_client = Client()
         cls.folower_client.force_login(cls.user_folower_client)
 
-        Follow.objects.create(user=cls.user_folower_client, author=cls.author)
         cls.object_size = 13
         Post.objects.bulk_create(
             Post(
                 text=f'text {num}', author=cls.author, group=cls.group
             ) for num in range(cls.object_size)
         )
+        # bulk_create не шлёт сигналы, ленту заполнит подписка.
+        Follow.objects.create(user=cls.user_folower_client, author=cls.author)
 
     def setUp(self):
         self.authorized_client = Client()
@@ -327,3 +489,189 @@ class PaginatorViewsTest(TestCase):
                         )
                         self.assertEqual(len(response.context["page_obj"]),
                                          posts_num)
+
+
+@override_settings(PAGE_CURSOR_MODE=True)
+class CursorPaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username="author")
+        cls.object_size = 13
+        Post.objects.bulk_create(
+            Post(text=f"text {num}", author=cls.author)
+            for num in range(cls.object_size)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cursor_pages_cover_all_posts(self):
+        """Курсоры next/prev обходят ленту без пропусков и повторов"""
+        url = reverse("posts:index")
+        first = self.client.get(url).context["page_obj"]
+        self.assertEqual(len(first), settings.PAGE_COUNT)
+        self.assertTrue(first.has_next())
+        self.assertFalse(first.has_previous())
+        second = self.client.get(
+            url, {"cursor": first.next_cursor()}
+        ).context["page_obj"]
+        self.assertEqual(len(second), settings.PAGE_COUNT_SEC_PAGE)
+        self.assertFalse(second.has_next())
+        ids = [post.pk for post in first] + [post.pk for post in second]
+        self.assertEqual(
+            ids,
+            list(Post.objects.order_by("-pub_date", "-pk")
+                 .values_list("pk", flat=True)),
+        )
+        back = self.client.get(
+            url, {"cursor": second.previous_cursor()}
+        ).context["page_obj"]
+        self.assertEqual([post.pk for post in back],
+                         [post.pk for post in first])
+
+    def test_follow_feed_cursor_pages(self):
+        """Лента подписок листается курсором по датам записей"""
+        reader = User.objects.create_user(username="reader")
+        Follow.objects.create(user=reader, author=self.author)
+        self.client.force_login(reader)
+        url = reverse("posts:follow_index")
+        first = self.client.get(url).context["page_obj"]
+        second = self.client.get(
+            url, {"cursor": first.next_cursor()}
+        ).context["page_obj"]
+        self.assertFalse(second.has_next())
+        self.assertEqual(
+            [post.pk for post in first] + [post.pk for post in second],
+            list(Post.objects.order_by("-pub_date", "-pk")
+                 .values_list("pk", flat=True)),
+        )
+
+    def test_page_number_and_broken_cursor(self):
+        """?page=N по-прежнему работает, битый курсор даёт первую страницу"""
+        url = reverse("posts:index")
+        page = self.client.get(url, {"page": 2}).context["page_obj"]
+        self.assertEqual(page.number, 2)
+        self.assertEqual(len(page), settings.PAGE_COUNT_SEC_PAGE)
+        page = self.client.get(url, {"cursor": "broken"}).context["page_obj"]
+        self.assertEqual(len(page), settings.PAGE_COUNT)
+        self.assertFalse(page.has_previous())
+
+    def test_page_number_beyond_offset_limit(self):
+        """?page дальше PAGE_CURSOR_MAX_OFFSET_PAGE даёт 404, а не
+        подменённую страницу"""
+        url = reverse("posts:index")
+        with self.settings(PAGE_CURSOR_MAX_OFFSET_PAGE=1):
+            self.assertEqual(
+                self.client.get(url, {"page": 2}).status_code, 404
+            )
+            self.assertEqual(
+                self.client.get(url, {"page": 1}).status_code, 200
+            )
+
+    def test_empty_page_is_not_found(self):
+        """Страница за концом ленты и устаревший курсор дают 404, а не
+        ошибку сервера"""
+        oldest = Post.objects.order_by("pub_date", "pk").first()
+        newest = Post.objects.order_by("-pub_date", "-pk").first()
+        stale = (
+            encode_cursor(CURSOR_NEXT, oldest.pub_date, oldest.pk),
+            encode_cursor(CURSOR_PREVIOUS, newest.pub_date, newest.pk),
+        )
+        for url in (reverse("posts:index"),
+                    reverse("posts:profile", args=[self.author.username])):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.client.get(url, {"page": 4}).status_code, 404
+                )
+                for cursor in stale:
+                    self.assertEqual(
+                        self.client.get(url, {"cursor": cursor}).status_code,
+                        404,
+                    )
+
+
+@override_settings(COMMENTS_PAGE_COUNT=3)
+class CommentsPaginationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="author")
+        cls.post = Post.objects.create(author=cls.user, text="Тестовый пост")
+        for num in range(5):
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text=f"Комментарий {num}"
+            )
+
+    def test_post_page_shows_first_comments(self):
+        """На странице поста только первая страница комментариев"""
+        response = self.client.get(
+            reverse("posts:post_detail", args=(self.post.id,))
+        )
+        comments = response.context["comments"]
+        self.assertEqual(len(comments), 3)
+        self.assertTrue(comments.has_next())
+        self.assertContains(
+            response, reverse("posts:post_comments", args=(self.post.id,))
+        )
+
+    def test_comments_endpoint_continues_from_cursor(self):
+        """Эндпоинт отдаёт следующие комментарии по курсору"""
+        first = self.client.get(
+            reverse("posts:post_detail", args=(self.post.id,))
+        ).context["comments"]
+        url = reverse("posts:post_comments", args=(self.post.id,))
+        response = self.client.get(url, {"cursor": first.next_cursor()})
+        self.assertTemplateUsed(
+            response, "posts/includes/comments_display.html"
+        )
+        self.assertNotContains(response, "comments-more")
+        data = self.client.get(
+            url, {"cursor": first.next_cursor(), "format": "json"}
+        ).json()
+        self.assertIsNone(data["next_cursor"])
+        texts = [comment.text for comment in first]
+        texts += [comment["text"] for comment in data["comments"]]
+        self.assertEqual(
+            texts, [f"Комментарий {num}" for num in range(4, -1, -1)]
+        )
+
+
+class SearchViewTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username="author")
+        cls.post = Post.objects.create(
+            author=cls.user, text="Мороз и солнце; день чудесный!"
+        )
+        Post.objects.create(author=cls.user, text="Буря мглою небо кроет")
+
+    def test_search_finds_and_highlights(self):
+        """Поиск находит пост по слову и подсвечивает совпадение"""
+        response = self.client.get(reverse("posts:search"), {"q": "солн"})
+        page_obj = response.context["page_obj"]
+        self.assertEqual([post.pk for post in page_obj], [self.post.pk])
+        self.assertContains(response, "<mark>солнце</mark>")
+
+    def test_search_index_follows_edits(self):
+        """Изменённый и удалённый пост ищется по актуальному тексту"""
+        self.post.text = "Вечор, ты помнишь, вьюга злилась"
+        self.post.save()
+        url = reverse("posts:search")
+        self.assertEqual(
+            len(self.client.get(url, {"q": "мороз"}).context["page_obj"]), 0
+        )
+        self.assertEqual(
+            len(self.client.get(url, {"q": "вьюга"}).context["page_obj"]), 1
+        )
+        self.post.delete()
+        self.assertEqual(
+            len(self.client.get(url, {"q": "вьюга"}).context["page_obj"]), 0
+        )
+
+    def test_search_escapes_text(self):
+        """Текст поста в выдаче экранируется"""
+        Post.objects.create(author=self.user, text="<script>тревога</script>")
+        response = self.client.get(reverse("posts:search"), {"q": "тревога"})
+        self.assertNotContains(response, "<script>")
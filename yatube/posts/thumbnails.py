@@ -0,0 +1,347 @@
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import (ImageFile, deserialize_image_file,
+                                   serialize_image_file)
+from sorl.thumbnail.kvstores.base import KVStoreBase, add_prefix
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from .cache import bump_post_generations
+from .images import (POSTS_DIR, build_placeholder, build_variants,
+                     downscale_image, read_image_metadata, replace_variants,
+                     store_variants, write_variants)
+from .models import Post
+from .shards import shard_for_author
+from .storage import acquire_file, release_file
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_flight = set()
+
+
+class PregeneratedThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl, который умеет только спросить готовую миниатюру."""
+
+    def resolve_options(self, source, options):
+        # Тот же набор опций, что в ThumbnailBackend.get_thumbnail:
+        # от него зависит имя файла миниатюры.
+        options = dict(options)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        return options
+
+    def thumbnail_name(self, file_, geometry_string, **options):
+        source = ImageFile(file_)
+        options = self.resolve_options(source, options)
+        return self._get_thumbnail_filename(source, geometry_string, options)
+
+    def get_ready_thumbnail(self, file_, geometry_string, **options):
+        """Миниатюра из KV-хранилища или None, если её ещё нет."""
+        name = self.thumbnail_name(file_, geometry_string, **options)
+        prefetched = getattr(file_, 'prefetched_thumbnails', None)
+        if prefetched is not None and name in prefetched:
+            return prefetched[name]
+        return default.kvstore.get(ImageFile(name, default.storage))
+
+    def get_ready_thumbnails(self, names):
+        """Готовые миниатюры по именам: {name: ImageFile или None}.
+
+        Для cached_db-хранилища sorl это один get_many к кэшу и один
+        запрос к таблице на все промахи кэша вместо пары запросов
+        на каждую картинку.
+        """
+        kvstore = default.kvstore
+        if not isinstance(kvstore, cached_db_kvstore.KVStore):
+            return {
+                name: kvstore.get(ImageFile(name, default.storage))
+                for name in names
+            }
+        keys = {
+            add_prefix(ImageFile(name, default.storage).key): name
+            for name in names
+        }
+        values = kvstore.cache.get_many(keys)
+        missing = [key for key in keys if key not in values]
+        if missing:
+            found = dict(
+                KVStoreModel.objects.filter(key__in=missing)
+                .values_list('key', 'value')
+            )
+            empty = cached_db_kvstore.EMPTY_VALUE
+            fetched = {key: found.get(key, empty) for key in missing}
+            kvstore.cache.set_many(
+                fetched, sorl_settings.THUMBNAIL_CACHE_TIMEOUT
+            )
+            values.update(fetched)
+        return {
+            name: None if values[key] == cached_db_kvstore.EMPTY_VALUE
+            else deserialize_image_file(values[key])
+            for key, name in keys.items()
+        }
+
+
+class RecordingKVStore(KVStoreBase):
+    """KV-хранилище sorl для процессов пула reprocess_images: держит
+    записи в памяти и запоминает созданные миниатюры. В таблицу их
+    пишет родительский процесс, так что процессы пула в базу не пишут.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.recorded = []
+
+    def set(self, image_file, source=None):
+        super().set(image_file, source)
+        if source is not None:
+            self.recorded.append((
+                serialize_image_file(source),
+                serialize_image_file(image_file),
+            ))
+
+    def pop_recorded(self):
+        """Миниатюры с прошлого вызова: [(источник, миниатюра)]
+        в сериализованном виде sorl."""
+        recorded, self.recorded = self.recorded, []
+        # Каждая картинка обрабатывается один раз: память не копится.
+        self.data.clear()
+        return recorded
+
+    def _get_raw(self, key):
+        return self.data.get(key)
+
+    def _set_raw(self, key, value):
+        self.data[key] = value
+
+    def _delete_raw(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def _find_keys_raw(self, prefix):
+        return [key for key in self.data if key.startswith(prefix)]
+
+
+backend = PregeneratedThumbnailBackend()
+
+
+def use_recording_kvstore():
+    """Инициализатор процесса пула: sorl пишет миниатюры в память."""
+    default.kvstore = RecordingKVStore()
+
+
+def pop_recorded_thumbnails():
+    kvstore = default.kvstore
+    if isinstance(kvstore, RecordingKVStore):
+        return kvstore.pop_recorded()
+    return []
+
+
+def record_thumbnails(recorded):
+    """Записывает в KV-хранилище миниатюры, которые создал процесс
+    пула с RecordingKVStore."""
+    kvstore = default.kvstore
+    for source, thumbnail in recorded:
+        source = deserialize_image_file(source)
+        kvstore.get_or_set(source)
+        kvstore.set(deserialize_image_file(thumbnail), source)
+
+
+def prefetch_thumbnails(images):
+    """Разрешает все миниатюры POST_THUMBNAILS для набора картинок
+    одним пакетом и кладёт результат на сами картинки: шаблонный тег
+    ready_thumbnail потом читает их из памяти."""
+    names = {}
+    for image in images:
+        image.prefetched_thumbnails = {}
+        for geometry, options in settings.POST_THUMBNAILS:
+            name = backend.thumbnail_name(image, geometry, **options)
+            names.setdefault(name, []).append(image)
+    for name, thumbnail in backend.get_ready_thumbnails(names).items():
+        for image in names[name]:
+            image.prefetched_thumbnails[name] = thumbnail
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails',
+            )
+        return _executor
+
+
+def generate_thumbnails(name):
+    """Создаёт все миниатюры POST_THUMBNAILS для картинки."""
+    for geometry, options in settings.POST_THUMBNAILS:
+        backend.get_thumbnail(name, geometry, **options)
+
+
+def render_post_image(name):
+    """Миниатюры, файлы вариантов и метаданные картинки без записи
+    в таблицы постов. В процессе пула reprocess_images с
+    RecordingKVStore в базу не пишут и миниатюры."""
+    generate_thumbnails(name)
+    with default_storage.open(name, 'rb') as file:
+        metadata = read_image_metadata(file)
+        metadata['image_placeholder'] = build_placeholder(file)
+        variants = store_variants(name, file)
+    return metadata, variants
+
+
+def _is_current(pk, name, using=None):
+    return (
+        Post.objects.using(using).filter(pk=pk, image=name).exists()
+        and default_storage.exists(name)
+    )
+
+
+def _share_processed(post):
+    """Та же картинка уже обработана для другого поста: хранилище
+    отдало тот же файл, так что миниатюры уже есть, а строки вариантов
+    достаточно скопировать."""
+    name = post.image.name
+    using = post._state.db
+    donor = Post.objects.using(using).filter(
+        image=name, image_ready=True
+    ).exclude(
+        pk=post.pk
+    ).first()
+    if donor is None:
+        return False
+    replace_variants({post.pk: [
+        (variant.width, variant.height, variant.format, variant.file.name)
+        for variant in donor.image_variants.all()
+    ]}, using=using)
+    _mark_ready(post, name, donor.image_placeholder)
+    return True
+
+
+def _mark_ready(post, name, placeholder):
+    Post.objects.using(post._state.db).filter(pk=post.pk, image=name).update(
+        image_ready=True, image_placeholder=placeholder
+    )
+    bump_post_generations(post.author_id, post.group_id)
+
+
+def _downscale(post):
+    """Заменяет слишком большую картинку поста уменьшенной копией до
+    IMAGE_STORE_MAX_SIDE: дальше её читают миниатюры, варианты и
+    браузеры. Оригинал уходит, когда на него не останется ссылок."""
+    original = post.image.name
+    with post.image.open('rb'):
+        downscaled = downscale_image(
+            post.image, settings.IMAGE_STORE_MAX_SIDE
+        )
+    if downscaled is None:
+        return
+    content, width, height = downscaled
+    name = default_storage.save(
+        posixpath.join(POSTS_DIR, posixpath.basename(original)),
+        ContentFile(content),
+    )
+    with transaction.atomic():
+        updated = Post.objects.using(post._state.db).filter(
+            pk=post.pk, image=original
+        ).update(
+            image=name, image_width=width, image_height=height,
+            image_size=len(content),
+        )
+        if not updated:
+            # Картинку успели сменить: новую обработает своя задача.
+            return
+        acquire_file(name)
+        release_file(original)
+    post.image.name = name
+
+
+def process_post_image(pk, using=None):
+    """Всё, что нужно ленте от новой картинки поста: уменьшение
+    слишком большого оригинала, миниатюры sorl и адаптивные варианты
+    (и размытая заглушка, если её нет).
+    Потом пост помечается готовым, и кэш его карточки и лент
+    сбрасывается."""
+    post = Post.objects.using(using).filter(pk=pk).first()
+    if post is None or not post.image:
+        return
+    _downscale(post)
+    name = post.image.name
+    if _share_processed(post):
+        return
+    with post.image.open('rb'):
+        # Заглушку новой загрузки уже посчитал pre_save; здесь — только
+        # для постов, загруженных раньше.
+        placeholder = (
+            post.image_placeholder or build_placeholder(post.image)
+        )
+        variants = build_variants(post.image)
+    # Пока картинка декодировалась, пост могли удалить или сменить
+    # картинку: файлы для неё уже никому не нужны.
+    if not _is_current(pk, name, using):
+        return
+    generate_thumbnails(name)
+    replace_variants({pk: write_variants(name, variants)}, using=using)
+    _mark_ready(post, name, placeholder)
+
+
+def _run_job(pk, using=None):
+    try:
+        process_post_image(pk, using)
+    except Exception:
+        logger.exception('Не удалось обработать картинку поста %s', pk)
+    finally:
+        _in_flight.discard(pk)
+
+
+def _run_pooled_job(pk, using=None):
+    try:
+        _run_job(pk, using)
+    finally:
+        # Соединения потока пула не должны висеть до конца процесса.
+        connections.close_all()
+
+
+def schedule_post_image(post):
+    """Ставит картинку поста в очередь пула после коммита транзакции,
+    чтобы запрос не ждал декодирования и ресайза.
+
+    При THUMBNAIL_WORKERS = 0 картинка обрабатывается сразу после
+    коммита в том же потоке. Задачей пост помечается только после
+    коммита: откаченная транзакция не оставит его «в работе» навсегда.
+    """
+    if not post.image or post.pk in _in_flight:
+        return
+    # Ленты читают посты с реплики, а задача пишет: база для неё —
+    # шард автора или default, а не та, откуда пост прочитан.
+    pk = post.pk
+    using = shard_for_author(post.author_id) or DEFAULT_DB_ALIAS
+
+    def start():
+        if pk in _in_flight:
+            return
+        _in_flight.add(pk)
+        if settings.THUMBNAIL_WORKERS:
+            get_executor().submit(_run_pooled_job, pk, using)
+        else:
+            _run_job(pk, using)
+
+    transaction.on_commit(start, using=using)
@@ -0,0 +1,257 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import AuthorStats, Follow, Post, TimelineEntry
+from .shards import ShardedQuery, post_databases
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Поля, по которым листается лента: у записей — копия даты поста,
+# у постов популярных авторов — сама дата.
+FEED_FIELD = 'feed_date'
+FEED_TIEBREAK = 'feed_pk'
+
+
+def is_pull_author(author_id):
+    """Популярные авторы не раскладываются по лентам при записи:
+    их посты ленты читают напрямую."""
+    return AuthorStats.objects.filter(pk=author_id, feed_pull=True).exists()
+
+
+def trim_timelines(user_ids=None, using=None):
+    """Оставляет в лентах FEED_TIMELINE_SIZE свежих записей.
+
+    Один DELETE на все ленты: место записи в ленте считает оконная
+    функция по индексу (user, -pub_date, -post). user_ids ограничивает
+    ленты, None — все ленты базы. Возвращает число удалённых записей.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    entries = TimelineEntry.objects.using(using)
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+    ranked = entries.annotate(position=Window(
+        RowNumber(),
+        partition_by=[F('user_id')],
+        order_by=[F('pub_date').desc(), F('post_id').desc()],
+    )).values('pk', 'position')
+    sql, params = ranked.query.get_compiler(using).as_sql()
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {TimelineEntry._meta.db_table} WHERE id IN '
+            f'(SELECT id FROM ({sql}) WHERE position > %s)',
+            [*params, settings.FEED_TIMELINE_SIZE],
+        )
+        return cursor.rowcount
+
+
+def fan_out_post(post):
+    """Кладёт новый пост в ленты всех подписчиков автора.
+
+    Вызывается из сигнала post_save, поэтому посты из bulk_create
+    в ленты не попадают — их подтянет только backfill при подписке.
+    Хвосты лент здесь не обрезаются: у автора могут быть тысячи
+    подписчиков, а запись идёт внутри запроса. Это делает периодическая
+    команда trim_timelines.
+    """
+    if is_pull_author(post.author_id):
+        return
+    using = post._state.db
+    followers = Follow.objects.using(using).filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    TimelineEntry.objects.using(using).bulk_create(
+        (TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+         for user_id in followers.iterator()),
+        batch_size=settings.FEED_BATCH_SIZE,
+    )
+
+
+def backfill(user_id, author_id, using=None):
+    """Заполняет ленту последними постами автора после подписки."""
+    if is_pull_author(author_id):
+        return
+    posts = Post.objects.using(using).filter(author_id=author_id).values_list(
+        'pk', 'pub_date'
+    )[:settings.FEED_BACKFILL_SIZE]
+    TimelineEntry.objects.using(using).bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+         for pk, pub_date in posts),
+        batch_size=settings.FEED_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim_timelines([user_id], using)
+
+
+def trim(user_id, author_id, using=None):
+    """Убирает из ленты посты автора после отписки."""
+    TimelineEntry.objects.using(using).filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def update_author_mode(author_id, using=None):
+    """Переключает автора между fan-out и чтением напрямую.
+
+    Порогов два: автор уходит в чтение, когда подписчиков больше
+    FEED_FANOUT_MAX_FOLLOWERS, а возвращается к fan-out, когда их
+    меньше FEED_FANOUT_RESUME_FOLLOWERS. Автор у границы не меняет
+    режим на каждой подписке. Ленты пересобираются в фоне после
+    коммита, а не в запросе подписки.
+    """
+    state = AuthorStats.objects.filter(pk=author_id).values_list(
+        'followers_count', 'feed_pull'
+    ).first()
+    if state is None:
+        return
+    followers, pull = state
+    if not pull and followers > settings.FEED_FANOUT_MAX_FOLLOWERS:
+        # Флаг ставится сразу: новые посты перестают раскладываться,
+        # а старые записи автора лента не читает, пока их не удалят.
+        if AuthorStats.objects.filter(pk=author_id, feed_pull=False).update(
+            feed_pull=True
+        ):
+            schedule_job(drop_author_entries, author_id, using)
+    elif pull and followers < settings.FEED_FANOUT_RESUME_FOLLOWERS:
+        schedule_job(resume_fan_out, author_id, using)
+
+
+def drop_author_entries(author_id, using=None):
+    """Убирает из лент записи автора, которого читают напрямую."""
+    if is_pull_author(author_id):
+        TimelineEntry.objects.using(using).filter(
+            post__author_id=author_id
+        ).delete()
+
+
+def resume_fan_out(author_id, using=None):
+    """Возвращает автора к fan-out и раскладывает его посты по лентам
+    заново: иначе посты, написанные, пока он читался напрямую, пропали
+    бы из лент подписчиков. Пока раскладка идёт, часть лент ещё без
+    них."""
+    switched = AuthorStats.objects.filter(
+        pk=author_id, feed_pull=True,
+        followers_count__lt=settings.FEED_FANOUT_RESUME_FOLLOWERS,
+    ).update(feed_pull=False)
+    if not switched:
+        # Задачу уже выполнили, или подписчиков снова много.
+        return
+    followers = Follow.objects.using(using).filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True)
+    for user_id in followers.iterator():
+        backfill(user_id, author_id, using)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.FEED_WORKERS,
+                thread_name_prefix='timelines',
+            )
+        return _executor
+
+
+def _run_job(job, author_id, using=None):
+    try:
+        job(author_id, using)
+    except Exception:
+        logger.exception('Не удалось пересобрать ленты автора %s', author_id)
+
+
+def _run_pooled_job(job, author_id, using=None):
+    try:
+        _run_job(job, author_id, using)
+    finally:
+        # Соединения потока пула не должны висеть до конца процесса.
+        connections.close_all()
+
+
+def schedule_job(job, author_id, using=None):
+    """Запускает job(author_id, using) в пуле после коммита транзакции
+    default, где лежит режим автора. При FEED_WORKERS = 0 задача
+    выполняется сразу после коммита в том же потоке."""
+    def start():
+        if settings.FEED_WORKERS:
+            get_executor().submit(_run_pooled_job, job, author_id, using)
+        else:
+            _run_job(job, author_id, using)
+
+    transaction.on_commit(start)
+
+
+def pull_authors(user):
+    """Популярные авторы, на которых подписан user: [(автор, база)].
+
+    С шардами подписки лежат в базах авторов, а статистика в default,
+    поэтому они сводятся в Python, а не JOIN.
+    """
+    if not settings.POST_SHARDS:
+        return [
+            (author_id, None) for author_id in Follow.objects.filter(
+                user=user, author__stats__feed_pull=True,
+            ).values_list('author', flat=True)
+        ]
+    pulled = []
+    for using in settings.POST_SHARDS:
+        followed = list(Follow.objects.using(using).filter(
+            user=user
+        ).values_list('author', flat=True))
+        pulled.extend(
+            (author_id, using) for author_id in AuthorStats.objects.filter(
+                pk__in=followed, feed_pull=True,
+            ).values_list('author', flat=True)
+        )
+    return pulled
+
+
+def get_timeline(user):
+    """Лента подписок: материализованные записи плюс посты
+    популярных авторов, которые читаются напрямую.
+
+    Каждая часть листается по своему индексу — записи по
+    (user, -pub_date, -post), посты автора по (author, -pub_date, -id), —
+    а страница собирается слиянием частей. Листать её нужно по
+    FEED_FIELD и FEED_TIEBREAK. Без шардов и популярных авторов часть
+    одна, и лента — обычный queryset.
+    """
+    pulled = pull_authors(user)
+    sources = [
+        Post.objects.using(using).filter(timeline_entries__user=user)
+        .annotate(
+            feed_date=F('timeline_entries__pub_date'),
+            feed_pk=F('timeline_entries__post'),
+        )
+        for using in post_databases()
+    ]
+    if pulled:
+        # Записи автора, ушедшего в чтение, удаляются в фоне: пока они
+        # есть, лента их пропускает, чтобы посты не задвоились.
+        pulled_ids = [author_id for author_id, _ in pulled]
+        sources = [
+            source.exclude(author_id__in=pulled_ids) for source in sources
+        ]
+    sources.extend(
+        Post.objects.using(using).filter(author_id=author_id).annotate(
+            feed_date=F('pub_date'), feed_pk=F('pk'),
+        )
+        for author_id, using in pulled
+    )
+    if len(sources) == 1 and not settings.POST_SHARDS:
+        # Одна часть не требует слияния и листается как обычная лента.
+        return sources[0].select_related('author', 'group').order_by(
+            f'-{FEED_FIELD}', f'-{FEED_TIEBREAK}'
+        )
+    return ShardedQuery(
+        lambda queryset: queryset, ('author', 'group'), sources=sources
+    )
@@ -0,0 +1,158 @@
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from PIL import ImageFile
+
+from .images import header_limits_error
+from .models import ChunkedUpload
+
+BLOCK_SIZE = 64 * 1024
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(Exception):
+    """Кусок не принят; status — код ответа для клиента."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def upload_path(upload):
+    return os.path.join(settings.UPLOAD_TEMP_ROOT, f'{upload.token.hex}.part')
+
+
+def start_upload(user, filename, size):
+    if not filename:
+        raise UploadError('Не указано имя файла.')
+    if not 0 < size <= min(settings.UPLOAD_MAX_SIZE,
+                           settings.IMAGE_MAX_BYTES):
+        raise UploadError('Недопустимый размер файла.', status=413)
+    purge_expired_uploads()
+    upload = ChunkedUpload.objects.create(
+        user=user, filename=os.path.basename(filename)[:255], size=size
+    )
+    os.makedirs(settings.UPLOAD_TEMP_ROOT, exist_ok=True)
+    open(upload_path(upload), 'wb').close()
+    return upload
+
+
+def parse_content_range(header):
+    """(начало, длина, весь размер) из Content-Range: bytes a-b/total."""
+    match = CONTENT_RANGE_RE.match(header or '')
+    if match is None:
+        raise UploadError('Нужен заголовок Content-Range: bytes a-b/total.')
+    start, end, total = map(int, match.groups())
+    if end < start:
+        raise UploadError('Пустой диапазон в Content-Range.')
+    return start, end - start + 1, total
+
+
+def append_chunk(upload, stream, start, length):
+    """Дописывает кусок из потока запроса прямо в файл блоками по
+    BLOCK_SIZE: в памяти не бывает больше одного блока.
+
+    Кусок принимается только с текущей позиции загрузки, так что
+    повтор после обрыва начинается с offset, который вернул сервер.
+    """
+    if start != upload.offset:
+        raise UploadError('Загрузка продолжается с другой позиции.', 409)
+    if start + length > upload.size or length > settings.UPLOAD_CHUNK_SIZE:
+        raise UploadError('Кусок больше допустимого.', status=413)
+    written = 0
+    with open(upload_path(upload), 'r+b') as file:
+        # Хвост оборванной попытки отбрасывается.
+        file.seek(start)
+        file.truncate()
+        while written < length:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            file.write(block)
+            written += len(block)
+    if written != length:
+        raise UploadError('Кусок пришёл не полностью.')
+    updated = ChunkedUpload.objects.filter(
+        pk=upload.pk, offset=start
+    ).update(offset=start + length)
+    if not updated:
+        raise UploadError('Загрузка продолжается с другой позиции.', 409)
+    upload.offset = start + length
+    check_header(upload)
+
+
+def check_header(upload):
+    """Распознаёт заголовок картинки по уже полученному началу файла.
+
+    Пиксели не декодируются: парсер Pillow получает данные, пока
+    не разберёт заголовок. Если в первых UPLOAD_HEADER_LIMIT байтах
+    картинки нет, загрузка прерывается, не дожидаясь остального файла.
+    """
+    if upload.image_format:
+        return
+    parser = ImageFile.Parser()
+    limit = min(upload.offset, settings.UPLOAD_HEADER_LIMIT)
+    with open(upload_path(upload), 'rb') as file:
+        while parser.image is None and file.tell() < limit:
+            block = file.read(min(BLOCK_SIZE, limit - file.tell()))
+            if not block:
+                break
+            try:
+                parser.feed(block)
+            except (OSError, SyntaxError):
+                break
+    if parser.image is not None:
+        error = header_limits_error(parser.image.format, *parser.image.size)
+        if error:
+            # Бомба отсекается по заголовку, не дожидаясь всего файла.
+            discard_upload(upload)
+            raise UploadError(error, status=415)
+        upload.image_format = parser.image.format
+        ChunkedUpload.objects.filter(pk=upload.pk).update(
+            image_format=upload.image_format
+        )
+    elif upload.complete or upload.offset >= settings.UPLOAD_HEADER_LIMIT:
+        discard_upload(upload)
+        raise UploadError('Файл не похож на картинку.', status=415)
+
+
+def get_finished_upload(token, user):
+    """Завершённая загрузка пользователя с распознанной картинкой."""
+    try:
+        upload = ChunkedUpload.objects.filter(token=token, user=user).first()
+    except ValidationError:
+        return None
+    if upload is None or not upload.complete or not upload.image_format:
+        return None
+    return upload
+
+
+def open_upload(upload):
+    return File(open(upload_path(upload), 'rb'), name=upload.filename)
+
+
+def discard_upload(upload):
+    try:
+        os.remove(upload_path(upload))
+    except FileNotFoundError:
+        pass
+    ChunkedUpload.objects.filter(pk=upload.pk).delete()
+
+
+def discard_on_commit(upload):
+    """Временный файл нужен, пока хранилище не сохранило картинку."""
+    transaction.on_commit(lambda: discard_upload(upload))
+
+
+def purge_expired_uploads():
+    expired = ChunkedUpload.objects.filter(
+        created__lt=timezone.now() - timedelta(seconds=settings.UPLOAD_EXPIRE)
+    )
+    for upload in expired:
+        discard_upload(upload)
@@ -1,8 +1,209 @@
-from django.core.paginator import Paginator
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from operator import attrgetter
+
 from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.db.models import Q, prefetch_related_objects
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+from .shards import ShardedQuery, merge_sorted, scatter
+
+CURSOR_NEXT = 'n'
+CURSOR_PREVIOUS = 'p'
+
+
+def encode_cursor(direction, value, pk):
+    """Упаковывает позицию ленты в непрозрачную строку для ссылки."""
+    raw = f'{direction}|{value.isoformat()}|{pk}'
+    return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Возвращает (направление, дата, pk) или None для битого курсора."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, value, pk = (
+            urlsafe_b64decode(padded.encode()).decode().split('|')
+        )
+        value = parse_datetime(value)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        return None
+    if direction not in (CURSOR_NEXT, CURSOR_PREVIOUS) or value is None:
+        return None
+    return direction, value, pk
+
+
+class CursorPage(Page):
+    """Страница keyset-пагинации: вместо номеров — курсоры соседей."""
+
+    is_cursor = True
+
+    def __init__(self, object_list, number, paginator, cursor,
+                 has_next, has_previous):
+        super().__init__(object_list, number, paginator)
+        self.cursor = cursor
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return self.paginator.cursor_for(CURSOR_NEXT, self.object_list[-1])
+
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return self.paginator.cursor_for(
+            CURSOR_PREVIOUS, self.object_list[0]
+        )
+
+
+class CursorPaginator(Paginator):
+    """Пагинация поиском по (field, tiebreak) без COUNT(*) и OFFSET.
+
+    Глубина страницы не влияет на стоимость запроса: каждая страница
+    берётся по индексу от позиции последней записи предыдущей.
+    Номера страниц ?page=N поддерживаются до ``max_offset_page``,
+    дальше — 404. Пустая страница, кроме первой, тоже 404: за концом
+    ленты или по устаревшему курсору показывать нечего.
+    """
+
+    def __init__(self, object_list, per_page, field='pub_date',
+                 max_offset_page=None, tiebreak='pk'):
+        super().__init__(object_list, per_page)
+        self.field = field
+        self.tiebreak = tiebreak
+        if max_offset_page is None:
+            max_offset_page = settings.PAGE_CURSOR_MAX_OFFSET_PAGE
+        self.max_offset_page = max_offset_page
+
+    def cursor_for(self, direction, obj):
+        return encode_cursor(
+            direction, getattr(obj, self.field), getattr(obj, self.tiebreak)
+        )
+
+    def _ordered(self, descending=True, queryset=None):
+        sign = '-' if descending else ''
+        if queryset is None:
+            queryset = self.object_list
+        return queryset.order_by(
+            f'{sign}{self.field}', f'{sign}{self.tiebreak}'
+        )
+
+    def _fetch(self, descending=True, condition=None, offset=0, limit=None):
+        queryset = self._ordered(descending)
+        if condition is not None:
+            queryset = queryset.filter(condition)
+        return list(queryset[offset:offset + limit])
+
+    def page_by_cursor(self, cursor):
+        position = decode_cursor(cursor) if cursor else None
+        if position is None:
+            return self.page_by_number(1)
+        direction, value, pk = position
+        field, tiebreak = self.field, self.tiebreak
+        if direction == CURSOR_NEXT:
+            items = self._fetch(
+                condition=Q(**{f'{field}__lt': value})
+                | Q(**{field: value, f'{tiebreak}__lt': pk}),
+                limit=self.per_page + 1,
+            )
+        else:
+            items = self._fetch(
+                descending=False,
+                condition=Q(**{f'{field}__gt': value})
+                | Q(**{field: value, f'{tiebreak}__gt': pk}),
+                limit=self.per_page + 1,
+            )
+        if not items:
+            raise Http404('Страница пуста')
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if direction == CURSOR_NEXT:
+            return CursorPage(items, None, self, cursor,
+                              has_next=has_more, has_previous=True)
+        items.reverse()
+        return CursorPage(items, None, self, cursor,
+                          has_next=True, has_previous=has_more)
+
+    def page_by_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            number = 1
+        number = max(number, 1)
+        if number > self.max_offset_page:
+            # Глубже листают курсором: подменять страницу ближайшей
+            # разрешённой значило бы отдать не то, что просили.
+            raise Http404('Страница недоступна по номеру')
+        bottom = (number - 1) * self.per_page
+        items = self._fetch(offset=bottom, limit=self.per_page + 1)
+        if not items and number > 1:
+            raise Http404('Страница пуста')
+        has_next = len(items) > self.per_page
+        return CursorPage(items[:self.per_page], number, self, None,
+                          has_next=has_next, has_previous=number > 1)
+
+
+class ShardedCursorPaginator(CursorPaginator):
+    """CursorPaginator для ленты со всех шардов: каждая база отдаёт
+    свою первую страницу по индексу, а общая страница собирается
+    k-way merge по (field, tiebreak)."""
+
+    def __init__(self, sharded, per_page, field='pub_date',
+                 max_offset_page=None, tiebreak='pk'):
+        super().__init__(sharded, per_page, field, max_offset_page, tiebreak)
+        self.sharded = sharded
+
+    def _fetch(self, descending=True, condition=None, offset=0, limit=None):
+        def fetch(shard):
+            queryset = self._ordered(descending, self.sharded.factory(shard))
+            if condition is not None:
+                queryset = queryset.filter(condition)
+            # Любая строка страницы может оказаться с одного шарда.
+            return list(queryset[:offset + limit])
+
+        items = merge_sorted(
+            scatter(fetch, sources=self.sharded.sources),
+            attrgetter(self.field, self.tiebreak), offset + limit,
+            reverse=descending,
+        )[offset:]
+        prefetch_related_objects(items, *self.sharded.related)
+        return items
+
 
+def get_page_context(request, posts, cursor=None,
+                     per_page=None, field='pub_date', tiebreak='pk'):
+    """Возвращает страницу постов для шаблона.
 
-def get_page_context(request, posts):
-    paginator = Paginator(posts, settings.PAGE_COUNT)
-    page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+    При ``cursor=True`` (или ``PAGE_CURSOR_MODE`` в настройках) страница
+    строится keyset-пагинацией по ``(field, tiebreak)``; ``ShardedQuery``
+    собирается со всех шардов и листается так всегда.
+    """
+    if per_page is None:
+        per_page = settings.PAGE_COUNT
+    if cursor is None:
+        cursor = settings.PAGE_CURSOR_MODE
+    if isinstance(posts, ShardedQuery):
+        # Лента со всех шардов листается только курсором.
+        paginator = ShardedCursorPaginator(
+            posts, per_page, field=field, tiebreak=tiebreak
+        )
+    elif cursor:
+        paginator = CursorPaginator(
+            posts, per_page, field=field, tiebreak=tiebreak
+        )
+    else:
+        paginator = Paginator(posts, per_page)
+        return paginator.get_page(request.GET.get('page'))
+    if 'cursor' in request.GET:
+        return paginator.page_by_cursor(request.GET['cursor'])
+    return paginator.page_by_number(request.GET.get('page'))
@@ -1,97 +1,187 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.utils.http import urlencode
 from django.shortcuts import get_object_or_404, redirect, render
+from django.views.decorators.http import require_http_methods, require_POST
 
-from .models import Follow, Group, Post, User
+from .archive import get_post_or_archived_404, with_archive
+from .models import ArchivedPost, ChunkedUpload, Follow, Group, Post, User
+from .cache import get_generation
 from .forms import CommentForm, PostForm
+from .replicas import read_from_replica
+from .shards import (get_post_or_404, scatter_posts, shard_for_author,
+                     with_related)
+from .search import search_posts
+from .sqlite import serialized_write
+from .stats import get_author_stats
+from .thumbnails import schedule_post_image
+from .timeline import FEED_FIELD, FEED_TIEBREAK, get_timeline
+from .uploads import (UploadError, append_chunk, discard_on_commit,
+                      parse_content_range, start_upload)
 from .utils import get_page_context
 
 
+@read_from_replica
 def index(request):
     page_obj = get_page_context(
-        request, Post.objects.select_related('author', 'group').all()
+        request,
+        scatter_posts(lambda using: Post.objects.using(using),
+                      'author', 'group'),
     )
     context = {
         'page_obj': page_obj,
+        'cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+        'generation': get_generation(('index',)),
     }
     return render(request, 'posts/index.html', context)
 
 
+@read_from_replica
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     page_obj = get_page_context(
-        request, group.posts.select_related('author').all()
+        request,
+        scatter_posts(lambda using: group.posts.using(using), 'author'),
     )
     context = {
         'group': group,
         'page_obj': page_obj,
+        'cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+        'generation': get_generation(('group', group.pk)),
     }
     return render(request, 'posts/group_list.html', context)
 
 
+@read_from_replica
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    posts = author.posts.select_related('group').all()
-    posts_count_author = posts.count()
+    shard = shard_for_author(author.pk)
+    posts = with_archive(
+        with_related(author.posts.using(shard), 'group'), author
+    )
+    author_stats = get_author_stats(author)
     page_obj = get_page_context(request, posts)
     following = (request.user.is_authenticated
                  and request.user != author
-                 and author.following.
+                 and author.following.using(shard).
                  filter(user=request.user).exists())
     context = {
         'author': author,
-        'posts_count_author': posts_count_author,
+        'author_stats': author_stats,
+        'posts_count_author': author_stats.posts_count,
         'page_obj': page_obj,
         'following': following,
+        'cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+        'generation': get_generation(('author', author.pk), ('groups',)),
     }
     return render(request, 'posts/profile.html', context)
 
 
-def post_detail(request, post_id):
-    post = get_object_or_404(
-        Post.objects.select_related('author').
-        prefetch_related('comments__author'),
-        pk=post_id
+def get_comments_page(request, post):
+    return get_page_context(
+        request,
+        with_related(post.comments.all(), 'author'),
+        cursor=True,
+        per_page=settings.COMMENTS_PAGE_COUNT,
+        field='created',
     )
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    if query:
+        page_obj = get_page_context(request, search_posts(query), cursor=False)
+    context = {
+        'query': query,
+        'query_string': urlencode({'q': query}) + '&',
+        'page_obj': page_obj,
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@read_from_replica
+def post_detail(request, post_id):
+    post = get_post_or_archived_404(post_id, 'author', 'group')
     comment_form = CommentForm(request.POST or None)
     context = {
         'post': post,
+        'archived': isinstance(post, ArchivedPost),
+        'author_stats': get_author_stats(post.author),
         'form': comment_form,
-        'comments': post.comments.all(),
+        'comments': get_comments_page(request, post),
     }
 
     return render(request, 'posts/post_detail.html', context)
 
 
+def post_comments(request, post_id):
+    post = get_post_or_archived_404(post_id)
+    comments = get_comments_page(request, post)
+    if request.GET.get('format') != 'json':
+        return render(
+            request,
+            'posts/includes/comments_display.html',
+            {'post': post, 'comments': comments},
+        )
+    return JsonResponse({
+        'comments': [
+            {
+                'id': comment.pk,
+                'author': comment.author.username,
+                'text': comment.text,
+                'created': comment.created.isoformat(),
+            }
+            for comment in comments
+        ],
+        'next_cursor': comments.next_cursor(),
+    })
+
+
 @login_required(login_url='/auth/login/')
+@serialized_write
 def post_create(request):
     user = request.user
 
     form = PostForm(
         request.POST or None,
-        files=request.FILES or None
+        files=request.FILES or None,
+        upload_token=request.POST.get('upload_token'),
+        user=user,
     )
     if form.is_valid():
         post = form.save(False)
         post.author = user
         post.save()
+        schedule_post_image(post)
+        if form.upload:
+            discard_on_commit(form.upload)
         return redirect('posts:profile', user.username)
 
     return render(request, 'posts/create_post.html', {'form': form})
 
 
 @login_required(login_url='/auth/login/')
+@serialized_write
 def post_edit(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_post_or_404(post_id)
     if post.author != request.user:
         return redirect('posts:post_detail', post_id=post_id)
 
     form = PostForm(
         request.POST or None,
         files=request.FILES or None,
-        instance=post
+        instance=post,
+        upload_token=request.POST.get('upload_token'),
+        user=request.user,
     )
     if form.is_valid():
-        form.save()
+        post = form.save()
+        if 'image' in form.changed_data or form.upload:
+            schedule_post_image(post)
+        if form.upload:
+            discard_on_commit(form.upload)
         return redirect('posts:post_edit', post_id=post_id)
     context = {
         'post': post,
@@ -101,9 +191,61 @@ def post_edit(request, post_id):
     return render(request, 'posts/create_post.html', context)
 
 
+@login_required(login_url='/auth/login/')
+@require_POST
+def upload_start(request):
+    """Начинает загрузку картинки кусками: возвращает токен, который
+    потом уходит в форму поста вместо файла."""
+    try:
+        size = int(request.POST.get('size', ''))
+        upload = start_upload(
+            request.user, request.POST.get('filename'), size
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Не указан размер файла.'}, status=400)
+    except UploadError as error:
+        return JsonResponse({'error': str(error)}, status=error.status)
+    return JsonResponse(
+        {
+            'token': str(upload.token),
+            'offset': upload.offset,
+            'chunk_size': settings.UPLOAD_CHUNK_SIZE,
+        },
+        status=201,
+    )
+
+
+@login_required(login_url='/auth/login/')
+@require_http_methods(['GET', 'PUT'])
+def upload_chunk(request, token):
+    """GET — сколько байт уже получено (для продолжения после обрыва),
+    PUT с Content-Range — следующий кусок файла."""
+    upload = get_object_or_404(ChunkedUpload, token=token, user=request.user)
+    if request.method == 'PUT':
+        try:
+            start, length, total = parse_content_range(
+                request.META.get('HTTP_CONTENT_RANGE')
+            )
+            if total != upload.size:
+                raise UploadError('Размер файла не совпадает с начатым.')
+            append_chunk(upload, request, start, length)
+        except UploadError as error:
+            return JsonResponse(
+                {'error': str(error), 'offset': upload.offset},
+                status=error.status,
+            )
+    return JsonResponse({
+        'token': str(upload.token),
+        'offset': upload.offset,
+        'size': upload.size,
+        'complete': upload.complete,
+    })
+
+
 @login_required
+@serialized_write
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_post_or_404(post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
@@ -114,28 +256,36 @@ def add_comment(request, post_id):
 
 
 @login_required
+@read_from_replica
 def follow_index(request):
-    posts_list = (Post.objects.select_related('author', 'group').
-                  filter(author__following__user=request.user))
-    page_obj = get_page_context(request, posts_list)
+    page_obj = get_page_context(
+        request, get_timeline(request.user),
+        field=FEED_FIELD, tiebreak=FEED_TIEBREAK,
+    )
     context = {'page_obj': page_obj,
                'follow': True, }
     return render(request, 'posts/follow.html', context)
 
 
 @login_required
+@serialized_write
 def profile_follow(request, username):
     auhtor = get_object_or_404(User, username=username)
     user = request.user
     if auhtor != user:
-        Follow.objects.get_or_create(user=user, author=auhtor)
+        Follow.objects.using(
+            shard_for_author(auhtor.pk, assign=True)
+        ).get_or_create(user=user, author=auhtor)
     return redirect('posts:profile', username)
 
 
 @login_required
+@serialized_write
 def profile_unfollow(request, username):
     unfollow_from_author = get_object_or_404(User, username=username)
-    Follow.objects.filter(user=request.user).filter(
+    Follow.objects.using(
+        shard_for_author(unfollow_from_author.pk)
+    ).filter(user=request.user).filter(
         author=unfollow_from_author
     ).delete()
     return redirect('posts:profile', username)
@@ -33,6 +33,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'posts.replicas.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -75,6 +76,47 @@ DATABASES = {
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
     }
 }
+# manage.py test добавляет тестовые базы шардов и архива и выключает
+# фоновые пулы — см. yatube/test_runner.py.
+TEST_RUNNER = 'yatube.test_runner.TestRunner'
+
+# Реплики только для чтения. Локально это копии db.sqlite3, которые
+# обновляет команда sync_replicas; 0 — всё читается из default.
+DATABASE_REPLICA_COUNT = 0
+DATABASE_REPLICAS = tuple(
+    f'replica_{number}' for number in range(1, DATABASE_REPLICA_COUNT + 1)
+)
+for alias in DATABASE_REPLICAS:
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, f'db_{alias}.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = [
+    'posts.archive.ArchiveRouter',
+    'posts.shards.ShardRouter',
+    'posts.replicas.PrimaryReplicaRouter',
+]
+# Сколько секунд после записи пользователь читает с primary.
+REPLICA_STICKY_SECONDS = 10
+REPLICA_STICKY_COOKIE = 'primary_until'
+
+# Профиль SQLite для конкурентной нагрузки, выставляется каждому
+# соединению: WAL не держит читателей за писателем, NORMAL в WAL
+# не теряет целостность при сбое, busy_timeout ждёт блокировку
+# вместо мгновенной ошибки. cache_size — в КиБ со знаком минус.
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'wal'),
+    ('synchronous', 'normal'),
+    ('busy_timeout', 5000),
+    ('cache_size', -20000),
+    ('mmap_size', 128 * 1024 * 1024),
+    ('temp_store', 'memory'),
+)
+# Пишущие запросы идут через один замок на процесс; блокировку
+# от других процессов повторяем с экспоненциальной паузой.
+SQLITE_WRITE_RETRIES = 5
+SQLITE_WRITE_BACKOFF = 0.05
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -115,7 +157,31 @@ STATICFILES_DIRS = (os.path.join(BASE_DIR, 'static'),)
 PAGE_COUNT = 10
 PAGE_COUNT_PROFILE = 5
 PAGE_COUNT_SEC_PAGE = 3
+COMMENTS_PAGE_COUNT = 20
+# Дальше этого админка не считает строки отфильтрованного списка.
+ADMIN_COUNT_LIMIT = 10000
 CACHE_TIMEOUT = 20
+# Фрагменты лент сбрасываются по поколениям, а не по времени.
+PAGE_CACHE_TIMEOUT = 60 * 60 * 4
+# Карточка поста кэшируется по отпечатку своего содержимого.
+ARTICLE_CACHE_TIMEOUT = 60 * 60 * 24
+# Keyset-пагинация лент вместо COUNT(*) + OFFSET.
+PAGE_CURSOR_MODE = False
+# До какой страницы ?page=N обслуживается смещением в режиме курсоров.
+PAGE_CURSOR_MAX_OFFSET_PAGE = 10
+
+# Лента подписок: fan-out при записи, для популярных авторов — чтение.
+# Автор уходит в чтение, когда подписчиков больше MAX, и возвращается
+# к fan-out, когда их меньше RESUME.
+FEED_FANOUT_MAX_FOLLOWERS = 10000
+FEED_FANOUT_RESUME_FOLLOWERS = 9000
+# Пул, который пересобирает ленты при смене режима автора; 0 — сразу
+# после коммита в потоке запроса.
+FEED_WORKERS = 1
+FEED_BACKFILL_SIZE = 500
+# Сколько свежих записей хранится в ленте одного пользователя.
+FEED_TIMELINE_SIZE = 1000
+FEED_BATCH_SIZE = 1000
 
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
@@ -126,9 +192,71 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Загрузки в эти каталоги называются по sha256 содержимого
+# и раскладываются по подкаталогам ab/cd/; дубликаты хранятся один раз.
+DEFAULT_FILE_STORAGE = 'posts.storage.ContentAddressedStorage'
+SHARDED_UPLOAD_DIRS = ('posts',)
+# Сюда collect_media_garbage --dry-run переносит файлы без ссылок.
+MEDIA_QUARANTINE_ROOT = os.path.join(BASE_DIR, 'media_quarantine')
+
+# Загрузка картинок кусками: недокачанные файлы живут здесь до отправки
+# формы. Заголовок картинки должен найтись в первых UPLOAD_HEADER_LIMIT
+# байтах, незавершённые загрузки удаляются через UPLOAD_EXPIRE секунд.
+UPLOAD_TEMP_ROOT = os.path.join(BASE_DIR, 'uploads')
+UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_HEADER_LIMIT = 256 * 1024
+UPLOAD_EXPIRE = 60 * 60 * 24
+
+# Лимиты загружаемых картинок: проверяются по заголовку до декодирования.
+# Картинки больше IMAGE_STORE_MAX_SIDE уменьшаются в фоне после загрузки.
+IMAGE_ALLOWED_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+IMAGE_MAX_BYTES = UPLOAD_MAX_SIZE
+IMAGE_MAX_SIDE = 10000
+IMAGE_MAX_PIXELS = 40 * 10 ** 6
+IMAGE_MAX_FRAMES = 200
+IMAGE_STORE_MAX_SIDE = 2560
 
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
+
+# Миниатюры постов создаются в фоновом пуле сразу после загрузки.
+POST_THUMBNAILS = (
+    ('900x400', {'crop': 'center', 'upscale': True}),
+)
+THUMBNAIL_WORKERS = 2
+# Шардирование по автору: посты, комментарии к ним, подписки на автора
+# и записи лент живут в одной из баз POST_SHARDS, а карта шардов,
+# пользователи и группы — в default. 0 — всё в default.
+POST_SHARD_COUNT = 0
+POST_SHARDS = tuple(
+    f'shard_{number}' for number in range(1, POST_SHARD_COUNT + 1)
+)
+for alias in POST_SHARDS:
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, f'db_{alias}.sqlite3'),
+    }
+# Сколько шардов лента опрашивает параллельно; 0 — по очереди.
+SHARD_WORKERS = 8
+# Холодный архив: команда archive_posts переносит посты старше
+# POST_ARCHIVE_AFTER_DAYS вместе с комментариями пачками по
+# POST_ARCHIVE_BATCH_SIZE. 'default' — архивные таблицы в основной базе,
+# 'archive' — отдельная db_archive.sqlite3.
+POST_ARCHIVE_DATABASE = 'default'
+POST_ARCHIVE_AFTER_DAYS = 365
+POST_ARCHIVE_BATCH_SIZE = 500
+if POST_ARCHIVE_DATABASE != 'default':
+    DATABASES[POST_ARCHIVE_DATABASE] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, f'db_{POST_ARCHIVE_DATABASE}.sqlite3'),
+    }
+# Адаптивные варианты картинки для srcset: ширины и пропорции кадра.
+POST_IMAGE_VARIANT_WIDTHS = (320, 640, 900)
+POST_IMAGE_VARIANT_RATIO = (900, 400)
+# Ширина размытой заглушки, которая встраивается в карточку data URI.
+POST_IMAGE_PLACEHOLDER_WIDTH = 16
+POST_IMAGE_SIZES = '(max-width: 900px) 100vw, 900px'
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+# Базы, которые тесты включают через override_settings(POST_SHARDS=...)
+# и override_settings(POST_ARCHIVE_DATABASE='archive').
+TEST_DATABASES = ('shard_1', 'shard_2', 'archive')
+# Фоновый поток не должен писать в базу и MEDIA_ROOT, пока тест их
+# очищает, а поток шарда не видит данных из транзакции теста.
+TEST_SETTINGS = {
+    'THUMBNAIL_WORKERS': 0,
+    'SHARD_WORKERS': 0,
+    'FEED_WORKERS': 0,
+}
+
+
+class TestRunner(DiscoverRunner):
+    """DiscoverRunner с тестовыми настройками: рабочие настройки
+    от способа запуска не зависят."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        # connections читает этот же словарь: новые алиасы видны ему
+        # до создания тестовых баз.
+        for alias in TEST_DATABASES:
+            settings.DATABASES.setdefault(alias, {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': ':memory:',
+            })
+        self.test_settings = override_settings(**TEST_SETTINGS)
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)